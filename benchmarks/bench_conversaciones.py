@@ -0,0 +1,334 @@
+"""
+Benchmark de extremo a extremo sin servicios externos.
+
+Reproduce transcripciones de conversaciones contra `process_turn` con clientes
+falsos (modelo guionado, Sheets, DynamoDB, Twilio, embeddings y Pinecone en
+memoria) que simulan la latencia de cada servicio, y reporta:
+
+- p50/p95/p99 por turno, hasta el primer mensaje y hasta la respuesta completa;
+- p50/p95/p99 y llamadas por turno de cada componente externo y de los nodos del grafo;
+- memoria asignada por turno (tracemalloc, en una pasada aparte).
+
+    python benchmarks/bench_conversaciones.py --concurrencia 16 --repeticiones 8
+    python benchmarks/bench_conversaciones.py --json actual.json --base main.json
+
+Con `--base` compara el p95 de extremo a extremo con un resultado anterior y
+termina con error si empeora más que `--tolerancia`.
+
+Formato de las transcripciones (JSON, una lista de conversaciones):
+
+    [{"nombre": "...", "turnos": [{"usuario": "...", "guion": [
+        {"herramientas": [{"name": "consultar_disponibilidad", "args": {"fecha_inicio": "{fecha+3}"}}]},
+        {"respuesta": "..."}]}]}]
+
+`{fecha+N}` se reemplaza por la fecha ISO N días después de hoy (el lunes si cae
+en domingo), `{fecha+N:dmy}` por la misma fecha en DD/MM/YYYY y `{codigo:N}` por
+el código de una de las citas iniciales de la hoja, distinta en cada repetición.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from collections import Counter
+from functools import wraps
+import threading
+import tracemalloc
+import argparse
+import tempfile
+import logging
+import glob
+import json
+import time
+import sys
+import re
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_temporal = tempfile.mkdtemp()
+os.environ.setdefault("SHEET_ID", "benchmark")
+os.environ.setdefault("GPT_MODEL", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ["JOURNAL_PATH"] = os.path.join(_temporal, "journal.sqlite")
+os.environ["CHECKPOINT_SPILL_PATH"] = os.path.join(_temporal, "checkpoints.sqlite")
+os.environ["WORKER_POOL_SIZE"] = "0"
+# El límite por número de Twilio mediría la política de envío, no el servicio
+os.environ.setdefault("TWILIO_PER_NUMBER_RATE", "0")
+
+from benchmarks.fakes import EntornoFalso, guion_turno  # noqa: E402
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+CODIGOS_POR_REPETICION = 20
+MENSAJE_ERROR = "Lo siento, ha ocurrido un error."
+METRICAS_TURNO = ("turno", "primer_mensaje", "respuesta_completa")
+
+DOCUMENTOS = [
+    "Spark es una empresa colombiana que desarrolla soluciones de inteligencia artificial.",
+    "Spark implementa plataformas IoT con sensores para monitoreo industrial y agrícola.",
+    "Los asistentes conversacionales de Spark atienden clientes por WhatsApp.",
+    "Spark ofrece consultoría en analítica de datos y automatización de procesos.",
+]
+
+
+def fecha_habil(dias: int) -> date:
+    fecha = date.today() + timedelta(days=dias)
+    return fecha + timedelta(days=1) if fecha.weekday() == 6 else fecha
+
+
+def citas_iniciales(cantidad: int) -> list:
+    """Citas repartidas en los próximos días hábiles, una por horario."""
+    filas = []
+    horas = [f"{hora:02d}:00:00" for hora in range(8, 18)]
+    dia = 1
+    while len(filas) < cantidad:
+        fecha = fecha_habil(dia)
+        if fecha.weekday() != 6:
+            for hora in horas[: cantidad - len(filas)]:
+                n = len(filas)
+                filas.append([f"BEN-{n:08x}", f"Paciente {n}", f"paciente{n}@example.com", fecha.strftime("%d/%m/%Y"), hora, "virtual"])
+        dia += 1
+    return filas
+
+
+def expandir(texto: str, repeticion: int, total_citas: int) -> str:
+    def fecha(match):
+        valor = fecha_habil(int(match.group(1)))
+        return valor.strftime("%d/%m/%Y") if match.group(2) else valor.isoformat()
+
+    def codigo(match):
+        n = (repeticion * CODIGOS_POR_REPETICION + int(match.group(1))) % max(total_citas, 1)
+        return f"BEN-{n:08x}"
+
+    texto = re.sub(r"\{fecha\+(\d+)(:dmy)?\}", fecha, texto)
+    return re.sub(r"\{codigo:(\d+)\}", codigo, texto)
+
+
+def cargar_transcripciones(rutas: list, repeticiones: int, total_citas: int) -> list:
+    """Lista de (número de WhatsApp, nombre, turnos) con las variables reemplazadas."""
+    originales = []
+    for ruta in rutas:
+        with open(ruta, encoding="utf-8") as f:
+            originales.extend(json.load(f))
+    conversaciones = []
+    for repeticion in range(repeticiones):
+        for n, conversacion in enumerate(originales):
+            turnos = json.loads(expandir(json.dumps(conversacion["turnos"], ensure_ascii=False), repeticion, total_citas))
+            numero = f"+57300{repeticion:03d}{n:04d}"
+            conversaciones.append((numero, conversacion.get("nombre", str(n)), turnos))
+    return conversaciones
+
+
+class Banco:
+    """Ejecuta las conversaciones sobre el entorno falso y mide cada turno."""
+
+    def __init__(self, entorno: EntornoFalso):
+        import lambda_function
+
+        self.entorno = entorno
+        self.medidor = entorno.medidor
+        self.lambda_function = lambda_function
+        self.despachador = lambda_function.get_despachador()
+        self._lock = threading.Lock()
+        self.encolados = Counter()
+        self.errores = 0
+        self.turnos = 0
+        self._instrumentar()
+
+    def _instrumentar(self) -> None:
+        """Cuenta los mensajes encolados por número y mide los nodos del grafo y cada herramienta."""
+        from tool_node import NodoHerramientas
+        import graph
+
+        enviar = self.despachador.enviar
+
+        def enviar_contando(to_number, body_text, media_url=None):
+            with self._lock:
+                self.encolados[to_number] += 1
+                self.errores += body_text == MENSAJE_ERROR
+            enviar(to_number, body_text, media_url=media_url)
+
+        self.despachador.enviar = enviar_contando
+        graph.Assistant.__call__ = self._medido("asistente", graph.Assistant.__call__)
+        NodoHerramientas.invocar = self._medido("herramientas", NodoHerramientas.invocar)
+        for herramienta in graph.tools:
+            herramienta.func = self._medido(f"herramienta:{herramienta.name}", herramienta.func)
+
+    def _medido(self, componente: str, funcion):
+        medidor = self.medidor
+
+        # wraps conserva la firma: LangGraph la inspecciona para decidir si pasa `config`
+        @wraps(funcion)
+        def medida(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                medidor.registrar(componente, time.perf_counter() - inicio)
+
+        return medida
+
+    def conversacion(self, numero: str, turnos: list) -> None:
+        for turno in turnos:
+            with self._lock:
+                previos = self.encolados[numero]
+            token = guion_turno.set(turno.get("guion"))
+            inicio = time.perf_counter()
+            try:
+                self.lambda_function.process_turn(numero, turno["usuario"])
+            finally:
+                guion_turno.reset(token)
+            self.medidor.registrar("turno", time.perf_counter() - inicio)
+            with self._lock:
+                encolados = self.encolados[numero]
+                self.turnos += 1
+            # El usuario escribe el siguiente mensaje cuando recibió toda la respuesta
+            envios = self.entorno.twilio.esperar(numero, encolados)[previos:encolados]
+            if envios:
+                self.medidor.registrar("primer_mensaje", envios[0] - inicio)
+                self.medidor.registrar("respuesta_completa", envios[-1] - inicio)
+
+    def ejecutar(self, conversaciones: list, concurrencia: int) -> float:
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(concurrencia) as pool:
+            for futuro in [pool.submit(self.conversacion, numero, turnos) for numero, _, turnos in conversaciones]:
+                futuro.result()
+        return time.perf_counter() - inicio
+
+
+def memoria_por_turno(banco: Banco, conversaciones: list) -> dict:
+    """Memoria asignada por turno, medida con tracemalloc en una pasada secuencial aparte."""
+    turnos = sum(len(turnos) for _, _, turnos in conversaciones)
+    tracemalloc.start(10)
+    antes = tracemalloc.take_snapshot()
+    for numero, _, turnos_conversacion in conversaciones:
+        banco.conversacion(numero, turnos_conversacion)
+    despues = tracemalloc.take_snapshot()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    diferencias = despues.compare_to(antes, "lineno")
+    retenida = sum(diferencia.size_diff for diferencia in diferencias)
+    return {
+        "turnos": turnos,
+        "retenida_kb_por_turno": round(retenida / 1024 / max(turnos, 1), 1),
+        "pico_mb": round(pico / 1024 / 1024, 1),
+        "principales": [
+            f"{diferencia.traceback[0].filename.split(os.sep)[-1]}:{diferencia.traceback[0].lineno} "
+            f"{diferencia.size_diff / 1024:+.1f} KB"
+            for diferencia in diferencias[:5]
+        ],
+    }
+
+
+def reporte(banco: Banco, duracion: float, memoria: dict = None) -> dict:
+    medidor = banco.medidor
+    llamadas = medidor.llamadas()
+    componentes = {}
+    for componente in sorted(llamadas):
+        if componente in METRICAS_TURNO:
+            continue
+        componentes[componente] = {
+            **medidor.percentiles(componente),
+            "por_turno": round(llamadas[componente] / max(banco.turnos, 1), 2),
+        }
+    return {
+        "turnos": banco.turnos,
+        "errores": banco.errores,
+        "duracion_s": round(duracion, 2),
+        "turnos_por_segundo": round(banco.turnos / duracion, 1) if duracion else None,
+        "extremo_a_extremo": {metrica: medidor.percentiles(metrica) for metrica in METRICAS_TURNO},
+        "componentes": componentes,
+        "ruta_rapida": banco.lambda_function.get_ruta_rapida().estadisticas(),
+        "diario_citas": banco.lambda_function.get_diario().estadisticas(),
+        "memoria": memoria,
+    }
+
+
+def imprimir(resultado: dict) -> None:
+    print(f"\n{resultado['turnos']} turnos en {resultado['duracion_s']} s "
+          f"({resultado['turnos_por_segundo']} turnos/s), errores: {resultado['errores']}")
+    print(f"\n{'métrica':<42}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'/turno':>8}")
+    filas = [(metrica, valores, None) for metrica, valores in resultado["extremo_a_extremo"].items()]
+    filas += [(componente, valores, valores["por_turno"]) for componente, valores in resultado["componentes"].items()]
+    for nombre, valores, por_turno in filas:
+        if not valores.get("n"):
+            continue
+        print(f"{nombre:<42}{valores['n']:>7}{valores['p50']:>9}{valores['p95']:>9}{valores['p99']:>9}"
+              f"{valores['max']:>9}{por_turno if por_turno is not None else '':>8}")
+    print("(milisegundos)")
+    memoria = resultado.get("memoria")
+    if memoria:
+        print(f"\nMemoria: {memoria['retenida_kb_por_turno']} KB retenidos por turno, pico {memoria['pico_mb']} MB")
+        for linea in memoria["principales"]:
+            print(f"  {linea}")
+
+
+def comparar(resultado: dict, base: dict, tolerancia: float) -> list:
+    """Métricas de extremo a extremo cuyo p95 empeoró más que la tolerancia respecto de la base."""
+    regresiones = []
+    for metrica in METRICAS_TURNO:
+        actual = resultado["extremo_a_extremo"].get(metrica, {}).get("p95")
+        anterior = base.get("extremo_a_extremo", {}).get(metrica, {}).get("p95")
+        if actual and anterior and actual > anterior * (1 + tolerancia):
+            regresiones.append(f"{metrica}: p95 {anterior} ms -> {actual} ms")
+    return regresiones
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcripciones", nargs="+", default=sorted(glob.glob(os.path.join(DIRECTORIO, "transcripciones", "*.json"))))
+    parser.add_argument("--concurrencia", type=int, default=8, help="Conversaciones simultáneas")
+    parser.add_argument("--repeticiones", type=int, default=4, help="Copias de cada conversación, con números distintos")
+    parser.add_argument("--citas-iniciales", type=int, default=500)
+    parser.add_argument("--latencia-openai-ms", type=float, default=400.0, help="Hasta el primer token")
+    parser.add_argument("--latencia-token-ms", type=float, default=5.0)
+    parser.add_argument("--latencia-embeddings-ms", type=float, default=60.0)
+    parser.add_argument("--latencia-pinecone-ms", type=float, default=50.0)
+    parser.add_argument("--latencia-sheets-ms", type=float, default=150.0)
+    parser.add_argument("--latencia-dynamodb-ms", type=float, default=10.0)
+    parser.add_argument("--latencia-twilio-ms", type=float, default=120.0)
+    parser.add_argument("--sin-memoria", action="store_true", help="Omite la pasada con tracemalloc")
+    parser.add_argument("--json", help="Guarda el resultado en este archivo")
+    parser.add_argument("--base", help="Resultado anterior (--json) con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Aumento máximo del p95 respecto de la base")
+    parser.add_argument("--verbose", action="store_true", help="Mantiene los logs INFO del servicio")
+    args = parser.parse_args()
+
+    latencias = {
+        nombre: getattr(args, f"latencia_{nombre}_ms") / 1000
+        for nombre in ("openai", "token", "embeddings", "pinecone", "sheets", "dynamodb", "twilio")
+    }
+    entorno = EntornoFalso(latencias, citas_iniciales(args.citas_iniciales), DOCUMENTOS)
+    entorno.instalar()
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        for nombre in list(logging.root.manager.loggerDict):
+            logging.getLogger(nombre).setLevel(logging.WARNING)
+
+    banco = Banco(entorno)
+    conversaciones = cargar_transcripciones(args.transcripciones, args.repeticiones, args.citas_iniciales)
+    print(f"{len(conversaciones)} conversaciones de {len(args.transcripciones)} transcripciones, concurrencia {args.concurrencia}")
+
+    # Calentamiento: importa y construye el grafo fuera de la medición
+    banco.lambda_function.get_graph()
+    duracion = banco.ejecutar(conversaciones, args.concurrencia)
+    resultado = reporte(banco, duracion)
+
+    if not args.sin_memoria:
+        muestra = cargar_transcripciones(args.transcripciones, 1, args.citas_iniciales)
+        muestra = [(f"+57399{numero[-7:]}", nombre, turnos) for numero, nombre, turnos in muestra]
+        resultado["memoria"] = memoria_por_turno(banco, muestra)
+
+    banco.despachador.esperar_envios()
+    banco.lambda_function.get_diario().vaciar()
+    imprimir(resultado)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    if args.base:
+        with open(args.base, encoding="utf-8") as f:
+            regresiones = comparar(resultado, json.load(f), args.tolerancia)
+        if regresiones:
+            raise SystemExit("Regresiones de latencia:\n  " + "\n  ".join(regresiones))
+        print(f"\nSin regresiones respecto de {args.base} (tolerancia {args.tolerancia:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""
+Clientes falsos para los benchmarks: reproducen en memoria la parte de las APIs
+externas que usa el servicio (Google Sheets, DynamoDB, Twilio, Pinecone y los
+modelos de OpenAI), con latencia configurable. Cada llamada se registra en un
+`Medidor` con el nombre del componente.
+"""
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.documents import Document
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+import numpy as np
+import threading
+import hashlib
+import asyncio
+import json
+import time
+import uuid
+import re
+
+
+ENCABEZADOS = ["Codigo", "Nombre", "Correo", "Fecha", "Hora", "Modalidad"]
+
+
+class Medidor:
+    """Duraciones por componente (segundos) y contadores de llamadas, seguro entre hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.duraciones: Dict[str, List[float]] = defaultdict(list)
+
+    def registrar(self, componente: str, segundos: float) -> None:
+        with self._lock:
+            self.duraciones[componente].append(segundos)
+
+    def llamadas(self) -> Dict[str, int]:
+        with self._lock:
+            return {componente: len(valores) for componente, valores in self.duraciones.items()}
+
+    def percentiles(self, componente: str) -> Dict[str, float]:
+        """p50/p95/p99 y máximo en milisegundos."""
+        with self._lock:
+            valores = np.array(self.duraciones.get(componente, []))
+        if not len(valores):
+            return {}
+        p50, p95, p99 = np.percentile(valores, [50, 95, 99]) * 1000
+        return {"n": len(valores), "p50": round(p50, 1), "p95": round(p95, 1), "p99": round(p99, 1), "max": round(valores.max() * 1000, 1)}
+
+    def reiniciar(self) -> None:
+        with self._lock:
+            self.duraciones.clear()
+
+
+class _Medicion:
+    def __init__(self, medidor: Optional[Medidor], componente: str):
+        self.medidor = medidor
+        self.componente = componente
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.medidor is not None:
+            self.medidor.registrar(self.componente, time.perf_counter() - self.inicio)
+
+
+def _medir(medidor: Optional[Medidor], componente: str) -> _Medicion:
+    return _Medicion(medidor, componente)
+
+
+class _Request:
+    def __init__(self, ejecutar, latencia: float, medidor: Optional[Medidor] = None, componente: str = "sheets"):
+        self._ejecutar = ejecutar
+        self._latencia = latencia
+        self._medidor = medidor
+        self._componente = componente
+
+    def execute(self):
+        with _medir(self._medidor, self._componente):
+            if self._latencia:
+                time.sleep(self._latencia)
+            return self._ejecutar()
+
+
+class HojaFalsa:
+    """Recurso `spreadsheets()` en memoria: `values().get` y `batchUpdate`."""
+
+    def __init__(self, filas: List[List[str]] = None, latencia: float = 0.0, medidor: Optional[Medidor] = None):
+        self.filas = [list(ENCABEZADOS)] + [list(fila) for fila in filas or []]
+        self.latencia = latencia
+        self.medidor = medidor
+        self.llamadas = {"get": 0, "batchUpdate": 0}
+        self._lock = threading.Lock()
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId: str, range: str):
+        self.llamadas["get"] += 1
+        match = re.match(r"A(\d+):Z", range)
+        inicio = int(match.group(1)) - 1 if match else 0
+
+        def ejecutar():
+            with self._lock:
+                if range == "A:A":
+                    return {"values": [[fila[0]] if fila else [] for fila in self.filas]}
+                return {"values": [list(fila) for fila in self.filas[inicio:]]}
+
+        return _Request(ejecutar, self.latencia, self.medidor)
+
+    def batchUpdate(self, spreadsheetId: str, body: dict):
+        self.llamadas["batchUpdate"] += 1
+
+        def ejecutar():
+            with self._lock:
+                for request in body["requests"]:
+                    if "updateCells" in request:
+                        fila = request["updateCells"]["range"]["startRowIndex"]
+                        self.filas[fila] = _valores(request["updateCells"]["rows"][0])
+                    elif "deleteDimension" in request:
+                        del self.filas[request["deleteDimension"]["range"]["startIndex"]]
+                    elif "appendCells" in request:
+                        self.filas.extend(_valores(row) for row in request["appendCells"]["rows"])
+            return {}
+
+        return _Request(ejecutar, self.latencia, self.medidor)
+
+
+def _valores(row: dict) -> List[str]:
+    return [celda["userEnteredValue"]["stringValue"] for celda in row["values"]]
+
+
+class ServicioFalso:
+    """Sustituto de `get_google_sheets_service()`."""
+
+    def __init__(self, hoja: HojaFalsa):
+        self.hoja = hoja
+
+    def spreadsheets(self) -> HojaFalsa:
+        return self.hoja
+
+
+class TablaDynamoFalsa:
+    """
+    Tabla de DynamoDB en memoria (recurso `Table` de boto3) con clave (partición, orden).
+
+    Cubre `get_item`, `put_item`, `update_item` con `set`, `delete_item` y
+    `query` con las condiciones de `boto3.dynamodb.conditions.Key`. Las
+    `ConditionExpression` no se evalúan.
+    """
+
+    def __init__(self, claves=("PhoneNumber", "Date"), latencia: float = 0.0, medidor: Optional[Medidor] = None):
+        self.claves = claves
+        self.latencia = latencia
+        self.medidor = medidor
+        self.items: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+
+    def _llamada(self):
+        medicion = _medir(self.medidor, "dynamodb")
+        medicion.__enter__()
+        if self.latencia:
+            time.sleep(self.latencia)
+        return medicion
+
+    def _clave(self, item: dict) -> tuple:
+        return tuple(item.get(nombre) for nombre in self.claves)
+
+    def get_item(self, Key: dict, **kwargs) -> dict:
+        with self._llamada(), self._lock:
+            item = self.items.get(self._clave(Key))
+            return {"Item": _copia(item)} if item is not None else {}
+
+    def put_item(self, Item: dict, **kwargs) -> dict:
+        with self._llamada(), self._lock:
+            self.items[self._clave(Item)] = _copia(Item)
+        return {}
+
+    def update_item(self, Key: dict, UpdateExpression: str, ExpressionAttributeValues: dict, ExpressionAttributeNames: dict = None, **kwargs) -> dict:
+        nombres = ExpressionAttributeNames or {}
+        with self._llamada(), self._lock:
+            item = self.items.setdefault(self._clave(Key), _copia(Key))
+            for asignacion in re.sub(r"^\s*set\s+", "", UpdateExpression, flags=re.IGNORECASE).split(","):
+                atributo, valor = (parte.strip() for parte in asignacion.split("="))
+                item[nombres.get(atributo, atributo)] = _copia(ExpressionAttributeValues[valor])
+        return {}
+
+    def delete_item(self, Key: dict, **kwargs) -> dict:
+        with self._llamada(), self._lock:
+            self.items.pop(self._clave(Key), None)
+        return {}
+
+    def query(self, KeyConditionExpression, ScanIndexForward: bool = True, Limit: int = None, **kwargs) -> dict:
+        with self._llamada(), self._lock:
+            items = [item for item in self.items.values() if _cumple(KeyConditionExpression, item)]
+        items.sort(key=lambda item: item.get(self.claves[1]), reverse=not ScanIndexForward)
+        return {"Items": [_copia(item) for item in items[:Limit]]}
+
+
+def _copia(valor):
+    return json.loads(json.dumps(valor)) if valor is not None else None
+
+
+def _cumple(condicion, item: dict) -> bool:
+    expresion = condicion.get_expression()
+    operador, valores = expresion["operator"], expresion["values"]
+    if operador == "AND":
+        return all(_cumple(valor, item) for valor in valores)
+    actual = item.get(valores[0].name)
+    if actual is None:
+        return False
+    if operador == "=":
+        return actual == valores[1]
+    if operador == "BETWEEN":
+        return valores[1] <= actual <= valores[2]
+    if operador == "begins_with":
+        return str(actual).startswith(valores[1])
+    comparaciones = {"<": actual.__lt__, "<=": actual.__le__, ">": actual.__gt__, ">=": actual.__ge__}
+    return comparaciones[operador](valores[1])
+
+
+class TwilioFalso:
+    """Cliente de Twilio que guarda los mensajes enviados en lugar de enviarlos."""
+
+    def __init__(self, latencia: float = 0.0, medidor: Optional[Medidor] = None):
+        self.latencia = latencia
+        self.medidor = medidor
+        self.messages = self
+        self.envios: Dict[str, List[float]] = defaultdict(list)
+        self._cambio = threading.Condition()
+
+    def create(self, to: str, body: str = "", from_: str = None, media_url: List[str] = None):
+        with _medir(self.medidor, "twilio"):
+            if self.latencia:
+                time.sleep(self.latencia)
+        numero = to.replace("whatsapp:", "")
+        with self._cambio:
+            self.envios[numero].append(time.perf_counter())
+            self._cambio.notify_all()
+        return _MensajeTwilio(uuid.uuid4().hex, body)
+
+    def esperar(self, numero: str, cantidad: int, timeout: float = 60.0) -> List[float]:
+        """Espera a que el número haya recibido `cantidad` mensajes y devuelve sus instantes de envío."""
+        with self._cambio:
+            self._cambio.wait_for(lambda: len(self.envios[numero]) >= cantidad, timeout)
+            return list(self.envios[numero])
+
+
+class _MensajeTwilio:
+    def __init__(self, sid: str, body: str):
+        self.sid = sid
+        self.body = body
+
+
+DIMENSION_EMBEDDINGS = 64
+
+
+class EmbeddingsFalsos:
+    """Embeddings deterministas: el mismo texto siempre produce el mismo vector unitario."""
+
+    def __init__(self, latencia: float = 0.0, medidor: Optional[Medidor] = None):
+        self.latencia = latencia
+        self.medidor = medidor
+
+    def _vector(self, texto: str) -> List[float]:
+        semilla = int.from_bytes(hashlib.sha256(texto.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(semilla).standard_normal(DIMENSION_EMBEDDINGS)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_query(self, texto: str) -> List[float]:
+        with _medir(self.medidor, "embeddings"):
+            if self.latencia:
+                time.sleep(self.latencia)
+            return self._vector(texto)
+
+    def embed_documents(self, textos: List[str]) -> List[List[float]]:
+        with _medir(self.medidor, "embeddings"):
+            if self.latencia:
+                time.sleep(self.latencia)
+            return [self._vector(texto) for texto in textos]
+
+    async def aembed_query(self, texto: str) -> List[float]:
+        with _medir(self.medidor, "embeddings"):
+            if self.latencia:
+                await asyncio.sleep(self.latencia)
+            return self._vector(texto)
+
+
+class VectorStoreFalso:
+    """Sustituto del `PineconeVectorStore`: búsqueda exacta por producto punto sobre documentos en memoria."""
+
+    def __init__(self, textos: List[str], embeddings: EmbeddingsFalsos, latencia: float = 0.0, medidor: Optional[Medidor] = None):
+        self.documentos = [Document(page_content=texto) for texto in textos]
+        self.matriz = np.array(embeddings.embed_documents(textos)) if textos else np.zeros((0, DIMENSION_EMBEDDINGS))
+        self.latencia = latencia
+        self.medidor = medidor
+        self.index = self
+
+    def describe_index_stats(self):
+        return _Estadisticas({"": _Namespace(len(self.documentos))})
+
+    def fetch(self, ids: List[str], namespace: str = ""):
+        # Sin versión publicada por ingest.py: se usa la cantidad de vectores
+        return _Registros({})
+
+    def _buscar(self, embedding: List[float], k: int) -> List[Document]:
+        puntajes = self.matriz @ np.asarray(embedding)
+        return [self.documentos[i] for i in np.argsort(-puntajes)[:k]]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs) -> List[Document]:
+        with _medir(self.medidor, "pinecone"):
+            if self.latencia:
+                time.sleep(self.latencia)
+            return self._buscar(embedding, k)
+
+    async def asimilarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs) -> List[Document]:
+        with _medir(self.medidor, "pinecone"):
+            if self.latencia:
+                await asyncio.sleep(self.latencia)
+            return self._buscar(embedding, k)
+
+
+class _Estadisticas:
+    def __init__(self, namespaces: dict):
+        self.namespaces = namespaces
+
+
+class _Registros:
+    def __init__(self, vectors: dict):
+        self.vectors = vectors
+
+
+class _Namespace:
+    def __init__(self, vector_count: int):
+        self.vector_count = vector_count
+
+
+# Guion del turno en curso: lista de pasos que el modelo guionado devuelve en orden
+guion_turno: ContextVar[Optional[List[dict]]] = ContextVar("guion_turno", default=None)
+
+
+class ModeloGuionado(BaseChatModel):
+    """
+    Modelo de chat que responde según el guion del turno en curso (`guion_turno`).
+
+    Cada paso del guion es `{"herramientas": [{"name": ..., "args": {...}}]}` (el
+    modelo pide esas herramientas) o `{"respuesta": "..."}` (respuesta final). El
+    paso se elige por la cantidad de respuestas del modelo desde el último mensaje
+    del usuario. Sin guion responde `respuesta_por_defecto`.
+
+    Simula la latencia hasta el primer token y entre tokens, y también emite los
+    tokens por streaming.
+    """
+
+    latencia: float = 0.0
+    latencia_token: float = 0.0
+    usar_guion: bool = True
+    respuesta_por_defecto: str = "Con gusto te ayudo."
+    medidor: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "guionado"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _siguiente(self, messages) -> AIMessage:
+        guion = guion_turno.get() if self.usar_guion else None
+        if not guion:
+            return AIMessage(content=self.respuesta_por_defecto)
+        ultimo_usuario = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=-1)
+        paso = sum(isinstance(message, AIMessage) for message in messages[ultimo_usuario + 1:])
+        paso = guion[min(paso, len(guion) - 1)]
+        if "herramientas" in paso:
+            tool_calls = [
+                {"name": llamada["name"], "args": llamada.get("args", {}), "id": f"call_{uuid.uuid4().hex[:12]}"}
+                for llamada in paso["herramientas"]
+            ]
+            return AIMessage(content=paso.get("texto", ""), tool_calls=tool_calls)
+        return AIMessage(content=paso["respuesta"])
+
+    @staticmethod
+    def _tokens(texto: str) -> List[str]:
+        return re.findall(r"\S+\s*|\s+", texto)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        with _medir(self.medidor, "openai"):
+            message = self._siguiente(messages)
+            time.sleep(self.latencia + self.latencia_token * len(self._tokens(message.content)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        with _medir(self.medidor, "openai"):
+            message = self._siguiente(messages)
+            time.sleep(self.latencia)
+            for token in self._tokens(message.content):
+                time.sleep(self.latencia_token)
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+                if run_manager:
+                    run_manager.on_llm_new_token(token, chunk=chunk)
+                yield chunk
+            for indice, tool_call in enumerate(message.tool_calls):
+                chunk = ChatGenerationChunk(message=AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[{"name": tool_call["name"], "args": json.dumps(tool_call["args"]), "id": tool_call["id"], "index": indice}],
+                ))
+                if run_manager:
+                    run_manager.on_llm_new_token("", chunk=chunk)
+                yield chunk
+
+
+PROMPT_BENCHMARK = "Eres el asistente de citas de Spark. Fecha y hora actual: {time}."
+
+
+class EntornoFalso:
+    """
+    Reemplaza los clientes externos del servicio por los falsos de este módulo.
+
+    Las variables de entorno que leen los módulos al importarse (SHEET_ID,
+    JOURNAL_PATH, etc.) deben definirse antes de llamar a `instalar`.
+
+    Args:
+        latencias (Dict[str, float]): Segundos por llamada para "openai", "token",
+            "embeddings", "pinecone", "sheets", "dynamodb" y "twilio".
+        filas (List[List[str]]): Citas iniciales de la hoja.
+        documentos (List[str]): Textos de la base de conocimiento.
+    """
+
+    def __init__(self, latencias: Dict[str, float], filas: List[List[str]] = None, documentos: List[str] = None):
+        self.medidor = Medidor()
+        self.hoja = HojaFalsa(filas, latencias.get("sheets", 0.0), self.medidor)
+        self.historial = TablaDynamoFalsa(latencia=latencias.get("dynamodb", 0.0), medidor=self.medidor)
+        self.twilio = TwilioFalso(latencias.get("twilio", 0.0), self.medidor)
+        self.embeddings = EmbeddingsFalsos(latencias.get("embeddings", 0.0), self.medidor)
+        self.vectorstore = VectorStoreFalso(documentos or [], self.embeddings, latencias.get("pinecone", 0.0), self.medidor)
+        modelo = dict(latencia=latencias.get("openai", 0.0), latencia_token=latencias.get("token", 0.0), medidor=self.medidor)
+        self.modelo = ModeloGuionado(**modelo)
+        self.modelo_auxiliar = ModeloGuionado(usar_guion=False, respuesta_por_defecto="Resumen de la conversación.", **modelo)
+
+    def instalar(self) -> None:
+        import lambda_function
+        import utils
+        import tools
+
+        servicio = ServicioFalso(self.hoja)
+        utils.get_google_sheets_service = tools.get_google_sheets_service = lambda: servicio
+        utils.get_twilio_client = lambda: self.twilio
+        utils.get_prompts = lambda: PROMPT_BENCHMARK
+        tools.get_embeddings = lambda: self.embeddings
+        tools.get_vectorstore = lambda: self.vectorstore
+        tools.get_llm_consulta = lambda: self.modelo_auxiliar
+        lambda_function.get_history_table = lambda: self.historial
+        lambda_function.get_summary_llm = lambda: self.modelo_auxiliar
+
+        import graph
+
+        graph.get_prompts = utils.get_prompts
+        graph.llm = self.modelo
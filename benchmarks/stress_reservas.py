@@ -0,0 +1,169 @@
+"""
+Prueba de estrés de las reservas por horario.
+
+Lanza muchas reservas concurrentes con `write_to_sheet_with_validation` contra
+una hoja en memoria y verifica que ningún horario quede con dos citas. Después
+mide cuánto tardan reservas de horarios distintos con reservas por horario y
+con un único lock global, simulando la latencia de registrar cada cita. También
+verifica que mover una cita con `modify_sheet` a un horario ocupado, o agendar
+una que se cruce con otra, se rechace:
+
+    python benchmarks/stress_reservas.py --hilos 64 --intentos 2000
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from datetime import date, timedelta
+import threading
+import argparse
+import tempfile
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SHEET_ID", "benchmark")
+os.environ["JOURNAL_PATH"] = os.path.join(tempfile.mkdtemp(), "journal.sqlite")
+os.environ["JOURNAL_FLUSH_SECONDS"] = "3600"
+
+from benchmarks.fakes import HojaFalsa, ServicioFalso  # noqa: E402
+import calendario  # noqa: E402
+import sheet_journal  # noqa: E402
+import tools  # noqa: E402
+import utils  # noqa: E402
+
+
+def proximos_lunes(cantidad: int):
+    dia = date.today() + timedelta(days=1)
+    while dia.weekday() != 0:
+        dia += timedelta(days=1)
+    return [dia + timedelta(weeks=n) for n in range(cantidad)]
+
+
+def reservar(fecha: date, hora: str) -> bool:
+    cadena = f"Prueba, prueba@example.com, {fecha.isoformat()}, {hora}, virtual"
+    return tools.write_to_sheet_with_validation.invoke({"cadena": cadena}).startswith("Guardado exitoso")
+
+
+def contencion(hilos: int, intentos: int, horarios: list) -> None:
+    barrera = threading.Barrier(hilos)
+
+    def trabajador(n: int) -> int:
+        barrera.wait()
+        rng = random.Random(n)
+        return sum(reservar(*rng.choice(horarios)) for _ in range(intentos // hilos))
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(hilos) as pool:
+        exitosas = sum(pool.map(trabajador, range(hilos)))
+    duracion = time.perf_counter() - inicio
+
+    sheet_journal.get_diario_citas().vaciar()
+    hoja = utils.get_google_sheets_service().spreadsheets()
+    ocupados = Counter((fila[3], fila[4]) for fila in hoja.filas[1:])
+    dobles = {slot: n for slot, n in ocupados.items() if n > 1}
+
+    print(f"Contención: {intentos} intentos sobre {len(horarios)} horarios con {hilos} hilos en {duracion:.2f} s")
+    print(f"  reservas exitosas: {exitosas}, filas en la hoja: {len(hoja.filas) - 1}, horarios dobles: {len(dobles)}")
+    print(f"  reservas: {tools.get_reservas().estadisticas()}")
+    if dobles or exitosas != len(ocupados):
+        raise SystemExit(f"Reservas dobles detectadas: {dobles}")
+
+
+def contencion_cruzada(hilos: int, fecha: date) -> None:
+    # Horas que no caen en punto y se cruzan entre sí: las reservas por franjas deben serializarlas
+    horas = ["10:00:00", "10:20:00", "10:40:00", "11:00:00", "11:50:00"]
+    barrera = threading.Barrier(hilos)
+
+    def trabajador(n: int) -> int:
+        barrera.wait()
+        return reservar(fecha, horas[n % len(horas)])
+
+    with ThreadPoolExecutor(hilos) as pool:
+        exitosas = sum(pool.map(trabajador, range(hilos)))
+    sheet_journal.get_diario_citas().vaciar()
+    hoja = utils.get_google_sheets_service().spreadsheets()
+    inicios = sorted(int(fila[4][:2]) * 60 + int(fila[4][3:5]) for fila in hoja.filas[1:] if fila[3] == fecha.strftime("%d/%m/%Y"))
+    cruces = [(a, b) for a, b in zip(inicios, inicios[1:]) if b - a < calendario.DURACION_CITA_MINUTOS]
+    print(f"Contención con horas cruzadas: {exitosas} reservas exitosas, inicios {inicios}")
+    if cruces:
+        raise SystemExit(f"Citas que se cruzan: {cruces}")
+
+
+def reagendamiento(fecha: date) -> None:
+    codigos = []
+    for hora in ("09:00:00", "10:00:00"):
+        respuesta = tools.write_to_sheet_with_validation.invoke(
+            {"cadena": f"Prueba, prueba@example.com, {fecha.isoformat()}, {hora}, virtual"}
+        )
+        codigos.append(respuesta.rsplit(" ", 1)[-1])
+
+    # La fecha llega como YYYY-MM-DD (formato del docstring) y la hora sin segundos
+    respuesta = tools.modify_sheet.invoke({"codigo": codigos[0], "fecha": fecha.isoformat(), "hora": "10:00"})
+    print(f"Reagendamiento a un horario ocupado: {respuesta}")
+    if not respuesta.startswith("Horarios ocupados"):
+        raise SystemExit(f"Se movió una cita a un horario ocupado: {respuesta}")
+
+    # Las 10:30 se cruzan con la cita de las 10:00; las 12:30 no se cruzan con ninguna
+    if reservar(fecha, "10:30:00"):
+        raise SystemExit("Se agendó una cita que se cruza con otra")
+    if not reservar(fecha, "12:30:00"):
+        raise SystemExit("No se agendó una cita en un horario libre fuera de la hora en punto")
+
+    respuesta = tools.modify_sheet.invoke({"codigo": codigos[0], "fecha": fecha.isoformat(), "hora": "11:00"})
+    fila = tools.get_diario_citas().cita(codigos[0])
+    if not respuesta.startswith("Cita modificada") or fila[3:5] != [fecha.strftime("%d/%m/%Y"), "11:00:00"]:
+        raise SystemExit(f"La cita no se movió al horario libre: {respuesta} {fila}")
+
+
+def paralelismo(hilos: int, horarios: list, latencia: float) -> None:
+    diario = sheet_journal.get_diario_citas()
+    registrar_alta = diario.registrar_alta
+
+    def registrar_lento(codigo, row):
+        time.sleep(latencia)
+        registrar_alta(codigo, row)
+
+    diario.registrar_alta = registrar_lento
+    global_lock = threading.Lock()
+
+    def con_lock_global(fecha, hora):
+        with global_lock:
+            return reservar(fecha, hora)
+
+    resultados = {}
+    for nombre, funcion, lote in (
+        ("lock global", con_lock_global, horarios[: len(horarios) // 2]),
+        ("reserva por horario", reservar, horarios[len(horarios) // 2:]),
+    ):
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(hilos) as pool:
+            list(pool.map(lambda slot: funcion(*slot), lote))
+        resultados[nombre] = time.perf_counter() - inicio
+        print(f"{nombre:>20}: {len(lote)} reservas de horarios distintos en {resultados[nombre]:.2f} s")
+    diario.registrar_alta = registrar_alta
+    print(f"  aceleración: {resultados['lock global'] / resultados['reserva por horario']:.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hilos", type=int, default=64)
+    parser.add_argument("--intentos", type=int, default=2000)
+    parser.add_argument("--horarios", type=int, default=20, help="Horarios disputados en la prueba de contención")
+    parser.add_argument("--latencia-ms", type=float, default=20.0, help="Latencia simulada al registrar una cita")
+    args = parser.parse_args()
+
+    servicio = ServicioFalso(HojaFalsa())
+    utils.get_google_sheets_service = tools.get_google_sheets_service = lambda: servicio
+
+    horas = [f"{h:02d}:00:00" for h in range(8, 18)]
+    dias = proximos_lunes(12)
+    todos = [(dia, hora) for dia in dias for hora in horas]
+    contencion(args.hilos, args.intentos, todos[: args.horarios])
+    contencion_cruzada(args.hilos, dias[-1] + timedelta(days=2))
+    reagendamiento(dias[-1] + timedelta(days=1))
+    paralelismo(args.hilos, todos[args.horarios:], args.latencia_ms / 1000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+from bisect import bisect_right
+import unicodedata
+import threading
+import logging
+import re
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Horario de atención y duración de cada cita, en hora de Colombia
+HORARIO_INICIO = os.getenv("HORARIO_INICIO", "08:00")
+HORARIO_FIN = os.getenv("HORARIO_FIN", "18:00")
+DURACION_CITA_MINUTOS = int(os.getenv("DURACION_CITA_MINUTOS", "60"))
+# Tamaño de las franjas con las que se reserva el tiempo de una cita mientras se agenda
+RESERVA_FRANJA_MINUTOS = int(os.getenv("RESERVA_FRANJA_MINUTOS", "15"))
+# Días hacia adelante en los que se pueden agendar citas
+HORIZONTE_DIAS = int(os.getenv("CALENDARIO_HORIZONTE_DIAS", "90"))
+# Lunes (0) a sábado (5)
+DIAS_HABILES = frozenset(range(6))
+
+FORMATO_FECHA = "%d/%m/%Y"
+
+
+def minutos(hora: str) -> int:
+    """Convierte una hora 'HH:MM' o 'HH:MM:SS' en minutos desde la medianoche."""
+    partes = hora.strip().split(":")
+    return int(partes[0]) * 60 + int(partes[1])
+
+
+def formatear_hora(minuto: int) -> str:
+    return f"{minuto // 60:02d}:{minuto % 60:02d}:00"
+
+
+def franjas_reserva(hora: str, duracion: int = DURACION_CITA_MINUTOS, franja: int = RESERVA_FRANJA_MINUTOS) -> List[str]:
+    """
+    Franjas del día que ocupa una cita que empieza a `hora`, para reservarlas al agendar.
+
+    Son los inicios (HH:MM:SS) de las franjas de `franja` minutos que tocan el
+    intervalo [hora, hora + duracion). Dos citas que se cruzan comparten al menos
+    un minuto y, por lo tanto, una franja: sus reservas no pueden coincidir.
+    Citas que no se cruzan solo comparten franja si una termina y la otra empieza
+    dentro de la misma.
+    """
+    inicio = minutos(hora)
+    primera = inicio - inicio % franja
+    return [formatear_hora(minuto) for minuto in range(primera, inicio + duracion, franja)]
+
+
+class CalendarioCitas:
+    """
+    Calendario precalculado de los horarios que se pueden agendar.
+
+    Contiene los días hábiles (lunes a sábado) desde mañana hasta `horizonte`
+    días adelante y, para cada uno, el inicio de cada cita en minutos desde la
+    medianoche. Se construye una vez por día; las consultas solo restan las
+    citas ya agendadas.
+    """
+
+    def __init__(self, hoy: date, inicio: str, fin: str, duracion: int, horizonte: int):
+        self.hoy = hoy
+        self.duracion = duracion
+        self.limite = hoy + timedelta(days=horizonte)
+        self.slots = list(range(minutos(inicio), minutos(fin) - duracion + 1, duracion))
+        self.dias = [
+            dia
+            for dia in (hoy + timedelta(days=n) for n in range(1, horizonte + 1))
+            if dia.weekday() in DIAS_HABILES
+        ]
+        self._dias = set(self.dias)
+        # Próxima ocurrencia de cada día de la semana (nunca hoy) y lunes de la semana siguiente
+        self.proximos = {dia_semana: hoy + timedelta(days=(dia_semana - hoy.weekday() - 1) % 7 + 1) for dia_semana in range(7)}
+        self.lunes_siguiente = hoy + timedelta(days=7 - hoy.weekday())
+
+    def validar(self, dia: date) -> Optional[str]:
+        """
+        Verifica si se puede agendar en la fecha indicada.
+
+        Returns:
+            Optional[str]: None si la fecha es válida, o el motivo por el que no lo es.
+        """
+        if dia == self.hoy:
+            return "la fecha ya paso: no se agendan citas para el mismo día"
+        if dia < self.hoy:
+            return "la fecha ya paso"
+        if dia > self.limite:
+            return f"La fecha debe estar dentro de los próximos {HORIZONTE_DIAS} días."
+        if dia not in self._dias:
+            return "La fecha debe ser entre lunes y sabado."
+        return None
+
+    def conflictos(self, hora: str, ocupadas: List[str]) -> List[str]:
+        """
+        Horas de `ocupadas` cuyas citas se cruzan con una cita que empieza a `hora`.
+
+        Es la misma regla de `libres`: dos citas de `duracion` minutos se cruzan si
+        sus inicios están a menos de `duracion` minutos.
+        """
+        inicio = minutos(hora)
+        return [ocupada for ocupada in ocupadas if ocupada and abs(minutos(ocupada) - inicio) < self.duracion]
+
+    def libres(self, dia: date, ocupadas: List[str]) -> List[str]:
+        """
+        Horarios libres de un día, descontando las citas que se cruzan con cada horario.
+
+        Args:
+            dia (date): Día a consultar.
+            ocupadas (List[str]): Horas de inicio de las citas agendadas ese día.
+
+        Returns:
+            List[str]: Horas libres en formato HH:MM:SS, en orden.
+        """
+        if dia not in self._dias:
+            return []
+        inicios = sorted(minutos(hora) for hora in ocupadas if hora)
+        libres = []
+        for slot in self.slots:
+            # Primera cita que empieza después de slot - duracion: si empieza antes de que
+            # termine el slot, los intervalos se cruzan
+            i = bisect_right(inicios, slot - self.duracion)
+            if i < len(inicios) and inicios[i] < slot + self.duracion:
+                continue
+            libres.append(formatear_hora(slot))
+        return libres
+
+    def rango(self, desde: date, hasta: date) -> List[date]:
+        """Días hábiles del calendario entre `desde` y `hasta`, inclusive."""
+        return [dia for dia in self.dias if desde <= dia <= hasta]
+
+
+_calendario: Optional[CalendarioCitas] = None
+_lock = threading.Lock()
+
+
+def get_calendario(hoy: date) -> CalendarioCitas:
+    """Calendario vigente para el día `hoy` (hora de Colombia); se reconstruye al cambiar de día."""
+    global _calendario
+    with _lock:
+        if _calendario is None or _calendario.hoy != hoy:
+            _calendario = CalendarioCitas(hoy, HORARIO_INICIO, HORARIO_FIN, DURACION_CITA_MINUTOS, HORIZONTE_DIAS)
+            logger.info(f"Calendario de citas construido: {len(_calendario.dias)} días, {len(_calendario.slots)} horarios por día")
+        return _calendario
+
+
+def parsear_fecha(fecha: str) -> date:
+    """Acepta fechas 'YYYY-MM-DD' o 'DD/MM/YYYY'."""
+    fecha = fecha.strip()
+    for formato in ("%Y-%m-%d", FORMATO_FECHA):
+        try:
+            return datetime.strptime(fecha, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Fecha no reconocida: {fecha}")
+
+
+def parsear_hora(hora: str) -> str:
+    """Acepta horas 'HH:MM' o 'HH:MM:SS' y las devuelve como se guardan en la hoja ('HH:MM:SS')."""
+    hora = hora.strip()
+    for formato in ("%H:%M:%S", "%H:%M"):
+        try:
+            return datetime.strptime(hora, formato).strftime("%H:%M:%S")
+        except ValueError:
+            continue
+    raise ValueError(f"Hora no reconocida: {hora}")
+
+
+MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+DIAS_SEMANA = {"lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3, "viernes": 4, "sabado": 5, "domingo": 6}
+
+_FECHA_ISO = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_FECHA_NUMERICA = re.compile(r"\b(\d{1,2})[/-](\d{1,2})(?:[/-](\d{4}|\d{2}))?\b")
+_FECHA_TEXTO = re.compile(r"\b(\d{1,2})\s+de\s+(" + "|".join(MESES) + r")(?:\s+(?:de|del)\s+(\d{4}))?\b")
+
+
+def normalizar_texto(texto: str) -> str:
+    """Minúsculas y sin tildes, para reconocer fechas y palabras clave escritas de cualquier forma."""
+    descompuesto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def _completar_anio(hoy: date, mes: int, dia: int, anio: Optional[str]) -> date:
+    if anio:
+        anio = int(anio)
+        return date(anio + 2000 if anio < 100 else anio, mes, dia)
+    fecha = date(hoy.year, mes, dia)
+    # Sin año, una fecha que ya pasó se refiere al año siguiente (igual que validate_date); hoy sigue siendo hoy
+    return fecha if fecha >= hoy else date(hoy.year + 1, mes, dia)
+
+
+def _buscar(texto: str, reglas) -> List[tuple]:
+    """Aplica cada regla en orden sobre el texto normalizado y devuelve (posición, fragmento, fecha)."""
+    encontradas = []
+    for patron, convertir in reglas:
+        for match in patron.finditer(texto):
+            try:
+                fecha = convertir(match)
+            except ValueError:
+                continue
+            if fecha is not None:
+                encontradas.append((match.start(), match.group(0).strip(), fecha))
+        # Se borra lo reconocido para que un patrón más general no lo vuelva a leer
+        texto = patron.sub(lambda m: " " * len(m.group(0)), texto)
+    return sorted(encontradas, key=lambda encontrada: encontrada[0])
+
+
+def _reglas_explicitas(hoy: date) -> list:
+    def convertir(orden):
+        def fecha(match):
+            grupos = dict(zip(orden, match.groups()))
+            mes = MESES.get(grupos["m"]) or int(grupos["m"])
+            return _completar_anio(hoy, mes, int(grupos["d"]), grupos["a"])
+        return fecha
+
+    return [(_FECHA_ISO, convertir("amd")), (_FECHA_TEXTO, convertir("dma")), (_FECHA_NUMERICA, convertir("dma"))]
+
+
+def fechas_en_texto(texto: str, hoy: date) -> List[date]:
+    """
+    Extrae las fechas explícitas de un mensaje en español.
+
+    Reconoce 'YYYY-MM-DD', 'DD/MM', 'DD/MM/YYYY' y '25 de diciembre (de 2025)'.
+    Las fechas que no existen (p. ej. 30/02) se omiten.
+
+    Args:
+        texto (str): Mensaje del usuario.
+        hoy (date): Fecha actual en Colombia, para completar el año.
+
+    Returns:
+        List[date]: Fechas encontradas, en orden de aparición.
+    """
+    return [fecha for _, _, fecha in _buscar(normalizar_texto(texto), _reglas_explicitas(hoy))]
+
+
+NUMEROS = {
+    "un": 1, "una": 1, "uno": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7,
+    "ocho": 8, "nueve": 9, "diez": 10, "once": 11, "doce": 12, "trece": 13, "catorce": 14, "quince": 15,
+}
+_DIA_SEMANA = "(" + "|".join(DIAS_SEMANA) + ")"
+_CANTIDAD = r"(\d{1,3}|" + "|".join(NUMEROS) + ")"
+_SEMANA_SIGUIENTE = r"(?:proxima semana|semana que viene|semana siguiente|otra semana)"
+
+_PASADO_MANANA = re.compile(r"\bpasado\s+manana\b")
+# "en la mañana", "por la mañana" hablan de la jornada, no del día siguiente
+_MANANA = re.compile(r"(?<!la )\bmanana\b")
+_HOY = re.compile(r"\bhoy\b")
+_DENTRO_DE = re.compile(r"\b(?:en|dentro de)\s+" + _CANTIDAD + r"\s+(dias?|semanas?)\b")
+_DIA_HABIL = re.compile(r"\b(?:proximo|siguiente)\s+dia\s+habil\b")
+_DIA_SEMANA_SIGUIENTE = re.compile(r"\b" + _DIA_SEMANA + r"\s+de\s+la\s+" + _SEMANA_SIGUIENTE + r"\b")
+_DIA_SEMANA_PROXIMO = re.compile(
+    r"(?:\b(?:el|este|esta|proximo|proxima|siguiente)\s+)*\b" + _DIA_SEMANA + r"(?:\s+(?:que viene|proximo|siguiente))?\b"
+)
+# "el 10:00", "el 3 pm" o "el 4 de la tarde" son horas, no días del mes
+_DIA_DEL_MES = re.compile(
+    r"\bel\s+(?:dia\s+)?(\d{1,2})\b"
+    r"(?!\s*(?:[:.h]\s*\d|h\b|hrs?\b|horas?\b|a\.?\s?m\b|p\.?\s?m\b|de\s+la\s+(?:manana|tarde|noche)|y\s+(?:media|cuarto)|en\s+punto))"
+)
+
+
+def _dia_del_mes(hoy: date, dia: int) -> date:
+    """Próxima fecha con el día del mes indicado, saltando los meses que no lo tienen."""
+    anio, mes = hoy.year, hoy.month
+    for _ in range(13):
+        try:
+            fecha = date(anio, mes, dia)
+        except ValueError:
+            fecha = None
+        if fecha is not None and fecha > hoy:
+            return fecha
+        anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+    raise ValueError(f"Día del mes no válido: {dia}")
+
+
+def resolver_fechas(texto: str, calendario: CalendarioCitas) -> List[tuple]:
+    """
+    Resuelve las fechas, explícitas o relativas, de una expresión en español.
+
+    Además de los formatos de `fechas_en_texto` reconoce 'hoy', 'mañana',
+    'pasado mañana', 'el (próximo) martes', 'el martes de la próxima semana',
+    'en 3 días', 'dentro de dos semanas', 'el próximo día hábil' y 'el 15'.
+    Una lista ('el lunes, el miércoles y el viernes') devuelve una fecha por
+    elemento. Los días de la semana se resuelven con las tablas del calendario
+    del día, sin recalcular el cambio de año.
+
+    Args:
+        texto (str): Expresión del usuario.
+        calendario (CalendarioCitas): Calendario vigente (ver `get_calendario`).
+
+    Returns:
+        List[tuple]: (fragmento reconocido, fecha) en orden de aparición, sin fechas repetidas.
+
+    Ejemplo de uso (se verifica con `python -m doctest calendario.py`); las horas no son días del mes:
+        >>> calendario = CalendarioCitas(date(2026, 10, 17), "08:00", "18:00", 60, 90)
+        >>> [(f, d.isoformat()) for f, d in resolver_fechas("el próximo martes o el 15", calendario)]
+        [('el proximo martes', '2026-10-20'), ('el 15', '2026-11-15')]
+        >>> [resolver_fechas(t, calendario) for t in ("quiero el 10:00", "el 3 pm", "el 10.30", "el 4 de la tarde")]
+        [[], [], [], []]
+        >>> [(f, d.isoformat()) for f, d in resolver_fechas("el 15 a las 10:00", calendario)]
+        [('el 15', '2026-11-15')]
+    """
+    hoy = calendario.hoy
+    reglas = _reglas_explicitas(hoy) + [
+        (_PASADO_MANANA, lambda m: hoy + timedelta(days=2)),
+        (_MANANA, lambda m: hoy + timedelta(days=1)),
+        (_HOY, lambda m: hoy),
+        (_DENTRO_DE, lambda m: hoy + timedelta(
+            days=(NUMEROS.get(m.group(1)) or int(m.group(1))) * (7 if m.group(2).startswith("semana") else 1))),
+        (_DIA_HABIL, lambda m: calendario.dias[0] if calendario.dias else None),
+        (_DIA_SEMANA_SIGUIENTE, lambda m: calendario.lunes_siguiente + timedelta(days=DIAS_SEMANA[m.group(1)])),
+        (_DIA_SEMANA_PROXIMO, lambda m: calendario.proximos[DIAS_SEMANA[m.group(1)]]),
+        (_DIA_DEL_MES, lambda m: _dia_del_mes(hoy, int(m.group(1)))),
+    ]
+    resueltas, vistas = [], set()
+    for _, fragmento, fecha in _buscar(normalizar_texto(texto), reglas):
+        if fecha not in vistas:
+            vistas.add(fecha)
+            resueltas.append((fragmento, fecha))
+    return resueltas
@@ -0,0 +1,227 @@
+from langgraph.checkpoint.memory import InMemorySaver
+from collections import OrderedDict, defaultdict
+from typing import Dict, Set
+import threading
+import logging
+import sqlite3
+import pickle
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CheckpointerAcotado(InMemorySaver):
+    """
+    Checkpointer en memoria con tope de uso y expulsión LRU.
+
+    Por cada hilo solo se conserva el último checkpoint (con sus escrituras
+    pendientes y los valores de canal que referencia). Cuando se supera
+    `max_hilos` o `max_bytes`, los hilos menos usados se vuelcan a SQLite y
+    se rehidratan la próxima vez que se consultan, de modo que la memoria por
+    worker se mantiene estable aunque crezca el número de usuarios.
+
+    Los hilos volcados que no se vuelven a consultar en `ttl_spill` segundos se
+    borran de SQLite, y si quedan más de `max_spill` se borran los más viejos: el
+    historial de la conversación sigue en su tabla, solo se pierde el estado del grafo.
+
+    Nota: al guardar solo el último checkpoint no hay historial para
+    "time travel" ni para canales delta que reconstruyen su estado a partir
+    de checkpoints anteriores; el grafo del agente no usa ninguno de los dos.
+    """
+
+    # Cada cuánto se buscan hilos volcados vencidos
+    INTERVALO_PODA_SPILL = 60.0
+
+    def __init__(self, max_hilos: int, max_bytes: int, ruta_spill: str, serde=None,
+                 ttl_spill: float = 7 * 24 * 3600, max_spill: int = 100_000):
+        super().__init__(serde=serde)
+        self.max_hilos = max_hilos
+        self.max_bytes = max_bytes
+        self.ttl_spill = ttl_spill
+        self.max_spill = max_spill
+        self._ultima_poda_spill = 0.0
+        self._lock = threading.RLock()
+        self._uso: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._claves_blobs: Dict[str, Set[tuple]] = defaultdict(set)
+        self._claves_writes: Dict[str, Set[tuple]] = defaultdict(set)
+        self._contadores = {"expulsados": 0, "rehidratados": 0, "spill_podados": 0}
+        self._db = sqlite3.connect(ruta_spill, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS spill (thread_id TEXT PRIMARY KEY, data BLOB NOT NULL, volcado REAL NOT NULL DEFAULT 0)")
+        # Archivos creados antes de la poda por antigüedad: sus filas vencen a partir de hoy
+        if "volcado" not in {columna[1] for columna in self._db.execute("PRAGMA table_info(spill)")}:
+            self._db.execute("ALTER TABLE spill ADD COLUMN volcado REAL NOT NULL DEFAULT 0")
+            self._db.execute("UPDATE spill SET volcado = ?", (time.time(),))
+        self._db.execute("CREATE INDEX IF NOT EXISTS spill_volcado ON spill (volcado)")
+
+    # ------------------------------------------------------------------
+    # API de BaseCheckpointSaver
+    # ------------------------------------------------------------------
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._asegurar(thread_id)
+            resultado = super().get_tuple(config)
+            self._limpiar_vacio(thread_id)
+            return resultado
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self._lock:
+            thread_id = (config or {}).get("configurable", {}).get("thread_id")
+            if thread_id is not None:
+                self._asegurar(thread_id)
+            resultado = list(super().list(config, filter=filter, before=before, limit=limit))
+            if thread_id is not None:
+                self._limpiar_vacio(thread_id)
+        return iter(resultado)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            self._asegurar(thread_id)
+            nuevo_config = super().put(config, checkpoint, metadata, new_versions)
+            self._claves_blobs[thread_id].update(
+                (thread_id, checkpoint_ns, canal, version) for canal, version in new_versions.items()
+            )
+            self._podar(thread_id, checkpoint_ns, checkpoint["id"], checkpoint["channel_versions"])
+            self._contabilizar(thread_id)
+            self._expulsar(excepto=thread_id)
+            return nuevo_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._asegurar(thread_id)
+            super().put_writes(config, writes, task_id, task_path)
+            self._claves_writes[thread_id].add(
+                (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+            )
+            self._contabilizar(thread_id)
+            self._expulsar(excepto=thread_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._descartar(thread_id)
+            self._db.execute("DELETE FROM spill WHERE thread_id = ?", (thread_id,))
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"hilos_en_memoria": len(self._uso), "bytes_en_memoria": self._bytes, **self._contadores}
+
+    # ------------------------------------------------------------------
+    # Poda, contabilidad y expulsión
+    # ------------------------------------------------------------------
+    def _podar(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, versiones: dict) -> None:
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for viejo in [c for c in checkpoints if c != checkpoint_id]:
+            del checkpoints[viejo]
+
+        claves_writes = self._claves_writes[thread_id]
+        for clave in [k for k in claves_writes if k[1] == checkpoint_ns and k[2] != checkpoint_id]:
+            self.writes.pop(clave, None)
+            claves_writes.discard(clave)
+
+        claves_blobs = self._claves_blobs[thread_id]
+        for clave in [k for k in claves_blobs if k[1] == checkpoint_ns and versiones.get(k[2]) != k[3]]:
+            self.blobs.pop(clave, None)
+            claves_blobs.discard(clave)
+
+    def _contabilizar(self, thread_id: str) -> None:
+        tamano = 0
+        for checkpoints in self.storage.get(thread_id, {}).values():
+            for checkpoint, metadata, _ in checkpoints.values():
+                tamano += len(checkpoint[1]) + len(metadata[1])
+        for clave in self._claves_writes.get(thread_id, ()):
+            tamano += sum(len(valor[2][1]) for valor in self.writes.get(clave, {}).values())
+        for clave in self._claves_blobs.get(thread_id, ()):
+            tamano += len(self.blobs[clave][1]) if clave in self.blobs else 0
+        self._bytes += tamano - self._uso.get(thread_id, 0)
+        self._uso[thread_id] = tamano
+        self._uso.move_to_end(thread_id)
+
+    def _expulsar(self, excepto: str) -> None:
+        while len(self._uso) > self.max_hilos or self._bytes > self.max_bytes:
+            candidato = next((t for t in self._uso if t != excepto), None)
+            if candidato is None:
+                return
+            self._volcar(candidato)
+
+    def _volcar(self, thread_id: str) -> None:
+        datos = {
+            "storage": {ns: dict(checkpoints) for ns, checkpoints in self.storage.get(thread_id, {}).items()},
+            "writes": {clave: dict(self.writes[clave]) for clave in self._claves_writes.get(thread_id, ()) if clave in self.writes},
+            "blobs": {clave: self.blobs[clave] for clave in self._claves_blobs.get(thread_id, ()) if clave in self.blobs},
+        }
+        self._db.execute(
+            "INSERT OR REPLACE INTO spill (thread_id, data, volcado) VALUES (?, ?, ?)",
+            (thread_id, pickle.dumps(datos, protocol=pickle.HIGHEST_PROTOCOL), time.time()),
+        )
+        self._descartar(thread_id)
+        self._contadores["expulsados"] += 1
+        self._podar_spill()
+
+    def _podar_spill(self) -> None:
+        """Borra los hilos volcados vencidos y, si aún sobran, los más viejos."""
+        ahora = time.time()
+        if ahora - self._ultima_poda_spill < self.INTERVALO_PODA_SPILL:
+            return
+        self._ultima_poda_spill = ahora
+        podados = self._db.execute("DELETE FROM spill WHERE volcado < ?", (ahora - self.ttl_spill,)).rowcount
+        sobrantes = self._db.execute("SELECT COUNT(*) FROM spill").fetchone()[0] - self.max_spill
+        if sobrantes > 0:
+            podados += self._db.execute(
+                "DELETE FROM spill WHERE thread_id IN (SELECT thread_id FROM spill ORDER BY volcado LIMIT ?)", (sobrantes,)
+            ).rowcount
+        if podados:
+            self._contadores["spill_podados"] += podados
+            logger.info(f"Checkpointer: {podados} hilos volcados borrados de SQLite")
+
+    def _asegurar(self, thread_id: str) -> None:
+        """Marca el hilo como usado recientemente y lo rehidrata desde SQLite si fue expulsado."""
+        if thread_id in self._uso:
+            self._uso.move_to_end(thread_id)
+            return
+        fila = self._db.execute("SELECT data FROM spill WHERE thread_id = ?", (thread_id,)).fetchone()
+        if fila is None:
+            return
+        datos = pickle.loads(fila[0])
+        for ns, checkpoints in datos["storage"].items():
+            self.storage[thread_id][ns].update(checkpoints)
+        for clave, valores in datos["writes"].items():
+            self.writes[clave] = valores
+            self._claves_writes[thread_id].add(clave)
+        for clave, blob in datos["blobs"].items():
+            self.blobs[clave] = blob
+            self._claves_blobs[thread_id].add(clave)
+        self._db.execute("DELETE FROM spill WHERE thread_id = ?", (thread_id,))
+        self._contabilizar(thread_id)
+        self._contadores["rehidratados"] += 1
+        self._expulsar(excepto=thread_id)
+
+    def _descartar(self, thread_id: str) -> None:
+        self.storage.pop(thread_id, None)
+        for clave in self._claves_writes.pop(thread_id, ()):
+            self.writes.pop(clave, None)
+        for clave in self._claves_blobs.pop(thread_id, ()):
+            self.blobs.pop(clave, None)
+        self._bytes -= self._uso.pop(thread_id, 0)
+
+    def _limpiar_vacio(self, thread_id: str) -> None:
+        # Las consultas sobre hilos nuevos crean entradas vacías en los defaultdict de InMemorySaver
+        if thread_id not in self._uso and not any(self.storage.get(thread_id, {}).values()):
+            self.storage.pop(thread_id, None)
+
+
+def crear_checkpointer() -> CheckpointerAcotado:
+    return CheckpointerAcotado(
+        max_hilos=int(os.getenv("CHECKPOINT_MAX_THREADS", "1000")),
+        max_bytes=int(os.getenv("CHECKPOINT_MAX_BYTES", str(64 * 1024 * 1024))),
+        ruta_spill=os.getenv("CHECKPOINT_SPILL_PATH", "/tmp/checkpoints.sqlite"),
+        ttl_spill=float(os.getenv("CHECKPOINT_SPILL_TTL_SECONDS", str(7 * 24 * 3600))),
+        max_spill=int(os.getenv("CHECKPOINT_SPILL_MAX_THREADS", "100000")),
+    )
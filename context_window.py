@@ -0,0 +1,145 @@
+from langchain_core.messages import BaseMessage, SystemMessage, trim_messages, get_buffer_string
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import tiktoken
+import logging
+import json
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Presupuesto de tokens del historial que se envía al modelo en cada llamada
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "2000"))
+# Al compactar, se conserva literal esta fracción del presupuesto y el resto pasa al resumen
+CONTEXT_KEEP_RATIO = float(os.getenv("CONTEXT_KEEP_RATIO", "0.5"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+
+# Tokens fijos que agrega el formato de chat por cada mensaje
+TOKENS_POR_MENSAJE = 3
+
+RESUMEN_PROMPT = """Eres un asistente que resume conversaciones de WhatsApp entre un cliente y un agente de agendamiento de citas.
+
+Resumen previo:
+{resumen}
+
+Mensajes nuevos:
+{mensajes}
+
+Escribe un resumen actualizado y breve (máximo {max_palabras} palabras) que conserve nombres, correos,
+fechas, horas, modalidades, códigos de cita y cualquier decisión o solicitud pendiente."""
+
+
+@lru_cache(maxsize=None)
+def get_encoding() -> Optional[tiktoken.Encoding]:
+    try:
+        try:
+            return tiktoken.encoding_for_model(os.getenv("GPT_MODEL") or "gpt-4o")
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # tiktoken descarga el vocabulario la primera vez; sin red se usa una aproximación
+        logger.warning(f"Tokenizer no disponible, se usa una aproximación por caracteres: {e}")
+        return None
+
+
+def _tokens_texto(texto: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return len(texto) // 4 + 1
+    return len(encoding.encode(texto))
+
+
+def contar_tokens_mensaje(message: BaseMessage) -> int:
+    """Cuenta los tokens de un mensaje con el tokenizer del modelo configurado."""
+    contenido = message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+    tokens = TOKENS_POR_MENSAJE + _tokens_texto(contenido)
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        tokens += _tokens_texto(json.dumps(tool_calls, ensure_ascii=False, default=str))
+    return tokens
+
+
+def contar_tokens(messages: List[BaseMessage]) -> int:
+    return sum(contar_tokens_mensaje(message) for message in messages)
+
+
+def mensaje_resumen(resumen: str) -> SystemMessage:
+    return SystemMessage(content=f"Resumen de la conversación anterior con este usuario:\n{resumen}")
+
+
+def recortar(messages: List[BaseMessage], max_tokens: int) -> List[BaseMessage]:
+    """Conserva los mensajes más recientes que caben en `max_tokens`, empezando en un mensaje del usuario."""
+    return trim_messages(
+        messages,
+        strategy="last",
+        token_counter=contar_tokens_mensaje,
+        max_tokens=max_tokens,
+        start_on="human",
+        include_system=False,
+    )
+
+
+def construir_contexto(messages: List[BaseMessage], resumen: Optional[str], max_tokens: int = CONTEXT_MAX_TOKENS) -> List[BaseMessage]:
+    """
+    Arma la lista de mensajes que se envía al modelo dentro del presupuesto de tokens.
+
+    Args:
+        messages (List[BaseMessage]): Mensajes aún no incluidos en el resumen, terminando en el turno actual.
+        resumen (Optional[str]): Resumen acumulado de los mensajes anteriores.
+        max_tokens (int): Presupuesto total para el resumen más el historial.
+
+    Returns:
+        List[BaseMessage]: El resumen (si existe) seguido de los mensajes más recientes.
+    """
+    prefijo = [mensaje_resumen(resumen)] if resumen else []
+    disponible = max_tokens - contar_tokens(prefijo)
+    recientes = recortar(messages, disponible)
+    if not recientes and messages:
+        # El turno actual no cabe solo: se envía igual para no perder la pregunta del usuario
+        recientes = messages[-1:]
+    return prefijo + recientes
+
+
+def compactar(
+    messages: List[BaseMessage],
+    resumen: Optional[str],
+    cubiertos: int,
+    llm,
+    max_tokens: int = CONTEXT_MAX_TOKENS,
+) -> Tuple[Optional[str], int]:
+    """
+    Actualiza el resumen de forma incremental cuando el historial pendiente excede el presupuesto.
+
+    Solo se resumen los mensajes que quedarían fuera de la ventana, junto con el resumen previo,
+    de modo que cada llamada procesa una cantidad acotada de texto.
+
+    Args:
+        messages (List[BaseMessage]): Historial completo de la sesión.
+        resumen (Optional[str]): Resumen vigente.
+        cubiertos (int): Cantidad de mensajes iniciales ya incluidos en el resumen.
+        llm: Modelo usado para resumir.
+        max_tokens (int): Presupuesto de la ventana de contexto.
+
+    Returns:
+        Tuple[Optional[str], int]: El nuevo resumen y la nueva cantidad de mensajes cubiertos.
+    """
+    pendientes = messages[cubiertos:]
+    if contar_tokens(pendientes) <= max_tokens:
+        return resumen, cubiertos
+
+    conservados = recortar(pendientes, int(max_tokens * CONTEXT_KEEP_RATIO))
+    a_resumir = pendientes[:len(pendientes) - len(conservados)]
+    if not a_resumir:
+        return resumen, cubiertos
+
+    prompt = RESUMEN_PROMPT.format(
+        resumen=resumen or "(sin resumen previo)",
+        mensajes=get_buffer_string(a_resumir, human_prefix="Usuario", ai_prefix="Asistente"),
+        max_palabras=int(SUMMARY_MAX_TOKENS * 0.6),
+    )
+    nuevo_resumen = llm.invoke(prompt).content
+    logger.info(f"Historial compactado: {len(a_resumir)} mensajes agregados al resumen")
+    return nuevo_resumen, cubiertos + len(a_resumir)
+
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from typing import Dict
+import threading
+import logging
+import asyncio
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cuánto se recuerda un MessageSid: Twilio reintenta el webhook durante unos minutos
+DEDUPE_TTL_SECONDS = float(os.getenv("DEDUPE_TTL_SECONDS", "3600"))
+# Máximo de MessageSid recordados en memoria por el backend local
+DEDUPE_MAX_ENTRIES = int(os.getenv("DEDUPE_MAX_ENTRIES", "50000"))
+# Tabla de DynamoDB para compartir los MessageSid entre instancias; sin ella son locales al proceso
+DEDUPE_TABLE = os.getenv("DEDUPE_TABLE")
+# Cuánto espera una entrega repetida a que termine la ejecución en curso antes de responder
+DEDUPE_WAIT_SECONDS = float(os.getenv("DEDUPE_WAIT_SECONDS", "10"))
+
+
+class DeduplicadorLocal:
+    """
+    MessageSid ya recibidos, en memoria y con TTL.
+
+    `registrar` es atómico: solo la primera entrega de un MessageSid devuelve
+    True mientras no venza su TTL. Como el TTL es el mismo para todos, el orden
+    de inserción es también el de vencimiento, y los vencidos se descartan desde
+    el inicio; si se supera `max_entradas` se descartan los más antiguos.
+    """
+
+    def __init__(self, ttl: float = DEDUPE_TTL_SECONDS, max_entradas: int = DEDUPE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._vistos: "OrderedDict[str, float]" = OrderedDict()
+        self._contadores = {"nuevos": 0, "duplicados": 0}
+
+    def registrar(self, sid: str) -> bool:
+        ahora = time.monotonic()
+        with self._lock:
+            while self._vistos:
+                primero, vence = next(iter(self._vistos.items()))
+                if vence > ahora and len(self._vistos) < self.max_entradas:
+                    break
+                del self._vistos[primero]
+            vence = self._vistos.get(sid)
+            if vence is not None and vence > ahora:
+                self._contadores["duplicados"] += 1
+                return False
+            self._vistos[sid] = ahora + self.ttl
+            self._contadores["nuevos"] += 1
+            return True
+
+    def liberar(self, sid: str) -> None:
+        with self._lock:
+            self._vistos.pop(sid, None)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"recordados": len(self._vistos), **self._contadores}
+
+
+class DeduplicadorDynamo:
+    """
+    MessageSid ya recibidos, en DynamoDB y compartidos entre instancias.
+
+    Cada entrega escribe `{MessageSid, Expira}` con un `put_item` condicional que
+    solo se acepta si el MessageSid no existe o ya venció. `Expira` (epoch) puede
+    usarse como atributo TTL de la tabla.
+    """
+
+    def __init__(self, table, ttl: float = DEDUPE_TTL_SECONDS):
+        self.table = table
+        self.ttl = ttl
+        self._contadores = {"nuevos": 0, "duplicados": 0}
+
+    def registrar(self, sid: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        ahora = time.time()
+        try:
+            self.table.put_item(
+                Item={"MessageSid": sid, "Expira": int(ahora + self.ttl)},
+                ConditionExpression="attribute_not_exists(MessageSid) OR Expira < :ahora",
+                ExpressionAttributeValues={":ahora": int(ahora)},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            self._contadores["duplicados"] += 1
+            return False
+        self._contadores["nuevos"] += 1
+        return True
+
+    def liberar(self, sid: str) -> None:
+        self.table.delete_item(Key={"MessageSid": sid})
+
+    def estadisticas(self) -> dict:
+        return dict(self._contadores)
+
+
+class EjecucionesEnCurso:
+    """
+    Turnos que se están procesando dentro de la petición, por MessageSid.
+
+    Una entrega repetida que llega a la misma instancia mientras el turno original
+    sigue en curso espera a que termine en lugar de responder de inmediato, así
+    Twilio recibe la respuesta cuando el mensaje realmente se procesó.
+    """
+
+    def __init__(self):
+        self._eventos: Dict[str, asyncio.Event] = {}
+
+    def iniciar(self, sid: str) -> None:
+        self._eventos[sid] = asyncio.Event()
+
+    def terminar(self, sid: str) -> None:
+        evento = self._eventos.pop(sid, None)
+        if evento is not None:
+            evento.set()
+
+    async def esperar(self, sid: str, timeout: float = DEDUPE_WAIT_SECONDS) -> bool:
+        """
+        Espera a que termine el turno en curso con ese MessageSid.
+
+        Returns:
+            bool: False si se agotó el tiempo; True si terminó o no había un turno en curso aquí.
+        """
+        evento = self._eventos.get(sid)
+        if evento is None:
+            return True
+        try:
+            await asyncio.wait_for(evento.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+_deduplicador = None
+_deduplicador_lock = threading.Lock()
+
+
+def get_deduplicador():
+    """Deduplicador del proceso: en DynamoDB si DEDUPE_TABLE está definida, si no en memoria."""
+    global _deduplicador
+    with _deduplicador_lock:
+        if _deduplicador is None:
+            if DEDUPE_TABLE:
+                import boto3
+                from observability import instrumentar_boto3
+
+                instrumentar_boto3()
+                dynamodb = boto3.resource("dynamodb", endpoint_url=os.getenv("DYNAMODB_ENDPOINT_URL"))
+                _deduplicador = DeduplicadorDynamo(dynamodb.Table(DEDUPE_TABLE))
+            else:
+                _deduplicador = DeduplicadorLocal()
+        return _deduplicador
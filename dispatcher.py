@@ -0,0 +1,146 @@
+from twilio.base.exceptions import TwilioRestException
+from requests.exceptions import ConnectionError, Timeout
+from utils import enviar_mensaje_twilio
+from worker_queue import ColaPorClave
+from tenants import get_tenant
+from collections import OrderedDict
+from typing import Callable, Optional
+import threading
+import logging
+import random
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class LimitadorTasa:
+    """
+    Token bucket: permite `tasa` mensajes por segundo con ráfagas de hasta `rafaga`.
+    """
+
+    def __init__(self, tasa: float, rafaga: float = 1.0):
+        self.tasa = tasa
+        self.rafaga = max(rafaga, 1.0)
+        self._tokens = self.rafaga
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def esperar(self) -> float:
+        """
+        Bloquea hasta que haya un token disponible.
+
+        Returns:
+            float: Segundos esperados.
+        """
+        if self.tasa <= 0:
+            return 0.0
+        esperado = 0.0
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._tokens = min(self.rafaga, self._tokens + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return esperado
+                faltante = (1 - self._tokens) / self.tasa
+            time.sleep(faltante)
+            esperado += faltante
+
+
+def es_error_transitorio(error: Exception) -> bool:
+    if isinstance(error, TwilioRestException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (ConnectionError, Timeout))
+
+
+class DespachadorMensajes:
+    """
+    Envía mensajes salientes de forma asíncrona.
+
+    Mantiene el orden por destinatario, aplica límites de tasa global y por
+    número en lugar de pausas fijas, y reintenta los errores transitorios con
+    backoff exponencial. Los envíos a destinatarios distintos salen en paralelo.
+    """
+
+    MAX_LIMITADORES = 10000
+
+    def __init__(
+        self,
+        enviar: Callable[[str, str, Optional[str], Optional[str]], object],
+        workers: int,
+        tasa_global: float,
+        tasa_por_numero: float,
+        reintentos: int,
+        backoff: float,
+    ):
+        self._enviar = enviar
+        self._global = LimitadorTasa(tasa_global, rafaga=tasa_global)
+        self._tasa_por_numero = tasa_por_numero
+        self._limitadores: "OrderedDict[str, LimitadorTasa]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self._contadores = {"enviados": 0, "reintentos": 0, "fallidos": 0}
+        self._cola = ColaPorClave("envios", self._procesar, workers)
+
+    def enviar(self, to_number: str, body_text: str, media_url: Optional[str] = None) -> None:
+        """Encola un mensaje; se envía después de los anteriores al mismo número."""
+        # El remitente es el número del tenant que atiende el turno, no el de los hilos de envío
+        self._cola.encolar(to_number, (body_text, media_url, get_tenant().twilio_number or None))
+
+    def esperar_envios(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que se envíen todos los mensajes encolados."""
+        return self._cola.esperar_vacia(timeout)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            contadores = dict(self._contadores)
+        return {**contadores, "cola": self._cola.estadisticas()}
+
+    def _limitador(self, to_number: str) -> LimitadorTasa:
+        with self._lock:
+            limitador = self._limitadores.get(to_number)
+            if limitador is None:
+                limitador = self._limitadores[to_number] = LimitadorTasa(self._tasa_por_numero)
+                if len(self._limitadores) > self.MAX_LIMITADORES:
+                    self._limitadores.popitem(last=False)
+            else:
+                self._limitadores.move_to_end(to_number)
+            return limitador
+
+    def _contar(self, clave: str) -> None:
+        with self._lock:
+            self._contadores[clave] += 1
+
+    def _procesar(self, to_number: str, mensaje: tuple) -> None:
+        body_text, media_url, remitente = mensaje
+        self._limitador(to_number).esperar()
+        for intento in range(self.reintentos + 1):
+            self._global.esperar()
+            try:
+                self._enviar(to_number, body_text, media_url, remitente)
+                self._contar("enviados")
+                return
+            except Exception as e:
+                if not es_error_transitorio(e) or intento == self.reintentos:
+                    self._contar("fallidos")
+                    logger.error(f"Error sending message to {to_number}: {e}")
+                    return
+                espera = self.backoff * (2 ** intento) * (1 + random.random())
+                self._contar("reintentos")
+                logger.info(f"Transient error sending to {to_number}, retrying in {espera:.1f}s: {e}")
+                time.sleep(espera)
+
+
+despachador = DespachadorMensajes(
+    enviar=enviar_mensaje_twilio,
+    workers=int(os.getenv("DISPATCH_WORKERS", "8")),
+    tasa_global=float(os.getenv("TWILIO_GLOBAL_RATE", "20")),
+    tasa_por_numero=float(os.getenv("TWILIO_PER_NUMBER_RATE", "1")),
+    reintentos=int(os.getenv("TWILIO_MAX_RETRIES", "3")),
+    backoff=float(os.getenv("TWILIO_RETRY_BACKOFF_SECONDS", "0.5")),
+)
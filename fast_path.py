@@ -0,0 +1,184 @@
+from calendario import DIAS_SEMANA, fechas_en_texto, normalizar_texto
+from typing import Callable, Dict, Optional
+import threading
+import logging
+import time
+import re
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+# Mensajes más largos suelen traer más de una intención: se dejan al modelo
+FAST_PATH_MAX_PALABRAS = int(os.getenv("FAST_PATH_MAX_PALABRAS", "20"))
+
+# Códigos generados por generar_codigo_cita: tres letras del nombre y 8 dígitos hexadecimales
+_CODIGO = re.compile(r"(?<![\w-])([^\W\d_]{1,3})-([0-9a-f]{8})(?![\w-])", re.IGNORECASE)
+_HORA = re.compile(r"\b\d{1,2}(:\d{2})+\b|\ba las\b|\b\d{1,2}\s*(am|pm|a\.m\.|p\.m\.)")
+_PROXIMO_DIA = re.compile(r"\b(?:proxim[oa]|siguiente)\s+(" + "|".join(DIAS_SEMANA) + r")\b")
+
+# Palabras que indican que el usuario quiere cambiar algo: siempre pasan por el modelo
+_MUTACION = ("cancel", "borr", "elimin", "modific", "cambi", "mover", "muev", "reagend", "correo", "nombre")
+_DISPONIBILIDAD = ("disponib", "libre", "horario", "cupo", "espacio")
+# Una consulta por código solo se responde con plantilla si, sin el código, las frases de
+# consulta y las palabras de relleno, no queda nada: "¿puedo llevar a alguien a la cita X?" va al modelo
+_CONSULTA_CITA = re.compile(
+    r"\b(?:consultar?|revisar?|ver|verificar?|confirmar?|datos|detalles?|informacion|estado|"
+    r"cuando es|cuando tengo|que dia es|a que hora es|que hora es)\b"
+)
+_RELLENO = frozenset({
+    "hola", "buenas", "buenos", "dias", "tardes", "noches", "por", "favor", "gracias", "quiero", "quisiera",
+    "puedes", "podrias", "me", "mi", "la", "el", "los", "las", "de", "del", "un", "una", "con", "sobre",
+    "cita", "codigo", "es", "mis",
+})
+_PREGUNTA_FECHA = ("que fecha", "cual es la fecha", "que dia es", "que dia cae", "cuando es", "cuando cae")
+
+_NOMBRES_DIAS = {"miercoles": "miércoles", "sabado": "sábado"}
+_DIAS_INGLES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+class RutaRapida:
+    """
+    Enrutador previo al grafo para intenciones estructuradas.
+
+    Reconoce con reglas locales las consultas que solo necesitan una
+    herramienta (consultar una cita por código, la disponibilidad de una
+    fecha explícita o la fecha del próximo día de la semana), ejecuta la
+    herramienta directamente y responde con una plantilla. Si el mensaje es
+    ambiguo devuelve None y el turno sigue por el grafo.
+    """
+
+    def __init__(self, habilitada: bool = FAST_PATH_ENABLED, max_palabras: int = FAST_PATH_MAX_PALABRAS):
+        self.habilitada = habilitada
+        self.max_palabras = max_palabras
+        self._lock = threading.Lock()
+        self._intentos = 0
+        self._aciertos: Dict[str, int] = {}
+        self._segundos_rapida = 0.0
+        self._turnos_grafo = 0
+        self._segundos_grafo = 0.0
+        self._intenciones: Dict[str, Callable[[str, str], Optional[str]]] = {
+            "cita_por_codigo": self._cita_por_codigo,
+            "disponibilidad_fecha": self._disponibilidad_fecha,
+            "proximo_dia": self._proximo_dia,
+        }
+
+    def resolver(self, mensaje: str) -> Optional[str]:
+        """
+        Intenta responder el mensaje sin pasar por el modelo.
+
+        Args:
+            mensaje (str): Mensaje del usuario.
+
+        Returns:
+            Optional[str]: La respuesta, o None si el mensaje debe ir al grafo.
+        """
+        if not self.habilitada:
+            return None
+        inicio = time.perf_counter()
+        with self._lock:
+            self._intentos += 1
+
+        texto = normalizar_texto(mensaje)
+        if len(texto.split()) > self.max_palabras or any(palabra in texto for palabra in _MUTACION):
+            return None
+
+        for nombre, intencion in self._intenciones.items():
+            try:
+                respuesta = intencion(mensaje, texto)
+            except Exception as e:
+                # Ante cualquier error el modelo sigue pudiendo responder el turno
+                logger.warning(f"Ruta rápida '{nombre}' falló, se usa el grafo: {e}")
+                return None
+            if respuesta is not None:
+                with self._lock:
+                    self._aciertos[nombre] = self._aciertos.get(nombre, 0) + 1
+                    self._segundos_rapida += time.perf_counter() - inicio
+                logger.info(f"Ruta rápida: {nombre}")
+                return respuesta
+        return None
+
+    def registrar_grafo(self, segundos: float) -> None:
+        """Registra la duración de un turno resuelto por el grafo, para estimar la latencia ahorrada."""
+        with self._lock:
+            self._turnos_grafo += 1
+            self._segundos_grafo += segundos
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            aciertos = sum(self._aciertos.values())
+            promedio_grafo = self._segundos_grafo / self._turnos_grafo if self._turnos_grafo else 0.0
+            promedio_rapida = self._segundos_rapida / aciertos if aciertos else 0.0
+            return {
+                "intentos": self._intentos,
+                "aciertos": aciertos,
+                "tasa_aciertos": round(aciertos / self._intentos, 3) if self._intentos else 0.0,
+                "por_intencion": dict(self._aciertos),
+                "latencia_rapida_promedio_s": round(promedio_rapida, 4),
+                "latencia_grafo_promedio_s": round(promedio_grafo, 4),
+                "latencia_ahorrada_s": round(max(promedio_grafo - promedio_rapida, 0.0) * aciertos, 2) if promedio_grafo else None,
+            }
+
+    # ------------------------------------------------------------------
+    # Intenciones
+    # ------------------------------------------------------------------
+    def _cita_por_codigo(self, mensaje: str, texto: str) -> Optional[str]:
+        codigos = _CODIGO.findall(mensaje)
+        if len(codigos) != 1:
+            return None
+        resto = _CONSULTA_CITA.sub(" ", normalizar_texto(_CODIGO.sub(" ", mensaje)))
+        if any(palabra not in _RELLENO for palabra in re.findall(r"\w+", resto)):
+            return None
+        from tools import datos_cita
+
+        codigo = f"{codigos[0][0].upper()}-{codigos[0][1].lower()}"
+        cita = datos_cita(codigo)
+        if cita is None:
+            return f"No encontré una cita con el código {codigo}. Por favor verifica que esté escrito correctamente."
+        return (
+            f"Tu cita con código {codigo} está agendada para el {cita.get('Fecha', '')} "
+            f"a las {cita.get('Hora', '')}, modalidad {cita.get('Modalidad', '')}.\n\n"
+            "Si quieres modificarla o cancelarla, avísame."
+        )
+
+    def _disponibilidad_fecha(self, mensaje: str, texto: str) -> Optional[str]:
+        if not any(palabra in texto for palabra in _DISPONIBILIDAD) or _HORA.search(texto):
+            return None
+        from calendario import get_calendario
+        from tools import horarios_libres
+        from utils import get_colombia_time
+
+        hoy = get_colombia_time().date()
+        fechas = fechas_en_texto(mensaje, hoy)
+        if len(fechas) != 1:
+            return None
+        fecha = fechas[0]
+        error = get_calendario(hoy).validar(fecha)
+        if error:
+            return f"Lo siento, no es posible agendar el {fecha.strftime('%d/%m/%Y')}: {error}"
+        libres = horarios_libres([fecha])[fecha]
+        if not libres:
+            return f"Lo siento, el {fecha.strftime('%d/%m/%Y')} ya no tiene horarios libres. ¿Quieres consultar otro día?"
+        return (
+            f"Para el {fecha.strftime('%d/%m/%Y')} tenemos estos horarios libres: {', '.join(libres)}.\n\n"
+            "¿Cuál prefieres?"
+        )
+
+    def _proximo_dia(self, mensaje: str, texto: str) -> Optional[str]:
+        match = _PROXIMO_DIA.search(texto)
+        if not match or not any(pregunta in texto for pregunta in _PREGUNTA_FECHA):
+            return None
+        from tools import next_day_of_week
+        from utils import get_colombia_time
+
+        dia = match.group(1)
+        fecha = next_day_of_week.invoke({
+            "start_date": get_colombia_time().strftime("%d/%m/%Y"),
+            "weekday": _DIAS_INGLES[DIAS_SEMANA[dia]],
+        })
+        return f"El próximo {_NOMBRES_DIAS.get(dia, dia)} es el {fecha}."
+
+
+ruta_rapida = RutaRapida()
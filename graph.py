@@ -0,0 +1,176 @@
+from tools import lookup_project_info,validate_date,consultar_disponibilidad,next_day_of_week,resolver_fechas_relativas,write_to_sheet_with_validation,modify_sheet,erase_from_sheet
+from tools import HERRAMIENTAS_ESCRITURA, get_cache_semantico
+from tool_node import NodoHerramientas
+from observability import callbacks_llm, metricas, span
+from response_cache import HERRAMIENTAS_CACHEABLES, RESPONSE_CACHE_ENABLED, clave_respuesta, get_cache_respuestas, version_prompt
+from utils import get_colombia_time, get_prompts
+from tenants import get_tenant
+from langchain_openai import ChatOpenAI
+from langchain_core.runnables import Runnable, RunnableConfig
+from langgraph.graph.message import AnyMessage, add_messages
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.prebuilt import tools_condition
+from langgraph.graph import StateGraph, START
+#from langchain_openai import AzureChatOpenAI
+from typing_extensions import TypedDict
+from dotenv import load_dotenv
+from typing import Annotated
+import logging
+import os
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load environment variables from .env file
+load_dotenv()
+
+class State(TypedDict):
+    messages: Annotated[list[AnyMessage], add_messages]
+llm = ChatOpenAI(model=os.getenv('GPT_MODEL'), max_tokens=250, stream_usage=True, callbacks=callbacks_llm())
+"""
+llm = AzureChatOpenAI(
+    azure_deployment=os.getenv("AZURE_DEPLOYMENT_NAME"),
+    api_version="2024-05-01-preview",
+    temperature=0,
+    max_tokens=None,
+    timeout=None,
+    max_retries=2,
+)
+embeddings = AzureOpenAIEmbeddings(
+    model="text-embedding-ada-002",
+    openai_api_version=os.getenv("OPENAI_API_VERSION"),
+)
+"""
+class Assistant:
+    def __init__(self, runnable: Runnable, cache=None, version: str = ""):
+        self.runnable = runnable
+        # Caché de respuestas finales para turnos sin contexto previo (cache=None lo desactiva)
+        self.cache = cache
+        self.version = version
+
+    def __call__(self, state: State, config: RunnableConfig):
+        with span("graph_node", node="assistant"):
+            clave = self._clave_cache(state["messages"])
+            if clave is not None and len(state["messages"]) == 1:
+                respuesta = self._leer_cache(clave)
+                if respuesta is not None:
+                    return {"messages": AIMessage(content=respuesta)}
+            resultado = self._responder(state, config)
+            if clave is not None and self._cacheable(state["messages"], resultado["messages"]):
+                self._guardar_cache(clave, resultado["messages"].content)
+            return resultado
+
+    def _clave_cache(self, messages) -> str:
+        # Solo el primer mensaje del usuario sin historial previo ni resumen: la respuesta
+        # depende únicamente del prompt y de ese mensaje
+        if self.cache is None or not messages or not isinstance(messages[0], HumanMessage):
+            return None
+        if any(isinstance(message, HumanMessage) for message in messages[1:]) or not isinstance(messages[0].content, str):
+            return None
+        # Las respuestas dependen de los documentos consultados: una ingesta nueva cambia la clave
+        return clave_respuesta(f"{self.version}:{get_cache_semantico().version_base_conocimiento()}", messages[0].content)
+
+    @staticmethod
+    def _cacheable(messages, result) -> bool:
+        # Una respuesta final cuyo turno no llamó herramientas con efectos ni dependientes de la fecha
+        if result.tool_calls or not isinstance(result.content, str) or not result.content:
+            return False
+        for message in messages[1:]:
+            if isinstance(message, AIMessage) and any(tc["name"] not in HERRAMIENTAS_CACHEABLES for tc in message.tool_calls):
+                return False
+            if isinstance(message, ToolMessage) and message.status == "error":
+                return False
+        return True
+
+    def _leer_cache(self, clave: str):
+        try:
+            respuesta = self.cache.obtener(clave)
+            metricas.incrementar("response_cache_lookups_total", result="miss" if respuesta is None else "hit")
+            return respuesta
+        except Exception as e:
+            logger.warning(f"No se pudo leer el caché de respuestas: {e}")
+            return None
+
+    def _guardar_cache(self, clave: str, respuesta: str) -> None:
+        try:
+            self.cache.guardar(clave, respuesta)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar en el caché de respuestas: {e}")
+
+    def _responder(self, state: State, config: RunnableConfig):
+        while True:
+            configuration = config.get("configurable", {})
+            passenger_id = configuration.get("passenger_id", None)
+            state = {**state, "user_info": passenger_id,"time":get_colombia_time().strftime("%Y-%m-%d %H:%M:%S")}
+            result = self.runnable.invoke(state)
+            # If the LLM happens to return an empty response, we will re-prompt it
+            # for an actual response.
+            if not result.tool_calls and (
+                not result.content
+                or isinstance(result.content, list)
+                and not result.content[0].get("text")
+            ):
+                messages = state["messages"] + [("user", "Respond with a real output.")]
+                state = {**state, "messages": messages}
+            else:
+                break
+        return {"messages": result}
+
+def handle_tool_error(state) -> dict:
+    error = state.get("error")
+    tool_calls = state["messages"][-1].tool_calls
+    return {
+        "messages": [
+            ToolMessage(
+                content=f"Error: {repr(error)}\n please fix your mistakes.",
+                tool_call_id=tc["id"],
+            )
+            for tc in tool_calls
+        ]
+    }
+
+def create_tool_node_with_fallback(tools: list) -> dict:
+    # Las llamadas independientes de un mismo mensaje corren en paralelo; las que escriben
+    # en la hoja se ejecutan en orden, una tras otra
+    nodo = NodoHerramientas(tools, secuenciales=HERRAMIENTAS_ESCRITURA)
+    return nodo.runnable().with_fallbacks(
+        [RunnableLambda(handle_tool_error)], exception_key="error"
+    )
+
+tools = [lookup_project_info,modify_sheet,erase_from_sheet,validate_date,consultar_disponibilidad,next_day_of_week,resolver_fechas_relativas,write_to_sheet_with_validation]
+
+def build_graph(checkpointer: BaseCheckpointSaver):
+    prompt=get_prompts()
+    primary_assistant_prompt = ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                prompt,
+            ),
+            ("placeholder", "{messages}"),
+        ]
+    )
+
+    part_1_assistant_runnable = primary_assistant_prompt | llm.bind_tools(tools)
+
+    builder = StateGraph(State)
+
+    # Define nodes: these do the work
+    # El caché de respuestas es compartido: la clave incluye el tenant, cuya base de conocimiento es propia
+    cache = get_cache_respuestas() if RESPONSE_CACHE_ENABLED else None
+    version = f"{get_tenant().id}:{version_prompt(prompt)}"
+    builder.add_node("assistant", Assistant(part_1_assistant_runnable, cache, version))
+    builder.add_node("tools", create_tool_node_with_fallback(tools))
+    # Define edges: these determine how the control flow moves
+    builder.add_edge(START, "assistant")
+    builder.add_conditional_edges(
+        "assistant",
+        tools_condition,
+    )
+    builder.add_edge("tools", "assistant")
+
+    # The checkpointer lets the graph persist its state.
+    return builder.compile(checkpointer=checkpointer)
@@ -0,0 +1,136 @@
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+from langchain_core.chat_history import BaseChatMessageHistory
+from boto3.dynamodb.conditions import Key
+from typing import List, Optional, Sequence, Tuple
+import logging
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Máximo de turnos sin resumir que se leen por sesión
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "50"))
+HISTORY_TTL_SECONDS = int(os.getenv("HISTORY_TTL_SECONDS", "0"))
+
+
+class HistorialConversacion(BaseChatMessageHistory):
+    """
+    Historial de conversación en DynamoDB con escritura solo por anexión.
+
+    Usa la misma tabla y clave que la sesión (`PhoneNumber`, `Date`):
+
+    - El ítem de sesión (`Date` = "YYYY-MM-DD") guarda el resumen y la clave del
+      último turno que cubre (`SummaryUntil`).
+    - Cada turno es un ítem propio (`Date` = "YYYY-MM-DD#<timestamp>") con los
+      mensajes del turno, escrito con un único `put_item` al confirmar.
+
+    Así cada turno cuesta una escritura de tamaño constante y solo se leen los
+    turnos que aún no están en el resumen.
+    """
+
+    def __init__(self, table, phone_number: str, date: str, max_turnos: int = HISTORY_MAX_TURNS):
+        self.table = table
+        self.phone_number = phone_number
+        self.date = date
+        self.max_turnos = max_turnos
+        self.resumen: Optional[str] = None
+        self._turnos: Optional[List[Tuple[str, List[BaseMessage]]]] = None
+        self._buffer: List[BaseMessage] = []
+
+    @property
+    def key(self) -> dict:
+        return {"PhoneNumber": self.phone_number, "Date": self.date}
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """Mensajes aún no resumidos, seguidos de los que están pendientes de confirmar."""
+        if self._turnos is None:
+            self._cargar()
+        return [message for _, mensajes in self._turnos for message in mensajes] + list(self._buffer)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Acumula los mensajes del turno; se escriben juntos en `confirmar`."""
+        self._buffer.extend(messages)
+
+    def confirmar(self) -> None:
+        """Escribe el turno acumulado como un único ítem nuevo."""
+        if not self._buffer:
+            return
+        if self._turnos is None:
+            self._cargar()
+        clave = f"{self.date}#{time.time_ns():020d}"
+        item = {
+            "PhoneNumber": self.phone_number,
+            "Date": clave,
+            "Messages": messages_to_dict(self._buffer),
+        }
+        if HISTORY_TTL_SECONDS:
+            item["expireAt"] = int(time.time()) + HISTORY_TTL_SECONDS
+        self.table.put_item(Item=item)
+        self._turnos.append((clave, self._buffer))
+        self._buffer = []
+
+    def guardar_resumen(self, resumen: str, cubiertos: int) -> None:
+        """
+        Guarda el resumen en el ítem de sesión.
+
+        Args:
+            resumen (str): Resumen actualizado.
+            cubiertos (int): Cantidad de mensajes iniciales de `messages` que incluye el resumen.
+                Solo se marcan como resumidos los turnos completos.
+        """
+        acumulados = 0
+        hasta = None
+        for clave, mensajes in self._turnos or []:
+            if acumulados + len(mensajes) > cubiertos:
+                break
+            acumulados += len(mensajes)
+            hasta = clave
+        if hasta is None:
+            return
+        self.table.update_item(
+            Key=self.key,
+            UpdateExpression="set #s = :s, #u = :u",
+            ExpressionAttributeNames={"#s": "Summary", "#u": "SummaryUntil"},
+            ExpressionAttributeValues={":s": resumen, ":u": hasta},
+        )
+        self.resumen = resumen
+        self._turnos = [(clave, mensajes) for clave, mensajes in self._turnos if clave > hasta]
+
+    def clear(self) -> None:
+        if self._turnos is None:
+            self._cargar()
+        for clave, _ in self._turnos:
+            if clave != self.date:
+                self.table.delete_item(Key={"PhoneNumber": self.phone_number, "Date": clave})
+        self.table.delete_item(Key=self.key)
+        self.resumen = None
+        self._turnos = []
+        self._buffer = []
+
+    def _cargar(self) -> None:
+        sesion = self.table.get_item(Key=self.key).get("Item", {})
+        self.resumen = sesion.get("Summary")
+        hasta = sesion.get("SummaryUntil", "")
+        turnos: List[Tuple[str, List[BaseMessage]]] = []
+
+        # Sesiones anteriores a este formato guardan todo el historial en el ítem de sesión
+        if sesion.get("History") and hasta < self.date:
+            turnos.append((self.date, messages_from_dict(sesion["History"])))
+
+        desde = max(hasta, f"{self.date}#")
+        response = self.table.query(
+            KeyConditionExpression=Key("PhoneNumber").eq(self.phone_number)
+            & Key("Date").between(desde, f"{self.date}#~"),
+            ScanIndexForward=False,
+            Limit=self.max_turnos,
+        )
+        recientes = [
+            (item["Date"], messages_from_dict(item["Messages"]))
+            for item in response.get("Items", [])
+            if item["Date"] > desde
+        ]
+        turnos.extend(reversed(recientes))
+        self._turnos = turnos
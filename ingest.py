@@ -0,0 +1,414 @@
+"""
+Sincroniza la base de conocimiento de `lookup_project_info` con el índice de Pinecone.
+
+Recorre los documentos (PDF, texto y Markdown), los divide en fragmentos y
+calcula el hash de cada uno. Solo se generan embeddings para los fragmentos
+nuevos o modificados, en lotes grandes y con concurrencia acotada. Los vectores
+se insertan y se eliminan en bloque.
+
+    python ingest.py documentos/
+    python ingest.py documentos/ --seco          # solo reporta los cambios
+    python ingest.py documentos/manual.pdf --forzar
+    python ingest.py documentos/ --destino local  # índice local (RETRIEVER_BACKEND=local)
+
+El identificador de cada vector es `<hash de la ruta>#<hash del contenido>`, así
+que un fragmento igual conserva su vector y re-sincronizar un corpus casi sin
+cambios no llama al modelo de embeddings. El manifiesto (`INGEST_MANIFEST`)
+guarda el hash de cada archivo y los vectores que generó. Los archivos cuyo
+hash no cambió se omiten sin leerlos de nuevo. Los que faltan bajo las rutas
+sincronizadas se eliminan del índice. Sin manifiesto, los vectores existentes
+se descubren listando el índice por prefijo, si el índice lo permite.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from retriever import CLAVE_TEXTO, LOCAL_INDEX_PATH, IndiceLocal, publicar_version
+from observability import span
+from dotenv import load_dotenv
+import argparse
+import hashlib
+import logging
+import json
+import time
+import re
+import os
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+INGEST_MANIFEST = os.getenv("INGEST_MANIFEST", "ingest_manifest.json")
+# Tamaño máximo de un fragmento, en caracteres
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1200"))
+# Fragmentos por llamada al modelo de embeddings y llamadas simultáneas
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "256"))
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+# Vectores por petición de upsert y de borrado a Pinecone
+INGEST_UPSERT_BATCH = int(os.getenv("INGEST_UPSERT_BATCH", "100"))
+INGEST_DELETE_BATCH = int(os.getenv("INGEST_DELETE_BATCH", "1000"))
+
+# Cada cuánto se guarda el manifiesto durante la sincronización
+INTERVALO_GUARDADO_SECONDS = 5.0
+
+EXTENSIONES = (".pdf", ".txt", ".md")
+
+
+# ----------------------------------------------------------------------
+# Lectura y fragmentación
+# ----------------------------------------------------------------------
+def listar_archivos(rutas: List[str]) -> Iterator[str]:
+    for ruta in rutas:
+        if os.path.isfile(ruta):
+            yield _normalizar(ruta)
+            continue
+        for raiz, directorios, archivos in os.walk(ruta):
+            directorios.sort()
+            for nombre in sorted(archivos):
+                if nombre.lower().endswith(EXTENSIONES):
+                    yield _normalizar(os.path.join(raiz, nombre))
+
+
+def _normalizar(ruta: str) -> str:
+    return os.path.relpath(ruta).replace(os.sep, "/")
+
+
+def hash_archivo(ruta: str) -> str:
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def leer_paginas(ruta: str) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    Texto del documento, página por página para los PDF.
+
+    Returns:
+        Iterator[Tuple[Optional[int], str]]: (número de página o None, texto).
+    """
+    if ruta.lower().endswith(".pdf"):
+        import pdfplumber
+
+        with pdfplumber.open(ruta) as pdf:
+            for numero, pagina in enumerate(pdf.pages, start=1):
+                yield numero, pagina.extract_text() or ""
+                # Libera los objetos de la página: los PDF grandes no se acumulan en memoria
+                pagina.flush_cache()
+        return
+    with open(ruta, encoding="utf-8", errors="replace") as f:
+        yield None, f.read()
+
+
+def dividir_texto(texto: str, tamano: int = INGEST_CHUNK_SIZE) -> List[str]:
+    """
+    Divide el texto en fragmentos de hasta `tamano` caracteres, por párrafos.
+
+    Los cortes dependen del contenido y no solo de la posición. Un fragmento se
+    cierra tras un párrafo cuyo hash cumple una condición, una vez superada la
+    mitad del tamaño, o cuando el párrafo siguiente no cabe. Así, editar un
+    párrafo cambia solo los fragmentos cercanos y no desplaza los cortes del
+    resto del documento.
+    """
+    parrafos = []
+    for parrafo in re.split(r"\n\s*\n", texto):
+        parrafo = " ".join(parrafo.split())
+        while len(parrafo) > tamano:
+            corte = parrafo.rfind(" ", 0, tamano)
+            corte = corte if corte > 0 else tamano
+            parrafos.append(parrafo[:corte])
+            parrafo = parrafo[corte:].lstrip()
+        if parrafo:
+            parrafos.append(parrafo)
+
+    fragmentos, actual = [], []
+    largo = 0
+    for parrafo in parrafos:
+        if actual and largo + len(parrafo) + 1 > tamano:
+            fragmentos.append("\n".join(actual))
+            actual, largo = [], 0
+        actual.append(parrafo)
+        largo += len(parrafo) + 1
+        if largo >= tamano // 2 and hashlib.md5(parrafo.encode("utf-8")).digest()[0] % 4 == 0:
+            fragmentos.append("\n".join(actual))
+            actual, largo = [], 0
+    if actual:
+        fragmentos.append("\n".join(actual))
+    return fragmentos
+
+
+def prefijo_archivo(ruta: str) -> str:
+    # Pinecone solo acepta identificadores ASCII: la ruta entra como hash
+    return hashlib.sha256(ruta.encode("utf-8")).hexdigest()[:16]
+
+
+def fragmentos_archivo(ruta: str, tamano: int = INGEST_CHUNK_SIZE) -> Iterator[Tuple[str, str, dict]]:
+    """
+    Fragmentos del archivo con su identificador de contenido.
+
+    Returns:
+        Iterator[Tuple[str, str, dict]]: (id del vector, texto, metadatos).
+    """
+    prefijo = prefijo_archivo(ruta)
+    vistos = set()
+    for pagina, texto in leer_paginas(ruta):
+        for fragmento in dividir_texto(texto, tamano):
+            id_vector = f"{prefijo}#{hashlib.sha256(fragmento.encode('utf-8')).hexdigest()[:32]}"
+            if id_vector in vistos:
+                continue
+            vistos.add(id_vector)
+            metadatos = {CLAVE_TEXTO: fragmento, "source": ruta}
+            if pagina is not None:
+                metadatos["page"] = pagina
+            yield id_vector, fragmento, metadatos
+
+
+# ----------------------------------------------------------------------
+# Manifiesto
+# ----------------------------------------------------------------------
+class Manifiesto:
+    """Hash y vectores de cada archivo sincronizado, en un archivo JSON."""
+
+    def __init__(self, ruta: str = INGEST_MANIFEST):
+        self.ruta = ruta
+        self.archivos: Dict[str, dict] = {}
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                self.archivos = json.load(f).get("archivos", {})
+
+    def guardar(self) -> None:
+        temporal = f"{self.ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"archivos": self.archivos}, f, ensure_ascii=False)
+        os.replace(temporal, self.ruta)
+
+    def version(self) -> str:
+        """Hash de los vectores de todos los archivos: cambia con cualquier edición, aunque no cambie la cantidad."""
+        ids = sorted(id_vector for archivo in self.archivos.values() for id_vector in archivo["ids"])
+        return hashlib.sha256("\n".join(ids).encode("utf-8")).hexdigest()[:16]
+
+
+# ----------------------------------------------------------------------
+# Sincronización
+# ----------------------------------------------------------------------
+class _Pendiente:
+    def __init__(self, hash_contenido: str, ids: List[str], obsoletos: Set[str]):
+        self.hash = hash_contenido
+        self.ids = ids
+        self.obsoletos = obsoletos
+        self.restantes = 0
+
+
+class Sincronizador:
+    """
+    Lleva el índice al contenido actual de los documentos.
+
+    Los archivos se leen uno por uno y sus fragmentos nuevos se acumulan en
+    lotes de `tam_lote`. Cada lote se envía a un hilo que genera los embeddings
+    y hace el upsert, con hasta `concurrencia` lotes en vuelo. Un archivo se
+    registra en el manifiesto, y sus vectores anteriores se eliminan, cuando
+    terminan todos sus lotes. Así, una ejecución interrumpida retoma desde los
+    archivos pendientes.
+
+    Args:
+        index: Índice de Pinecone o `IndiceLocal` (`upsert`, `delete` y, opcionalmente, `list`).
+        embeddings: Modelo con `embed_documents`.
+        manifiesto (Manifiesto): Estado de la última sincronización.
+        namespace (str): Namespace del índice.
+        seco (bool): Solo cuenta los cambios, sin llamar a los servicios.
+    """
+
+    def __init__(self, index, embeddings, manifiesto: Manifiesto, namespace: str = "",
+                 tam_lote: int = INGEST_EMBED_BATCH, concurrencia: int = INGEST_EMBED_CONCURRENCY,
+                 tamano_fragmento: int = INGEST_CHUNK_SIZE, seco: bool = False):
+        self.index = index
+        self.embeddings = embeddings
+        self.manifiesto = manifiesto
+        self.namespace = namespace
+        self.tam_lote = tam_lote
+        self.concurrencia = max(1, concurrencia)
+        self.tamano_fragmento = tamano_fragmento
+        self.seco = seco
+        self.estadisticas = {"archivos": 0, "sin_cambios": 0, "fragmentos": 0, "embebidos": 0,
+                             "llamadas_embeddings": 0, "eliminados": 0, "archivos_eliminados": 0}
+        self._pendientes: Dict[str, _Pendiente] = {}
+        self._ultimo_guardado = time.monotonic()
+
+    def sincronizar(self, rutas: List[str], forzar: bool = False, podar: bool = True) -> dict:
+        inicio = time.perf_counter()
+        presentes = set()
+        lote: List[Tuple[str, str, str, dict]] = []
+        en_vuelo = {}
+        with ThreadPoolExecutor(max_workers=self.concurrencia, thread_name_prefix="ingesta") as executor:
+            for ruta in listar_archivos(rutas):
+                presentes.add(ruta)
+                self.estadisticas["archivos"] += 1
+                hash_contenido = hash_archivo(ruta)
+                anterior = self.manifiesto.archivos.get(ruta)
+                if anterior is not None and anterior["hash"] == hash_contenido and not forzar:
+                    self.estadisticas["sin_cambios"] += 1
+                    continue
+
+                existentes = set(anterior["ids"]) if anterior is not None else self._ids_en_indice(ruta)
+                fragmentos = list(fragmentos_archivo(ruta, self.tamano_fragmento))
+                ids = [id_vector for id_vector, _, _ in fragmentos]
+                pendiente = self._pendientes[ruta] = _Pendiente(hash_contenido, ids, existentes - set(ids))
+                self.estadisticas["fragmentos"] += len(fragmentos)
+                for id_vector, texto, metadatos in fragmentos:
+                    if id_vector in existentes and not forzar:
+                        continue
+                    pendiente.restantes += 1
+                    lote.append((ruta, id_vector, texto, metadatos))
+                    if len(lote) >= self.tam_lote:
+                        self._enviar(executor, en_vuelo, lote)
+                        lote = []
+                if pendiente.restantes == 0:
+                    self._completar(ruta)
+            if lote:
+                self._enviar(executor, en_vuelo, lote)
+            while en_vuelo:
+                self._recoger(en_vuelo, todos=True)
+
+        if podar:
+            self._podar(rutas, presentes)
+        if not self.seco:
+            self._guardar()
+            self._publicar_version()
+        self.estadisticas["segundos"] = round(time.perf_counter() - inicio, 2)
+        return self.estadisticas
+
+    def _enviar(self, executor, en_vuelo: dict, lote: list) -> None:
+        # Acota los lotes en vuelo: la lectura de archivos no se adelanta sin límite a los embeddings
+        while len(en_vuelo) >= self.concurrencia:
+            self._recoger(en_vuelo)
+        futuro = executor.submit(self._embeber_y_subir, lote)
+        en_vuelo[futuro] = lote
+
+    def _recoger(self, en_vuelo: dict, todos: bool = False) -> None:
+        hechos, _ = wait(list(en_vuelo), return_when=FIRST_COMPLETED)
+        for futuro in hechos:
+            lote = en_vuelo.pop(futuro)
+            futuro.result()
+            self.estadisticas["embebidos"] += len(lote)
+            self.estadisticas["llamadas_embeddings"] += 1
+            for ruta, _, _, _ in lote:
+                pendiente = self._pendientes[ruta]
+                pendiente.restantes -= 1
+                if pendiente.restantes == 0:
+                    self._completar(ruta)
+
+    def _embeber_y_subir(self, lote: list) -> None:
+        if self.seco:
+            return
+        with span("external_call", service="openai", operation="embeddings"):
+            vectores = self.embeddings.embed_documents([texto for _, _, texto, _ in lote])
+        registros = [
+            {"id": id_vector, "values": vector, "metadata": metadatos}
+            for (_, id_vector, _, metadatos), vector in zip(lote, vectores)
+        ]
+        for i in range(0, len(registros), INGEST_UPSERT_BATCH):
+            with span("external_call", service="pinecone", operation="upsert"):
+                self.index.upsert(vectors=registros[i:i + INGEST_UPSERT_BATCH], namespace=self.namespace)
+
+    def _completar(self, ruta: str) -> None:
+        pendiente = self._pendientes.pop(ruta)
+        self._eliminar(pendiente.obsoletos)
+        if self.seco:
+            return
+        self.manifiesto.archivos[ruta] = {"hash": pendiente.hash, "ids": pendiente.ids}
+        if time.monotonic() - self._ultimo_guardado >= INTERVALO_GUARDADO_SECONDS:
+            self._guardar()
+            self._ultimo_guardado = time.monotonic()
+
+    def _guardar(self) -> None:
+        # El índice local se escribe antes que el manifiesto: nunca registra vectores que no estén en disco
+        if hasattr(self.index, "guardar"):
+            self.index.guardar()
+        self.manifiesto.guardar()
+
+    def _publicar_version(self) -> None:
+        # El índice local ya lleva su versión en el descriptor
+        if hasattr(self.index, "guardar"):
+            return
+        version = self.manifiesto.version()
+        publicar_version(self.index, self.namespace, version)
+        self.estadisticas["version"] = version
+
+    def _podar(self, rutas: List[str], presentes: Set[str]) -> None:
+        # Solo los archivos del manifiesto que están bajo las rutas sincronizadas
+        raices = [_normalizar(ruta) for ruta in rutas]
+        for ruta in list(self.manifiesto.archivos):
+            bajo_raiz = any(r == "." or ruta == r or ruta.startswith(r.rstrip("/") + "/") for r in raices)
+            if ruta in presentes or not bajo_raiz:
+                continue
+            self._eliminar(set(self.manifiesto.archivos[ruta]["ids"]))
+            self.estadisticas["archivos_eliminados"] += 1
+            if not self.seco:
+                del self.manifiesto.archivos[ruta]
+
+    def _eliminar(self, ids: Set[str]) -> None:
+        if not ids:
+            return
+        self.estadisticas["eliminados"] += len(ids)
+        if self.seco:
+            return
+        ids = sorted(ids)
+        for i in range(0, len(ids), INGEST_DELETE_BATCH):
+            with span("external_call", service="pinecone", operation="delete"):
+                self.index.delete(ids=ids[i:i + INGEST_DELETE_BATCH], namespace=self.namespace)
+
+    def _ids_en_indice(self, ruta: str) -> Set[str]:
+        """Vectores del archivo ya presentes en el índice, para un archivo sin manifiesto."""
+        try:
+            with span("external_call", service="pinecone", operation="list"):
+                return {id_vector for pagina in self.index.list(prefix=f"{prefijo_archivo(ruta)}#", namespace=self.namespace)
+                        for id_vector in pagina}
+        except Exception as e:
+            # Los índices pod-based no permiten listar: los fragmentos se embeben de nuevo
+            logger.info(f"No se pudieron listar los vectores de {ruta}: {e}")
+            return set()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("rutas", nargs="+", help="Archivos o directorios con los documentos")
+    parser.add_argument("--destino", choices=("pinecone", "local"), default="pinecone",
+                        help="Índice de Pinecone o índice local para RETRIEVER_BACKEND=local")
+    parser.add_argument("--tenant", help="Tenant cuyo índice se sincroniza (por defecto, el tenant por defecto)")
+    parser.add_argument("--indice-local", help=f"Descriptor del índice local (por defecto el del tenant o {LOCAL_INDEX_PATH})")
+    parser.add_argument("--namespace", help="Por defecto, el namespace del tenant")
+    parser.add_argument("--manifiesto", help=f"Por defecto {INGEST_MANIFEST} (con el id si no es el tenant por defecto), o <índice local>.manifest.json")
+    parser.add_argument("--lote", type=int, default=INGEST_EMBED_BATCH, help="Fragmentos por llamada de embeddings")
+    parser.add_argument("--concurrencia", type=int, default=INGEST_EMBED_CONCURRENCY, help="Lotes de embeddings simultáneos")
+    parser.add_argument("--forzar", action="store_true", help="Embebe de nuevo todos los fragmentos")
+    parser.add_argument("--sin-podar", action="store_true", help="No elimina los archivos que ya no existen")
+    parser.add_argument("--seco", action="store_true", help="Solo reporta los cambios")
+    args = parser.parse_args()
+
+    from tenants import get_directorio, get_tenant, usar_tenant
+    from tools import get_embeddings, get_vectorstore
+
+    tenant = get_directorio().obtener(args.tenant) if args.tenant else get_tenant()
+    if tenant is None:
+        raise SystemExit(f"Tenant desconocido: {args.tenant}")
+    with usar_tenant(tenant):
+        if args.destino == "local":
+            # Mismos fragmentos e ids que en Pinecone, con su propio manifiesto
+            indice_local = args.indice_local or tenant.local_index_path or LOCAL_INDEX_PATH
+            index = IndiceLocal(indice_local)
+            manifiesto = args.manifiesto or f"{os.path.splitext(indice_local)[0]}.manifest.json"
+        else:
+            index = get_vectorstore().index
+            base, extension = os.path.splitext(INGEST_MANIFEST)
+            manifiesto = args.manifiesto or (f"{base}.{tenant.id}{extension}" if tenant.ambito else INGEST_MANIFEST)
+        namespace = args.namespace if args.namespace is not None else tenant.namespace or ""
+        sincronizador = Sincronizador(
+            index, get_embeddings(), Manifiesto(manifiesto), namespace,
+            tam_lote=args.lote, concurrencia=args.concurrencia, seco=args.seco,
+        )
+        estadisticas = sincronizador.sincronizar(args.rutas, forzar=args.forzar, podar=not args.sin_podar)
+    print(json.dumps(estadisticas, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
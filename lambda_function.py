@@ -1,26 +1,20 @@
-from tools import lookup_project_info,validate_date,next_day_of_week,write_to_sheet_with_validation,modify_sheet,erase_from_sheet
-from utils import get_colombia_time, send_message, split_text, split_text_and_images , get_prompts
-from langchain_community.chat_message_histories import DynamoDBChatMessageHistory
-from langchain_openai import AzureOpenAIEmbeddings,AzureChatOpenAI,ChatOpenAI
-from langchain_core.messages import trim_messages, ToolMessage
-from langchain_core.runnables import Runnable, RunnableConfig
-from langgraph.graph.message import AnyMessage, add_messages
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnableLambda
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.prebuilt import tools_condition
-from langgraph.graph import StateGraph, START
-#from langchain_openai import AzureChatOpenAI
-from typing_extensions import TypedDict
-from langgraph.prebuilt import ToolNode
-from langchain.schema import AIMessage
-from fastapi import FastAPI, Request
+from startup_profile import fase, reporte_arranque
+from observability import callbacks_llm, configurar_logging, instrumentar_boto3, metricas, trazar
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from rafagas import DEBOUNCE_MS, AgrupadorRafagas, TurnoReemplazado
+from deduplicacion import EjecucionesEnCurso, get_deduplicador
+from response_cache import get_cache_respuestas
+from tenants import con_tenant, get_directorio, get_tenant, recursos_tenants, recurso_tenant, usar_tenant
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Callable, Optional
+from datetime import date
+from mangum import Mangum
 from dotenv import load_dotenv
-from typing import Annotated
-from time import sleep
-import uvicorn
 import logging
-import boto3
+import time
 import os
 
 logging.basicConfig(level=logging.INFO)
@@ -28,195 +22,387 @@ logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file
 load_dotenv()
-app = FastAPI()
-
-# Inicializa DynamoDB
-dynamodb = boto3.resource('dynamodb')
-
-table_name = os.getenv("MESSAGE_MEMORY_TABLE") # Nombre de la tabla de DynamoDB
-
-class State(TypedDict):
-    messages: Annotated[list[AnyMessage], add_messages]
-llm = ChatOpenAI(model=os.getenv('GPT_MODEL'), max_tokens=250)
-"""
-llm = AzureChatOpenAI(
-    azure_deployment=os.getenv("AZURE_DEPLOYMENT_NAME"),
-    api_version="2024-05-01-preview",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-)
-embeddings = AzureOpenAIEmbeddings(
-    model="text-embedding-ada-002",
-    openai_api_version=os.getenv("OPENAI_API_VERSION"),
-)
-"""
-class Assistant:
-    def __init__(self, runnable: Runnable):
-        self.runnable = runnable
-
-    def __call__(self, state: State, config: RunnableConfig):
-        while True:
-            configuration = config.get("configurable", {})
-            passenger_id = configuration.get("passenger_id", None)
-            state = {**state, "user_info": passenger_id,"time":get_colombia_time().strftime("%Y-%m-%d %H:%M:%S")}
-            result = self.runnable.invoke(state)
-            # If the LLM happens to return an empty response, we will re-prompt it
-            # for an actual response.
-            if not result.tool_calls and (
-                not result.content
-                or isinstance(result.content, list)
-                and not result.content[0].get("text")
-            ):
-                messages = state["messages"] + [("user", "Respond with a real output.")]
-                state = {**state, "messages": messages}
-            else:
-                break
-        return {"messages": result}
-
-def handle_tool_error(state) -> dict:
-    error = state.get("error")
-    tool_calls = state["messages"][-1].tool_calls
-    return {
-        "messages": [
-            ToolMessage(
-                content=f"Error: {repr(error)}\n please fix your mistakes.",
-                tool_call_id=tc["id"],
-            )
-            for tc in tool_calls
-        ]
-    }
 
-def create_tool_node_with_fallback(tools: list) -> dict:
-    return ToolNode(tools).with_fallbacks(
-        [RunnableLambda(handle_tool_error)], exception_key="error"
-    )
-
-
-prompt=get_prompts()
-primary_assistant_prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            prompt,
-        ),
-        ("placeholder", "{messages}"),
-    ]
-)
-
-tools = [lookup_project_info,modify_sheet,erase_from_sheet,validate_date,next_day_of_week,write_to_sheet_with_validation]
-part_1_assistant_runnable = primary_assistant_prompt | llm.bind_tools(tools)
-
-builder = StateGraph(State)
-
-# Define nodes: these do the work
-builder.add_node("assistant", Assistant(part_1_assistant_runnable))
-builder.add_node("tools", create_tool_node_with_fallback(tools))
-# Define edges: these determine how the control flow moves
-builder.add_edge(START, "assistant")
-builder.add_conditional_edges(
-    "assistant",
-    tools_condition,
-)
-builder.add_edge("tools", "assistant")
-
-# The checkpointer lets the graph persist its state
-# this is a complete memory for the entire graph.
-memory = MemorySaver()
-part_1_graph = builder.compile(checkpointer=memory)
+# Los logs INFO se muestrean (LOG_SAMPLE_RATE) y se escriben fuera del hilo de la petición
+configurar_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Con PRELOAD_GRAPH=true (servidores de larga vida) el grafo se construye al iniciar
+    # y no en el primer mensaje
+    if os.getenv("PRELOAD_GRAPH", "false").lower() == "true":
+        await run_in_threadpool(get_graph)
+    # Reanuda las escrituras en la hoja que quedaron pendientes si el proceso se detuvo
+    await run_in_threadpool(reanudar_diarios)
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
+# Las dependencias pesadas (LangChain, LangGraph, Google, Twilio, boto3) se cargan en el primer uso
+# para que el arranque en frío de Lambda solo pague por FastAPI.
+
+@lru_cache(maxsize=None)
+def get_history_table():
+    # Inicializa DynamoDB (DYNAMODB_ENDPOINT_URL permite usar DynamoDB Local)
+    with fase("dynamodb"):
+        import boto3
+        instrumentar_boto3()
+        dynamodb = boto3.resource('dynamodb', endpoint_url=os.getenv("DYNAMODB_ENDPOINT_URL"))
+        table_name = os.getenv("MESSAGE_MEMORY_TABLE") # Nombre de la tabla de DynamoDB
+        return dynamodb.Table(table_name)
+
+@lru_cache(maxsize=None)
+def get_checkpointer():
+    # Solo guarda el último checkpoint por hilo y vuelca a SQLite los hilos inactivos
+    # para que la memoria del worker no crezca con el número de usuarios.
+    with fase("checkpointer"):
+        from checkpointer import crear_checkpointer
+        return crear_checkpointer()
+
+def get_graph():
+    # Un grafo compilado por tenant (su prompt y su caché de respuestas); el checkpointer,
+    # el modelo y los clientes son compartidos
+    def crear(tenant):
+        with fase("import:graph"):
+            from graph import build_graph
+        with fase("graph_build"):
+            part_1_graph = build_graph(get_checkpointer())
+        logger.info(f"Startup profile ({tenant.id}): {reporte_arranque()}")
+        return part_1_graph
+
+    return recurso_tenant("grafo", crear)
+
+@lru_cache(maxsize=None)
+def get_summary_llm():
+    from langchain_openai import ChatOpenAI
+    from context_window import SUMMARY_MAX_TOKENS
+    return ChatOpenAI(model=os.getenv('GPT_MODEL'), max_tokens=SUMMARY_MAX_TOKENS, callbacks=callbacks_llm())
+
+@lru_cache(maxsize=None)
+def get_despachador():
+    with fase("import:dispatcher"):
+        from dispatcher import despachador
+    return despachador
+
+def get_diario():
+    from sheet_journal import get_diario_citas
+    return get_diario_citas()
+
+def reanudar_diarios():
+    # Abre el diario del tenant por defecto y el de cada tenant con mutaciones guardadas en disco
+    from sheet_journal import ruta_diario
+    get_diario()
+    for tenant in get_directorio().todos():
+        if tenant.ambito and os.path.exists(ruta_diario(tenant)):
+            with usar_tenant(tenant):
+                get_diario()
+
+@lru_cache(maxsize=None)
+def get_ruta_rapida():
+    from fast_path import ruta_rapida
+    return ruta_rapida
 
 @app.get("/")
 async def index():
     logger.info("Endpoint '/' was called.")
     return {"msg": "working"}
 
-@app.post("/message")
-async def chat_with_user(request: Request):
-    logger.info("Received a new message.")
-    form_data = await request.form()
-    user_message = form_data["Body"]
-    whatsapp_number = form_data["From"].replace('whatsapp:', '')
+@trazar("turn")
+@con_tenant
+def process_turn(whatsapp_number: str, user_message: str, cancelado: Optional[Callable[[], bool]] = None):
+    from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage
+    from langgraph.graph.message import REMOVE_ALL_MESSAGES
+    from context_window import compactar, construir_contexto, contar_tokens
+    from history_store import HistorialConversacion
+    from utils import get_colombia_time, split_text, split_text_and_images
+
+    ruta_rapida = get_ruta_rapida()
+    despachador = get_despachador()
     date_today = get_colombia_time().strftime("%Y-%m-%d")  # Formato de fecha YYYY-MM-DD
 
-    # Inicializa DynamoDBChatMessageHistory con el número de teléfono y la fecha
-    session_id = f"{whatsapp_number}#{date_today}"
-    logger.info(f"Session ID: {session_id}")
-
-    my_key = {
-    "PhoneNumber": whatsapp_number,
-    "Date": date_today,
-    }
+    # Historial del día: un ítem por turno en DynamoDB, escrito una sola vez al final del turno.
+    # El mismo número tiene una conversación separada con cada tenant
+    conversacion = get_tenant().clave(whatsapp_number)
+    session_id = f"{conversacion}#{date_today}"
+    logger.debug("Session ID: %s", session_id)
 
-    history = DynamoDBChatMessageHistory(table_name=table_name, session_id=session_id, key=my_key)
+    history = HistorialConversacion(get_history_table(), conversacion, date_today)
 
-    # Recupera el historial de mensajes de DynamoDB
-    previous_messages = history.messages  # Recupera el historial almacenado
+    # Recupera solo los mensajes que aún no están incluidos en el resumen
+    previous_messages = history.messages
+    resumen = history.resumen
 
-    # Almacena el mensaje del usuario en DynamoDB
     history.add_user_message(user_message)
-    logger.info(f"User message stored: {user_message}")
-
-    history_messages = previous_messages + [("user", user_message)]
-    history_messages = trim_messages(
-        history_messages,
-        strategy="last",
-        token_counter=len,
-        max_tokens=5,
-        start_on="human",
-        end_on=("human", "tool"),
-        include_system=True,
-    )
-
-    
+    logger.debug("User message stored: %s", user_message)
+
+    # Consultas estructuradas (código de cita, disponibilidad de una fecha, próximo día)
+    # se responden con la herramienta y una plantilla, sin llamar al modelo
+    respuesta_rapida = ruta_rapida.resolver(user_message)
+    if respuesta_rapida is not None:
+        history.add_ai_message(respuesta_rapida)
+        for message in split_text(respuesta_rapida):
+            despachador.enviar(whatsapp_number, message)
+        history.confirmar()
+        return
+
+    part_1_graph = get_graph()
+    from tools import HERRAMIENTAS_ESCRITURA
+    inicio_grafo = time.perf_counter()
+
+    def comprobar_reemplazo(mensajes, enviados):
+        # Si llegaron mensajes nuevos del usuario el turno se abandona para responder todo junto,
+        # pero solo mientras no se haya enviado nada y el modelo no haya pedido escribir en la hoja
+        if cancelado is None or enviados or not cancelado():
+            return
+        for msg in mensajes:
+            llamadas = list(getattr(msg, "tool_calls", None) or []) + list(getattr(msg, "tool_call_chunks", None) or [])
+            if any(llamada.get("name") in HERRAMIENTAS_ESCRITURA for llamada in llamadas):
+                return
+        raise TurnoReemplazado()
+
+    comprobar_reemplazo([], 0)
+
+    # Solo se envía al modelo el resumen acumulado más los mensajes recientes que caben en el presupuesto.
+    # REMOVE_ALL_MESSAGES descarta la copia del turno anterior guardada en el checkpointer del hilo.
+    context_messages = construir_contexto(previous_messages + [HumanMessage(content=user_message)], resumen)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Context: %d messages, %d tokens", len(context_messages), contar_tokens(context_messages))
+
     # Prepara el estado y la configuración
     state = {
-        "messages": previous_messages + [("user", user_message)]  # Combina el historial con el nuevo mensaje
+        "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)] + context_messages
     }
 
     config = {
         "configurable": {
             "passenger_id": None,
-            "thread_id": whatsapp_number, # Usa el número de WhatsApp como ID de hilo
+            "thread_id": conversacion, # Usa el número de WhatsApp (dentro del tenant) como ID de hilo
         }
     }
 
     # Ejecuta el asistente
+    ia_messages = []
     try:
-        events = part_1_graph.stream(
-            state, config, stream_mode="values"
-        )
-
-        for event in events:
-            ia_messages = [msg.content for msg in event.get("messages", []) if isinstance(msg, AIMessage)]
+        if STREAM_REPLIES:
+            # Cada par de párrafos (y cada imagen) se envía apenas el modelo lo termina
+            ia_messages, enviados = stream_reply(part_1_graph, state, config, whatsapp_number, despachador, comprobar_reemplazo)
+        else:
+            events = part_1_graph.stream(
+                state, config, stream_mode="values"
+            )
+            for event in events:
+                comprobar_reemplazo(event.get("messages", []), 0)
+                ia_messages = [msg.content for msg in event.get("messages", []) if isinstance(msg, AIMessage)]
+            enviados = 0
+        ruta_rapida.registrar_grafo(time.perf_counter() - inicio_grafo)
 
         # Dividir el último mensaje en texto y URLs de imágenes
         if ia_messages:
             message_text = ia_messages[-1]
             history.add_ai_message(message_text)
-            logger.info(f"AI message stored: {message_text}")
+            logger.debug("AI message stored: %s", message_text)
+
+        # Sin streaming (o si el modelo no emitió tokens) se envía la respuesta completa
+        if ia_messages and not enviados:
             text_content, image_urls = split_text_and_images(message_text)
 
-            # Enviar el texto primero
+            # Enviar el texto primero; el despachador respeta el orden y el límite de tasa por número
             if text_content:
                 messages=split_text(text_content)
                 for message in messages:
-                    send_message(whatsapp_number, message)
-                    sleep(1)
-                logger.info(f"Sent text message to {whatsapp_number}: {text_content}")
+                    despachador.enviar(whatsapp_number, message)
+                logger.debug("Queued %d text messages to %s", len(messages), whatsapp_number)
 
             # Enviar cada imagen como mensaje independiente
             for image_url in image_urls:
-                send_message(whatsapp_number, "", media_url=image_url)
-                logger.info(f"Sent image to {whatsapp_number}: {image_url}")
+                despachador.enviar(whatsapp_number, "", media_url=image_url)
+                logger.debug("Queued image to %s: %s", whatsapp_number, image_url)
         
 
+    except TurnoReemplazado:
+        # El historial del turno no se confirma: sus mensajes se procesan con los nuevos
+        raise
     except Exception as e:
         logger.error(f"An error occurred: {e}")
         assistant_response = "Lo siento, ha ocurrido un error."
-        send_message(whatsapp_number, assistant_response)
+        despachador.enviar(whatsapp_number, assistant_response)
+        history.confirmar()
+        return
+
+    # Guarda el turno con una sola escritura y compacta el historial después de responder,
+    # fuera del camino crítico del usuario
+    history.confirmar()
+    if ia_messages:
+        try:
+            nuevo_resumen, cubiertos = compactar(history.messages, resumen, 0, get_summary_llm())
+            if cubiertos:
+                history.guardar_resumen(nuevo_resumen, cubiertos)
+        except Exception as e:
+            logger.error(f"Error compacting history for {whatsapp_number}: {e}")
+
+def stream_reply(part_1_graph, state, config, whatsapp_number, despachador, comprobar_reemplazo=None):
+    """
+    Ejecuta el grafo enviando la respuesta del asistente mientras se genera.
+
+    Los tokens del nodo "assistant" pasan por un `DivisorIncremental`, que produce los
+    mismos mensajes que `split_text` con el texto completo. Los mensajes que resultan
+    ser llamadas a herramientas se descartan y solo se envía el texto de la respuesta final.
+
+    `comprobar_reemplazo(mensajes, enviados)` se llama con cada evento y puede interrumpir
+    la ejecución lanzando `TurnoReemplazado`.
+
+    Returns:
+        Tuple[list, int]: El contenido de los AIMessage del estado final y la cantidad de envíos.
+    """
+    from langchain_core.messages import AIMessage
+    from utils import DivisorIncremental
+
+    ia_messages = []
+    enviados = 0
+    divisor = None
+    mensaje_id = None
+    mensajes = []
+
+    def enviar(envios):
+        nonlocal enviados
+        for tipo, contenido in envios:
+            if tipo == "imagen":
+                despachador.enviar(whatsapp_number, "", media_url=contenido)
+            else:
+                despachador.enviar(whatsapp_number, contenido)
+            enviados += 1
+
+    for modo, datos in part_1_graph.stream(state, config, stream_mode=["messages", "values"]):
+        # Los fragmentos con llamadas a herramientas se revisan apenas llegan, antes de que
+        # se ejecute el nodo de herramientas
+        if modo == "values":
+            mensajes = list(datos.get("messages", []))
+        elif getattr(datos[0], "tool_call_chunks", None):
+            mensajes.append(datos[0])
+        if comprobar_reemplazo is not None:
+            comprobar_reemplazo(mensajes, enviados)
+        if modo == "values":
+            ia_messages = [msg.content for msg in datos.get("messages", []) if isinstance(msg, AIMessage)]
+            continue
+        chunk, metadata = datos
+        if metadata.get("langgraph_node") != "assistant" or not isinstance(chunk, AIMessage):
+            continue
+        if chunk.id != mensaje_id:
+            # Empieza una nueva respuesta del modelo: la anterior llamó herramientas
+            mensaje_id = chunk.id
+            divisor = DivisorIncremental()
+        if divisor is None:
+            continue
+        if getattr(chunk, "tool_call_chunks", None) or chunk.tool_calls:
+            divisor = None
+            continue
+        enviar(divisor.agregar(chunk.text))
+
+    if divisor is not None:
+        enviar(divisor.finalizar())
+    logger.info("Streamed %d messages to %s", enviados, whatsapp_number)
+    return ia_messages, enviados
+
+# Envía la respuesta por párrafos mientras el modelo la genera (STREAM_REPLIES=false la envía al final)
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "true").lower() == "true"
+
+# Los turnos se procesan fuera del request: en orden por número y en paralelo entre números.
+# Con WORKER_POOL_SIZE=0 (p. ej. en Lambda, donde no hay trabajo después de responder)
+# el turno se procesa dentro del request, pero en un hilo para no bloquear el event loop.
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "4"))
+# Los mensajes seguidos de un mismo número (separados por menos de DEBOUNCE_MS) se responden
+# con un solo turno; un mensaje nuevo reemplaza al turno en curso si aún no respondió nada
+agrupador = AgrupadorRafagas(process_turn, DEBOUNCE_MS / 1000, WORKER_POOL_SIZE)
+cola_conversaciones = agrupador.cola
+
+# Twilio reenvía el webhook si la respuesta tarda: cada MessageSid se procesa una sola vez
+en_curso = EjecucionesEnCurso()
+
+@app.post("/message")
+async def chat_with_user(request: Request):
+    logger.info("Received a new message.")
+    form_data = await request.form()
+    user_message = form_data["Body"]
+    whatsapp_number = form_data["From"].replace('whatsapp:', '')
+    message_sid = form_data.get("MessageSid")
+    # El tenant es el negocio dueño del número que recibió el mensaje
+    tenant = get_directorio().resolver(form_data.get("To", ""))
+    if tenant is None:
+        logger.warning("Message to unknown number %s rejected", form_data.get("To"))
+        raise HTTPException(status_code=404, detail="Número no configurado")
+
+    deduplicador = get_deduplicador()
+    if message_sid and not await run_in_threadpool(deduplicador.registrar, message_sid):
+        # Entrega repetida: si el turno original sigue en curso en esta instancia se espera
+        # a que termine; si no, ya se procesó (o se está procesando en otra) y se responde
+        logger.info("Duplicate delivery of %s ignored", message_sid)
+        await en_curso.esperar(message_sid)
+        return {"status": "duplicate"}
+
+    try:
+        with usar_tenant(tenant):
+            if WORKER_POOL_SIZE > 0:
+                agrupador.agregar(whatsapp_number, user_message, clave=tenant.clave(whatsapp_number))
+                logger.info("Message from %s added to its burst", whatsapp_number)
+            else:
+                if message_sid:
+                    en_curso.iniciar(message_sid)
+                try:
+                    await run_in_threadpool(process_turn, whatsapp_number, user_message)
+                    # Sin workers en segundo plano los envíos y las escrituras en la hoja deben terminar
+                    # antes de responder: Lambda congela el proceso al devolver la respuesta
+                    await run_in_threadpool(get_despachador().esperar_envios)
+                    await run_in_threadpool(get_diario().vaciar)
+                finally:
+                    if message_sid:
+                        en_curso.terminar(message_sid)
+    except Exception:
+        # El turno no se completó: el reintento de Twilio debe poder procesarlo
+        if message_sid:
+            await run_in_threadpool(deduplicador.liberar, message_sid)
+        raise
 
     return {"status": "success"}
 
+@app.get("/stats")
+async def stats():
+    return {
+        "cola_conversaciones": cola_conversaciones.estadisticas(),
+        "rafagas": agrupador.estadisticas(),
+        "envios": get_despachador().estadisticas(),
+        "checkpointer": get_checkpointer().estadisticas(),
+        "diario_citas": get_diario().estadisticas(),
+        "ruta_rapida": get_ruta_rapida().estadisticas(),
+        "deduplicacion": get_deduplicador().estadisticas(),
+        "cache_respuestas": get_cache_respuestas().estadisticas(),
+        "tenants": recursos_tenants.estadisticas(),
+        "arranque": reporte_arranque(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Histogramas de duración de los nodos del grafo, las herramientas y las llamadas externas,
+    # y tokens de los modelos, en el formato de texto de Prometheus
+    return PlainTextResponse(metricas.exportar(), media_type="text/plain; version=0.0.4")
+
+@app.get("/reportes/citas")
+async def reportes_citas(agrupar: str = "dia", desde: date = None, hasta: date = None, authorization: Optional[str] = Header(None)):
+    # Solo lectura: agrega la hoja completa en memoria (se relee cada REPORTES_TTL_SECONDS).
+    # El tenant es el dueño del token (REPORTES_TOKEN o `reportes_token` en TENANTS_FILE)
+    from reportes import get_reportes
+    esquema, _, token = (authorization or "").partition(" ")
+    elegido = get_directorio().por_token_reportes(token.strip()) if esquema.lower() == "bearer" else None
+    if elegido is None:
+        raise HTTPException(status_code=401, detail="Token de reportes inválido", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        with usar_tenant(elegido):
+            return await run_in_threadpool(lambda: get_reportes().consultar(agrupar, desde, hasta))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Punto de entrada para AWS Lambda
+handler = Mangum(app, lifespan="off")
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
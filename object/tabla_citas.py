@@ -0,0 +1,145 @@
+from typing import Dict, List, Optional
+from datetime import date
+import numpy as np
+
+
+class TablaCitas:
+    """
+    Clase TablaCitas, representa todas las citas de la hoja en formato columnar.
+
+    En lugar de un `InformacionCita` por fila, guarda una columna por campo:
+    fechas (`datetime64[D]`), horas (minutos desde la medianoche) y modalidades
+    (códigos enteros sobre `modalidades`). La validación se hace sobre las
+    columnas completas; las filas con fecha u hora inválidas quedan marcadas
+    en `validas` y no cuentan en los reportes.
+    """
+
+    def __init__(self, codigos: np.ndarray, fechas: np.ndarray, minutos: np.ndarray, modalidad: np.ndarray, modalidades: List[str], validas: np.ndarray):
+        self.codigos = codigos
+        self.fechas = fechas
+        self.minutos = minutos
+        self.modalidad = modalidad
+        self.modalidades = modalidades
+        self.validas = validas
+
+    def __len__(self) -> int:
+        return len(self.fechas)
+
+    @classmethod
+    def from_rows(cls, rows: List[List[str]]) -> 'TablaCitas':
+        """
+        Crea la tabla a partir de las filas de la hoja, incluida la fila de encabezados.
+
+        Args:
+            rows (List[List[str]]): Valores devueltos por `values().get`; la primera fila son los encabezados.
+
+        Returns:
+            TablaCitas: La tabla con una columna por campo.
+        """
+        encabezados = rows[0] if rows else []
+        datos = rows[1:]
+
+        def columna(nombre: Optional[str], posicion: int, ancho: int) -> np.ndarray:
+            indice = encabezados.index(nombre) if nombre in encabezados else posicion
+            return np.array([row[indice].strip() if len(row) > indice else "" for row in datos], dtype=f"U{ancho}")
+
+        codigos = columna(None, 0, 16)
+        fechas, fechas_validas = parsear_fechas(columna("Fecha", 3, 10))
+        minutos, horas_validas = parsear_horas(columna("Hora", 4, 8))
+        modalidades, modalidad = np.unique(np.char.lower(columna("Modalidad", 5, 32)), return_inverse=True)
+        return cls(
+            codigos=codigos,
+            fechas=fechas,
+            minutos=minutos,
+            modalidad=modalidad.astype(np.int16),
+            modalidades=[str(nombre) for nombre in modalidades],
+            validas=fechas_validas & horas_validas,
+        )
+
+    # ------------------------------------------------------------------
+    # Reportes
+    # ------------------------------------------------------------------
+    def filtro(self, desde: Optional[date] = None, hasta: Optional[date] = None) -> np.ndarray:
+        """Máscara de las citas válidas entre `desde` y `hasta`, inclusive."""
+        mascara = self.validas.copy()
+        if desde is not None:
+            mascara &= self.fechas >= np.datetime64(desde, "D")
+        if hasta is not None:
+            mascara &= self.fechas <= np.datetime64(hasta, "D")
+        return mascara
+
+    def por_dia(self, mascara: np.ndarray) -> Dict[str, int]:
+        dias, conteos = np.unique(self.fechas[mascara], return_counts=True)
+        return {str(dia): int(conteo) for dia, conteo in zip(dias, conteos)}
+
+    def por_modalidad(self, mascara: np.ndarray) -> Dict[str, int]:
+        conteos = np.bincount(self.modalidad[mascara], minlength=len(self.modalidades))
+        return {nombre: int(conteo) for nombre, conteo in zip(self.modalidades, conteos) if conteo}
+
+    def por_hora(self, mascara: np.ndarray) -> Dict[str, int]:
+        conteos = np.bincount(self.minutos[mascara] // 60, minlength=24)
+        return {f"{hora:02d}:00": int(conteo) for hora, conteo in enumerate(conteos) if conteo}
+
+    def ocupacion_por_hora(self, mascara: np.ndarray, dias_habiles: int) -> Dict[str, float]:
+        """Fracción de los días hábiles del rango en que cada hora tuvo una cita."""
+        if dias_habiles <= 0:
+            return {}
+        return {hora: round(conteo / dias_habiles, 4) for hora, conteo in self.por_hora(mascara).items()}
+
+
+def parsear_fechas(valores: np.ndarray):
+    """
+    Convierte fechas 'DD/MM/YYYY' (formato de `InformacionCita.to_dict`) en `datetime64[D]`.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Las fechas (NaT si no son válidas) y la máscara de válidas.
+    """
+    caracteres = _caracteres(valores, 10)
+    digitos = [0, 1, 3, 4, 6, 7, 8, 9]
+    validas = (
+        (np.char.str_len(valores) == 10)
+        & (caracteres[:, 2] == "/")
+        & (caracteres[:, 5] == "/")
+        & np.all((caracteres[:, digitos] >= "0") & (caracteres[:, digitos] <= "9"), axis=1)
+    )
+    numeros = np.where(validas[:, None], caracteres[:, digitos], "0").astype(np.int32)
+    dia = numeros[:, 0] * 10 + numeros[:, 1]
+    mes = numeros[:, 2] * 10 + numeros[:, 3]
+    anio = numeros[:, 4] * 1000 + numeros[:, 5] * 100 + numeros[:, 6] * 10 + numeros[:, 7]
+    validas &= (mes >= 1) & (mes <= 12) & (anio >= 1970)
+
+    mes_inicio = (np.where(validas, anio, 1970) - 1970).astype("datetime64[Y]").astype("datetime64[M]")
+    mes_inicio = mes_inicio + (np.where(validas, mes, 1) - 1).astype("timedelta64[M]")
+    dias_mes = ((mes_inicio + 1).astype("datetime64[D]") - mes_inicio.astype("datetime64[D]")).astype(np.int32)
+    validas &= (dia >= 1) & (dia <= dias_mes)
+
+    fechas = mes_inicio.astype("datetime64[D]") + (np.where(validas, dia, 1) - 1).astype("timedelta64[D]")
+    fechas[~validas] = np.datetime64("NaT")
+    return fechas, validas
+
+
+def parsear_horas(valores: np.ndarray):
+    """
+    Convierte horas 'HH:MM:SS' o 'HH:MM' en minutos desde la medianoche.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Los minutos (0 si no son válidos) y la máscara de válidas.
+    """
+    caracteres = _caracteres(valores, 8)
+    digitos = [0, 1, 3, 4]
+    largo = np.char.str_len(valores)
+    validas = (
+        ((largo == 5) | ((largo == 8) & (caracteres[:, 5] == ":")))
+        & (caracteres[:, 2] == ":")
+        & np.all((caracteres[:, digitos] >= "0") & (caracteres[:, digitos] <= "9"), axis=1)
+    )
+    numeros = np.where(validas[:, None], caracteres[:, digitos], "0").astype(np.int32)
+    horas = numeros[:, 0] * 10 + numeros[:, 1]
+    minutos = numeros[:, 2] * 10 + numeros[:, 3]
+    validas &= (horas < 24) & (minutos < 60)
+    return np.where(validas, horas * 60 + minutos, 0).astype(np.int16), validas
+
+
+def _caracteres(valores: np.ndarray, ancho: int) -> np.ndarray:
+    """Matriz (filas x ancho) con un carácter por celda, sin copiar cada texto por separado."""
+    return np.ascontiguousarray(valores.astype(f"U{ancho}")).view("U1").reshape(len(valores), ancho)
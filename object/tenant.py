@@ -0,0 +1,41 @@
+from pydantic import BaseModel
+from typing import Optional
+
+
+class Tenant(BaseModel):
+    """
+    Clase Tenant, configuración de un negocio atendido por el proceso.
+
+    Cada tenant tiene su número de WhatsApp, su hoja de citas, su prompt en S3
+    y su índice de conocimiento; los clientes de HTTP, Sheets y OpenAI son
+    compartidos por todos.
+    """
+    id: str
+    twilio_number: str
+    sheet_id: Optional[str] = None
+    prompt_bucket: Optional[str] = None
+    prompt_file: Optional[str] = None
+    index_name: Optional[str] = None
+    namespace: Optional[str] = None
+    local_index_path: Optional[str] = None
+    # Token (Authorization: Bearer) con el que el negocio consulta sus reportes; sin él no los puede consultar
+    reportes_token: Optional[str] = None
+    # El tenant por defecto conserva las claves de un despliegue de un solo negocio
+    por_defecto: bool = False
+
+    @property
+    def ambito(self) -> str:
+        """Prefijo de las claves compartidas entre tenants (hilos, historial, reservas); vacío para el tenant por defecto."""
+        return "" if self.por_defecto else self.id
+
+    def clave(self, valor: str) -> str:
+        """
+        Clave de `valor` dentro del tenant.
+
+        Args:
+            valor (str): Número de WhatsApp, código de cita u otra clave compartida.
+
+        Returns:
+            str: `valor` para el tenant por defecto, `<id>#<valor>` para los demás.
+        """
+        return f"{self.id}#{valor}" if self.ambito else valor
@@ -0,0 +1,315 @@
+from logging.handlers import QueueHandler, QueueListener
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+from functools import wraps
+import threading
+import logging
+import atexit
+import random
+import queue
+import json
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Fracción de los logs INFO/DEBUG que se emiten; WARNING y superiores siempre se emiten
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+# Con LOG_ASYNC=true los logs se formatean y escriben en un hilo aparte
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() == "true"
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "spark")
+
+# Límites (segundos) de los histogramas de duración
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histograma:
+    """Histograma acumulativo con límites fijos, como los de Prometheus."""
+
+    def __init__(self, limites: Tuple[float, ...] = BUCKETS_SEGUNDOS):
+        self.limites = limites
+        self.conteos = [0] * (len(limites) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float) -> None:
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.conteos[i] += 1
+                break
+        else:
+            self.conteos[-1] += 1
+        self.suma += valor
+        self.total += 1
+
+
+class Metricas:
+    """
+    Registro de histogramas y contadores con etiquetas, exportable en el formato
+    de texto de Prometheus.
+    """
+
+    def __init__(self, prefijo: str = METRICS_PREFIX):
+        self.prefijo = prefijo
+        self._lock = threading.Lock()
+        self._histogramas: Dict[Tuple[str, tuple], Histograma] = {}
+        self._contadores: Dict[Tuple[str, tuple], float] = {}
+
+    def observar(self, nombre: str, valor: float, **etiquetas) -> None:
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = Histograma()
+            histograma.observar(valor)
+
+    def incrementar(self, nombre: str, cantidad: float = 1, **etiquetas) -> None:
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + cantidad
+
+    def total(self, nombre: str) -> float:
+        """Suma de un contador sobre todas sus etiquetas."""
+        with self._lock:
+            return sum(valor for (clave, _), valor in self._contadores.items() if clave == nombre)
+
+    def exportar(self) -> str:
+        """Texto para el endpoint /metrics (formato de exposición de Prometheus 0.0.4)."""
+        with self._lock:
+            histogramas = {clave: (list(h.conteos), h.limites, h.suma, h.total) for clave, h in self._histogramas.items()}
+            contadores = dict(self._contadores)
+
+        lineas = []
+        tipos = set()
+        for (nombre, etiquetas), (conteos, limites, suma, total) in sorted(histogramas.items()):
+            nombre = f"{self.prefijo}_{nombre}"
+            if nombre not in tipos:
+                tipos.add(nombre)
+                lineas.append(f"# TYPE {nombre} histogram")
+            acumulado = 0
+            for limite, conteo in zip(list(limites) + ["+Inf"], conteos):
+                acumulado += conteo
+                lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas, le=limite)} {acumulado}")
+            lineas.append(f"{nombre}_sum{_etiquetas(etiquetas)} {suma:.6f}")
+            lineas.append(f"{nombre}_count{_etiquetas(etiquetas)} {total}")
+        for (nombre, etiquetas), valor in sorted(contadores.items()):
+            nombre = f"{self.prefijo}_{nombre}"
+            if nombre not in tipos:
+                tipos.add(nombre)
+                lineas.append(f"# TYPE {nombre} counter")
+            lineas.append(f"{nombre}{_etiquetas(etiquetas)} {valor:g}")
+        return "\n".join(lineas) + "\n"
+
+
+def _etiquetas(etiquetas: tuple, **extra) -> str:
+    pares = list(etiquetas) + list(extra.items())
+    if not pares:
+        return ""
+    valores = ",".join(f'{clave}="{str(valor).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for clave, valor in pares)
+    return "{" + valores + "}"
+
+
+metricas = Metricas()
+logger_spans = logging.getLogger("spans")
+
+
+class _Json:
+    """Se serializa solo si el registro de log pasa el muestreo y llega a formatearse."""
+
+    def __init__(self, datos: dict):
+        self.datos = datos
+
+    def __str__(self) -> str:
+        return json.dumps(self.datos, ensure_ascii=False)
+
+
+@contextmanager
+def span(nombre: str, **etiquetas):
+    """
+    Mide la duración del bloque y la agrega al histograma `<nombre>_duration_seconds`.
+
+    Las etiquetas deben tener pocos valores posibles (nodo, herramienta, servicio,
+    operación); se agrega `status` con "ok" o "error".
+
+    Ejemplo de uso:
+        with span("external_call", service="twilio", operation="messages.create"):
+            ...
+    """
+    inicio = time.perf_counter()
+    estado = "ok"
+    try:
+        yield
+    except BaseException:
+        estado = "error"
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        metricas.observar(f"{nombre}_duration_seconds", duracion, status=estado, **etiquetas)
+        logger_spans.info("%s", _Json({"span": nombre, **etiquetas, "status": estado, "ms": round(duracion * 1000, 2)}))
+
+
+def trazar(nombre: str, **etiquetas):
+    """Decorador equivalente a envolver la función en `span(nombre, **etiquetas)`."""
+
+    def decorador(funcion):
+        @wraps(funcion)
+        def trazada(*args, **kwargs):
+            with span(nombre, **etiquetas):
+                return funcion(*args, **kwargs)
+
+        return trazada
+
+    return decorador
+
+
+# ----------------------------------------------------------------------
+# Llamadas a los modelos de OpenAI
+# ----------------------------------------------------------------------
+_callbacks_llm = None
+
+
+def callbacks_llm() -> list:
+    """Callbacks para los modelos de chat: duración de cada llamada y tokens de entrada y salida."""
+    global _callbacks_llm
+    if _callbacks_llm is None:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        class CallbackLLM(BaseCallbackHandler):
+            def __init__(self):
+                self._inicios: Dict[object, Tuple[float, str]] = {}
+
+            def on_chat_model_start(self, serialized, messages, *, run_id, invocation_params=None, **kwargs):
+                modelo = (invocation_params or {}).get("model") or (invocation_params or {}).get("model_name") or "desconocido"
+                self._inicios[run_id] = (time.perf_counter(), modelo)
+                metricas.incrementar("llm_calls_total", model=modelo)
+
+            def on_llm_end(self, response, *, run_id, **kwargs):
+                inicio, modelo = self._inicios.pop(run_id, (None, "desconocido"))
+                if inicio is not None:
+                    metricas.observar("external_call_duration_seconds", time.perf_counter() - inicio,
+                                      service="openai", operation="chat", status="ok")
+                entrada, salida = _tokens(response)
+                if entrada or salida:
+                    metricas.incrementar("llm_tokens_total", entrada, model=modelo, type="prompt")
+                    metricas.incrementar("llm_tokens_total", salida, model=modelo, type="completion")
+
+            def on_llm_error(self, error, *, run_id, **kwargs):
+                inicio, _ = self._inicios.pop(run_id, (None, None))
+                if inicio is not None:
+                    metricas.observar("external_call_duration_seconds", time.perf_counter() - inicio,
+                                      service="openai", operation="chat", status="error")
+
+        _callbacks_llm = [CallbackLLM()]
+    return _callbacks_llm
+
+
+def _tokens(response) -> Tuple[int, int]:
+    # Con streaming el uso viene en usage_metadata del mensaje; sin streaming, en llm_output
+    for generaciones in response.generations:
+        for generacion in generaciones:
+            uso = getattr(getattr(generacion, "message", None), "usage_metadata", None)
+            if uso:
+                return uso.get("input_tokens", 0), uso.get("output_tokens", 0)
+    uso = (response.llm_output or {}).get("token_usage") or {}
+    return uso.get("prompt_tokens", 0), uso.get("completion_tokens", 0)
+
+
+# ----------------------------------------------------------------------
+# Llamadas de boto3 (S3, Secrets Manager, DynamoDB)
+# ----------------------------------------------------------------------
+_boto3_instrumentado = False
+_boto3_lock = threading.Lock()
+
+
+def instrumentar_boto3() -> None:
+    """
+    Mide cada llamada de los clientes de boto3 creados después de invocarla.
+
+    Registra los eventos `before-call`/`after-call` en la sesión por defecto,
+    cuyos manejadores heredan los clientes y recursos creados con `boto3.client`
+    y `boto3.resource`.
+    """
+    global _boto3_instrumentado
+    with _boto3_lock:
+        if _boto3_instrumentado:
+            return
+        import boto3
+
+        def antes(context, **kwargs):
+            context["_inicio_span"] = time.perf_counter()
+
+        def despues(model, context, http_response, **kwargs):
+            inicio = context.pop("_inicio_span", None)
+            if inicio is None:
+                return
+            estado = "ok" if http_response.status_code < 400 else "error"
+            metricas.observar("external_call_duration_seconds", time.perf_counter() - inicio,
+                              service=model.service_model.service_name, operation=model.name, status=estado)
+
+        def error(event_name, context, **kwargs):
+            # Errores de conexión o de tiempo agotado: no hay respuesta HTTP. El evento
+            # no trae el modelo; el servicio y la operación vienen en su nombre
+            inicio = context.pop("_inicio_span", None)
+            if inicio is not None:
+                _, servicio, operacion = event_name.split(".", 2)
+                metricas.observar("external_call_duration_seconds", time.perf_counter() - inicio,
+                                  service=servicio, operation=operacion, status="error")
+
+        if boto3.DEFAULT_SESSION is None:
+            boto3.setup_default_session()
+        boto3.DEFAULT_SESSION.events.register("before-call", antes)
+        boto3.DEFAULT_SESSION.events.register("after-call", despues)
+        boto3.DEFAULT_SESSION.events.register("after-call-error", error)
+        _boto3_instrumentado = True
+
+
+# ----------------------------------------------------------------------
+# Logging asíncrono y muestreado
+# ----------------------------------------------------------------------
+class FiltroMuestreo(logging.Filter):
+    """Deja pasar todos los WARNING o superiores y una fracción `tasa` del resto."""
+
+    def __init__(self, tasa: float):
+        super().__init__()
+        self.tasa = tasa
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.tasa
+
+
+class _ManejadorCola(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El formateo (y la interpolación de los argumentos) se hace en el hilo del listener
+        return record
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configurar_logging(tasa: float = LOG_SAMPLE_RATE, asincrono: bool = LOG_ASYNC) -> None:
+    """
+    Coloca el muestreo y, si `asincrono`, una cola delante de los manejadores del logger raíz.
+
+    El hilo de la petición solo evalúa el filtro y encola el registro; el
+    listener lo formatea y lo escribe con los manejadores originales.
+    """
+    global _listener
+    raiz = logging.getLogger()
+    if _listener is not None or any(isinstance(manejador, _ManejadorCola) for manejador in raiz.handlers):
+        return
+    manejadores = raiz.handlers[:] or [logging.StreamHandler()]
+    filtro = FiltroMuestreo(tasa)
+    if not asincrono:
+        for manejador in manejadores:
+            manejador.addFilter(filtro)
+        if not raiz.handlers:
+            raiz.addHandler(manejadores[0])
+        return
+    cola = _ManejadorCola(queue.SimpleQueue())
+    cola.addFilter(filtro)
+    raiz.handlers = [cola]
+    _listener = QueueListener(cola.queue, *manejadores, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
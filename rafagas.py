@@ -0,0 +1,172 @@
+from worker_queue import ColaPorClave
+from typing import Callable, Dict, Hashable, List, Optional
+import contextvars
+import threading
+import logging
+import heapq
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Mensajes del mismo número separados por menos de esta ventana forman un solo turno
+DEBOUNCE_MS = float(os.getenv("DEBOUNCE_MS", "800"))
+
+
+class TurnoReemplazado(Exception):
+    """Llegaron mensajes nuevos antes de que el turno enviara algo o escribiera en la hoja."""
+
+
+class _Sesion:
+    def __init__(self, numero: str):
+        self.numero = numero
+        self.contexto: Optional[contextvars.Context] = None
+        self.mensajes: List[str] = []
+        self.version = 0
+        self.plazo: Optional[float] = None
+        self.en_curso = False
+
+
+class AgrupadorRafagas:
+    """
+    Agrupa las ráfagas de mensajes de un mismo número en un solo turno.
+
+    Cada mensaje reinicia la ventana de la sesión; cuando pasa `ventana`
+    segundos sin mensajes nuevos, los acumulados se unen (uno por línea) y se
+    procesan con una sola ejecución del grafo en la cola por número.
+
+    Si llega un mensaje mientras su sesión tiene un turno en curso, `cancelado`
+    pasa a ser verdadero para ese turno: `procesar` puede abandonarlo con
+    `TurnoReemplazado` mientras no haya enviado mensajes ni ejecutado
+    herramientas de escritura, y sus mensajes se agregan a la ráfaga siguiente.
+    Si ya no es seguro abandonarlo, termina normalmente y los mensajes nuevos
+    forman el turno siguiente.
+
+    `procesar` se ejecuta en el contexto (`contextvars`) del último mensaje de
+    la ráfaga, p. ej. con el tenant que lo recibió.
+
+    Args:
+        procesar: `procesar(numero, mensaje, cancelado=callable)`.
+        ventana (float): Segundos sin mensajes nuevos que cierran una ráfaga.
+        workers (int): Hilos de la cola de turnos.
+    """
+
+    def __init__(self, procesar: Callable[..., None], ventana: float, workers: int):
+        self.procesar = procesar
+        self.ventana = ventana
+        self.cola = ColaPorClave("conversaciones", self._ejecutar, workers)
+        self._lock = threading.Lock()
+        self._despertar = threading.Condition(self._lock)
+        self._sesiones: Dict[Hashable, _Sesion] = {}
+        self._plazos: List[tuple] = []
+        self._hilo: Optional[threading.Thread] = None
+        self._contadores = {"mensajes": 0, "ejecuciones": 0, "reemplazadas": 0}
+
+    def agregar(self, numero: str, mensaje: str, clave: Optional[Hashable] = None) -> None:
+        """
+        Agrega un mensaje a la ráfaga en curso del número.
+
+        Args:
+            numero (str): Número de WhatsApp del usuario.
+            mensaje (str): Texto recibido.
+            clave (Hashable, optional): Conversación a la que pertenece (por defecto, el número);
+                el mismo número puede tener conversaciones separadas, p. ej. una por tenant.
+        """
+        clave = numero if clave is None else clave
+        with self._lock:
+            sesion = self._sesiones.get(clave)
+            if sesion is None:
+                sesion = self._sesiones[clave] = _Sesion(numero)
+            sesion.contexto = contextvars.copy_context()
+            sesion.mensajes.append(mensaje)
+            sesion.version += 1
+            self._contadores["mensajes"] += 1
+            if self.ventana <= 0:
+                sesion.plazo = None
+                self._despachar(clave, sesion)
+                return
+            sesion.plazo = time.monotonic() + self.ventana
+            heapq.heappush(self._plazos, (sesion.plazo, clave))
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._vigilar, name="rafagas", daemon=True)
+                self._hilo.start()
+            self._despertar.notify()
+
+    def estadisticas(self) -> dict:
+        from observability import metricas
+
+        with self._lock:
+            contadores = dict(self._contadores)
+            sesiones = len(self._sesiones)
+        ahorradas = contadores["mensajes"] - contadores["ejecuciones"]
+        # Los turnos reemplazados también llamaron al modelo antes de abandonarse
+        iniciadas = contadores["ejecuciones"] + contadores["reemplazadas"]
+        llamadas_por_ejecucion = metricas.total("llm_calls_total") / iniciadas if iniciadas else 0.0
+        return {
+            **contadores,
+            "sesiones_activas": sesiones,
+            "ventana_ms": self.ventana * 1000,
+            "ejecuciones_ahorradas": ahorradas,
+            "llamadas_llm_ahorradas_estimadas": round(ahorradas * llamadas_por_ejecucion, 1),
+        }
+
+    # ------------------------------------------------------------------
+    # Ventanas
+    # ------------------------------------------------------------------
+    def _vigilar(self) -> None:
+        with self._lock:
+            while True:
+                if not self._plazos:
+                    self._despertar.wait()
+                    continue
+                plazo, clave = self._plazos[0]
+                espera = plazo - time.monotonic()
+                if espera > 0:
+                    self._despertar.wait(espera)
+                    continue
+                heapq.heappop(self._plazos)
+                sesion = self._sesiones.get(clave)
+                # Un mensaje posterior movió el plazo: esta entrada ya no vale
+                if sesion is None or sesion.plazo != plazo:
+                    continue
+                sesion.plazo = None
+                self._despachar(clave, sesion)
+
+    def _despachar(self, clave: Hashable, sesion: _Sesion) -> None:
+        """Encola la ráfaga si la ventana cerró y la sesión no tiene un turno en curso (con el lock tomado)."""
+        if sesion.en_curso or sesion.plazo is not None or not sesion.mensajes:
+            return
+        mensajes, sesion.mensajes = sesion.mensajes, []
+        sesion.en_curso = True
+        self.cola.encolar(clave, (mensajes, sesion.version, sesion.contexto))
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+    def _ejecutar(self, clave: Hashable, trabajo: tuple) -> None:
+        mensajes, version, contexto = trabajo
+        sesion = self._sesiones[clave]
+        numero = sesion.numero
+        if len(mensajes) > 1:
+            logger.info("Ráfaga de %d mensajes de %s procesada en un solo turno", len(mensajes), numero)
+        reemplazado = False
+        try:
+            contexto.run(self.procesar, numero, "\n".join(mensajes), cancelado=lambda: sesion.version != version)
+        except TurnoReemplazado:
+            reemplazado = True
+            logger.info("Turno de %s reemplazado por mensajes nuevos", numero)
+            with self._lock:
+                self._contadores["reemplazadas"] += 1
+                sesion.mensajes[:0] = mensajes
+        finally:
+            with self._lock:
+                # Un turno reemplazado no cuenta como ejecución: sus mensajes se procesan en el siguiente
+                if not reemplazado:
+                    self._contadores["ejecuciones"] += 1
+                sesion.en_curso = False
+                if sesion.mensajes:
+                    self._despachar(clave, sesion)
+                elif sesion.plazo is None:
+                    del self._sesiones[clave]
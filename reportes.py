@@ -0,0 +1,96 @@
+from object.tabla_citas import TablaCitas
+from calendario import DIAS_HABILES
+from tenants import recurso_tenant
+from datetime import date
+from typing import Optional
+import numpy as np
+import threading
+import logging
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se vuelve a leer la hoja para los reportes
+REPORTES_TTL_SECONDS = float(os.getenv("REPORTES_TTL_SECONDS", "60"))
+
+AGRUPACIONES = ("dia", "modalidad", "hora")
+
+# Máscara de días hábiles para numpy.busday_count (lunes a domingo)
+_SEMANA_HABIL = [dia in DIAS_HABILES for dia in range(7)]
+
+
+class ReportesCitas:
+    """
+    Reportes agregados de solo lectura sobre la hoja de citas.
+
+    La hoja se lee completa con una sola llamada y se convierte en una
+    `TablaCitas`, que se reutiliza durante `ttl` segundos; cada reporte es
+    una agregación vectorizada sobre esa tabla.
+    """
+
+    def __init__(self, sheet_id: str, obtener_sheet, ttl: float = REPORTES_TTL_SECONDS):
+        self.sheet_id = sheet_id
+        self.obtener_sheet = obtener_sheet
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tabla: Optional[TablaCitas] = None
+        self._cargada = 0.0
+
+    def tabla(self) -> TablaCitas:
+        with self._lock:
+            if self._tabla is None or time.monotonic() - self._cargada > self.ttl:
+                inicio = time.perf_counter()
+                rows = self.obtener_sheet().values().get(spreadsheetId=self.sheet_id, range="A:Z").execute().get("values", [])
+                self._tabla = TablaCitas.from_rows(rows)
+                self._cargada = time.monotonic()
+                logger.info(f"Tabla de citas cargada: {len(self._tabla)} filas en {time.perf_counter() - inicio:.3f} s")
+            return self._tabla
+
+    def consultar(self, agrupar: str, desde: Optional[date] = None, hasta: Optional[date] = None) -> dict:
+        """
+        Agrega las citas del rango.
+
+        Args:
+            agrupar (str): "dia", "modalidad" u "hora" (la hora incluye la ocupación por día hábil).
+            desde (Optional[date]): Primera fecha incluida.
+            hasta (Optional[date]): Última fecha incluida.
+
+        Returns:
+            dict: Totales del rango y los conteos por grupo.
+        """
+        if agrupar not in AGRUPACIONES:
+            raise ValueError(f"agrupar debe ser uno de: {', '.join(AGRUPACIONES)}")
+        tabla = self.tabla()
+        inicio = time.perf_counter()
+        mascara = tabla.filtro(desde, hasta)
+        resultado = {
+            "total": int(mascara.sum()),
+            "filas_invalidas": int((~tabla.validas).sum()),
+        }
+        if agrupar == "dia":
+            resultado["por_dia"] = tabla.por_dia(mascara)
+        elif agrupar == "modalidad":
+            resultado["por_modalidad"] = tabla.por_modalidad(mascara)
+        else:
+            resultado["por_hora"] = tabla.por_hora(mascara)
+            resultado["ocupacion_por_hora"] = tabla.ocupacion_por_hora(mascara, self._dias_habiles(tabla, mascara, desde, hasta))
+        resultado["duracion_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+        return resultado
+
+    @staticmethod
+    def _dias_habiles(tabla: TablaCitas, mascara: np.ndarray, desde: Optional[date], hasta: Optional[date]) -> int:
+        if not mascara.any():
+            return 0
+        primero = np.datetime64(desde, "D") if desde else tabla.fechas[mascara].min()
+        ultimo = np.datetime64(hasta, "D") if hasta else tabla.fechas[mascara].max()
+        return int(np.busday_count(primero, ultimo + 1, weekmask=_SEMANA_HABIL))
+
+
+def get_reportes() -> ReportesCitas:
+    """Reportes de la hoja del tenant actual."""
+    from utils import get_google_sheets_service
+
+    return recurso_tenant("reportes", lambda tenant: ReportesCitas(tenant.sheet_id, lambda: get_google_sheets_service().spreadsheets()))
@@ -0,0 +1,241 @@
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterable, Tuple
+import threading
+import logging
+import uuid
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Duración de una reserva: si el proceso que la tomó no la confirma ni la libera, expira sola
+RESERVA_LEASE_SECONDS = float(os.getenv("RESERVA_LEASE_SECONDS", "15"))
+# Máximo que un horario confirmado sigue reservado mientras el diario no lo escribe en la hoja
+# (p. ej. durante una caída de Google Sheets); al escribirlo vuelve a durar RESERVA_LEASE_SECONDS
+RESERVA_RETENCION_SECONDS = float(os.getenv("RESERVA_RETENCION_SECONDS", "86400"))
+# Tabla de DynamoDB para compartir las reservas entre instancias; sin ella son locales al proceso
+RESERVAS_TABLE = os.getenv("RESERVAS_TABLE")
+
+
+class HorarioReservado(Exception):
+    """Otra operación tiene reservado el horario o la cita."""
+
+
+class ReservasLocales:
+    """
+    Reservas con lease en memoria, por clave: (fecha, hora) para un horario o
+    ("codigo", codigo) para una cita existente.
+
+    `reservar` es atómico: solo un dueño puede tener la clave hasta que la
+    libere o hasta que venza el lease. Las operaciones sobre claves distintas no
+    se bloquean entre sí.
+    """
+
+    def __init__(self, lease: float = RESERVA_LEASE_SECONDS):
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._reservas: Dict[Hashable, Tuple[str, float]] = {}
+        self._contadores = {"reservadas": 0, "rechazadas": 0, "vencidas": 0}
+
+    def reservar(self, clave: Hashable, dueno: str) -> bool:
+        ahora = time.monotonic()
+        with self._lock:
+            actual = self._reservas.get(clave)
+            if actual is not None and actual[0] != dueno:
+                if actual[1] > ahora:
+                    self._contadores["rechazadas"] += 1
+                    return False
+                self._contadores["vencidas"] += 1
+            self._reservas[clave] = (dueno, ahora + self.lease)
+            self._contadores["reservadas"] += 1
+            return True
+
+    def liberar(self, clave: Hashable, dueno: str) -> None:
+        with self._lock:
+            actual = self._reservas.get(clave)
+            if actual is not None and actual[0] == dueno:
+                del self._reservas[clave]
+
+    def confirmar(self, clave: Hashable, dueno: str) -> None:
+        # En el mismo proceso el diario de citas ya muestra el horario ocupado
+        self.liberar(clave, dueno)
+
+    def escrita(self, clave: Hashable, dueno: str) -> None:
+        pass
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"activas": len(self._reservas), **self._contadores}
+
+
+class ReservasDynamo:
+    """
+    Reservas con lease en DynamoDB, compartidas entre instancias.
+
+    Cada reserva es un ítem `{Clave, Dueno, Expira}` escrito con un `put_item`
+    condicional: solo se acepta si la clave no existe, ya venció o es del mismo
+    dueño. `Expira` (epoch) puede usarse como atributo TTL de la tabla.
+    """
+
+    def __init__(self, table, lease: float = RESERVA_LEASE_SECONDS, retencion: float = RESERVA_RETENCION_SECONDS):
+        self.table = table
+        self.lease = lease
+        self.retencion = retencion
+        self._contadores = {"reservadas": 0, "rechazadas": 0}
+
+    def reservar(self, clave: Hashable, dueno: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        ahora = time.time()
+        try:
+            self.table.put_item(
+                Item={"Clave": _clave_texto(clave), "Dueno": dueno, "Expira": int(ahora + self.lease)},
+                ConditionExpression="attribute_not_exists(Clave) OR Expira < :ahora OR Dueno = :dueno",
+                ExpressionAttributeValues={":ahora": int(ahora), ":dueno": dueno},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            self._contadores["rechazadas"] += 1
+            return False
+        self._contadores["reservadas"] += 1
+        return True
+
+    def liberar(self, clave: Hashable, dueno: str) -> None:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.table.delete_item(
+                Key={"Clave": _clave_texto(clave)},
+                ConditionExpression="Dueno = :dueno",
+                ExpressionAttributeValues={":dueno": dueno},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    def confirmar(self, clave: Hashable, dueno: str) -> None:
+        # Las otras instancias solo ven el horario ocupado cuando su índice lee la fila que
+        # escribe el diario de esta instancia: hasta entonces la reserva se retiene
+        self._extender(clave, dueno, self.retencion)
+
+    def escrita(self, clave: Hashable, dueno: str) -> None:
+        # La fila ya está en la hoja: la reserva dura un lease más, lo que tardan los
+        # índices de las otras instancias en sincronizarse, y se deja vencer
+        self._extender(clave, dueno, self.lease)
+
+    def _extender(self, clave: Hashable, dueno: str, segundos: float) -> None:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.table.update_item(
+                Key={"Clave": _clave_texto(clave)},
+                UpdateExpression="SET Expira = :expira",
+                ConditionExpression="Dueno = :dueno",
+                ExpressionAttributeValues={":expira": int(time.time() + segundos), ":dueno": dueno},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            logger.warning(f"La reserva {clave} ya no es de esta operación")
+
+    def estadisticas(self) -> dict:
+        return dict(self._contadores)
+
+
+def _clave_texto(clave: Hashable) -> str:
+    return "#".join(clave) if isinstance(clave, tuple) else str(clave)
+
+
+class Reserva:
+    """
+    Claves tomadas por una operación; `confirmar` indica que la escritura se hizo
+    y `escrita` que el diario ya la llevó a la hoja.
+    """
+
+    def __init__(self, reservas, horarios: Iterable[Tuple[str, str]], citas: Iterable[str], ambito: str = ""):
+        self.reservas = reservas
+        self.dueno = uuid.uuid4().hex
+        # Con un ámbito (tenant) las claves de hojas distintas no se cruzan en el backend compartido
+        prefijo = (ambito,) if ambito else ()
+        self.horarios = {prefijo + tuple(horario) for horario in horarios}
+        self.claves = sorted(self.horarios | {("codigo",) + prefijo + (codigo,) for codigo in citas}, key=_clave_texto)
+        self.confirmada = False
+
+    def confirmar(self) -> None:
+        self.confirmada = True
+
+    def escrita(self) -> None:
+        for clave in self.horarios:
+            try:
+                self.reservas.escrita(clave, self.dueno)
+            except Exception as e:
+                # La retención vence sola
+                logger.warning(f"No se pudo acortar la reserva {clave}: {e}")
+
+
+@contextmanager
+def reservar(reservas, horarios: Iterable[Tuple[str, str]] = (), citas: Iterable[str] = (), espera: float = 0.0, ambito: str = ""):
+    """
+    Toma los horarios y las citas indicados (en orden, para evitar interbloqueos) durante el bloque.
+
+    Se usa alrededor de "verificar y escribir": mientras dura el bloque nadie más
+    puede tomar los mismos horarios o modificar las mismas citas. Al salir, si la
+    reserva se confirmó, los horarios quedan como definitivos (`confirmar` del
+    backend) hasta que se llame a `Reserva.escrita`; si no, se liberan. Las citas
+    siempre se liberan.
+
+    Args:
+        reservas: `ReservasLocales` o `ReservasDynamo`.
+        horarios (Iterable[Tuple[str, str]]): Pares (fecha, hora) a reservar.
+        citas (Iterable[str]): Códigos de citas existentes que se van a modificar o borrar.
+        espera (float): Segundos que se reintenta una clave ocupada antes de rendirse.
+        ambito (str): Prefijo de las claves, p. ej. el tenant dueño de la hoja.
+
+    Raises:
+        HorarioReservado: Si alguna clave sigue ocupada por otra operación.
+    """
+    reserva = Reserva(reservas, horarios, citas, ambito)
+    tomadas = []
+    try:
+        for clave in reserva.claves:
+            limite = time.monotonic() + espera
+            while not reservas.reservar(clave, reserva.dueno):
+                if time.monotonic() >= limite:
+                    raise HorarioReservado(clave)
+                time.sleep(0.05)
+            tomadas.append(clave)
+        yield reserva
+    finally:
+        for clave in reversed(tomadas):
+            try:
+                if reserva.confirmada and clave in reserva.horarios:
+                    reservas.confirmar(clave, reserva.dueno)
+                else:
+                    reservas.liberar(clave, reserva.dueno)
+            except Exception as e:
+                # El lease vence solo: no se interrumpe la operación por no poder liberarla
+                logger.warning(f"No se pudo liberar la reserva {clave}: {e}")
+
+
+_reservas = None
+_reservas_lock = threading.Lock()
+
+
+def get_reservas():
+    """Reservas compartidas del proceso: en DynamoDB si RESERVAS_TABLE está definida, si no en memoria."""
+    global _reservas
+    with _reservas_lock:
+        if _reservas is None:
+            if RESERVAS_TABLE:
+                import boto3
+                from observability import instrumentar_boto3
+
+                instrumentar_boto3()
+                dynamodb = boto3.resource("dynamodb", endpoint_url=os.getenv("DYNAMODB_ENDPOINT_URL"))
+                _reservas = ReservasDynamo(dynamodb.Table(RESERVAS_TABLE))
+            else:
+                _reservas = ReservasLocales()
+        return _reservas
@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+import unicodedata
+import threading
+import hashlib
+import logging
+import time
+import re
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+# Tabla de DynamoDB para compartir el caché entre instancias; sin ella es local al proceso
+RESPONSE_CACHE_TABLE = os.getenv("RESPONSE_CACHE_TABLE")
+
+# Herramientas de solo lectura cuyo resultado no depende de la fecha ni de la agenda: un turno
+# que solo usó estas herramientas (o ninguna) puede reutilizarse. Cualquier otra lo excluye.
+HERRAMIENTAS_CACHEABLES = frozenset({"lookup_project_info"})
+
+
+def normalizar_consulta(query: str) -> str:
+    """
+    Normaliza una consulta para compararla de forma exacta: minúsculas,
+    sin tildes, sin signos de puntuación y con espacios simples.
+    """
+    texto = unicodedata.normalize("NFKD", query.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+def version_prompt(prompt: str) -> str:
+    """Hash corto del prompt del sistema: al cambiar el prompt en S3 cambian todas las claves."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def clave_respuesta(version: str, mensaje: str) -> str:
+    modelo = os.getenv("GPT_MODEL", "")
+    return hashlib.sha256(f"{version}\n{modelo}\n{normalizar_consulta(mensaje)}".encode("utf-8")).hexdigest()
+
+
+class CacheRespuestasLocal:
+    """Respuestas finales del asistente en memoria, con LRU y TTL."""
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL_SECONDS, max_entradas: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._contadores = {"aciertos": 0, "fallos": 0, "guardadas": 0}
+
+    def obtener(self, clave: str) -> Optional[str]:
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada[1] < time.monotonic():
+                self._entradas.pop(clave, None)
+                self._contadores["fallos"] += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self._contadores["aciertos"] += 1
+            return entrada[0]
+
+    def guardar(self, clave: str, respuesta: str) -> None:
+        with self._lock:
+            self._entradas[clave] = (respuesta, time.monotonic() + self.ttl)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+            self._contadores["guardadas"] += 1
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"entradas": len(self._entradas), **self._contadores}
+
+
+class CacheRespuestasDynamo:
+    """
+    Respuestas finales del asistente en DynamoDB, compartidas entre instancias.
+
+    Cada respuesta es un ítem `{Clave, Respuesta, Expira}`; `Expira` (epoch)
+    puede usarse como atributo TTL de la tabla, pero la lectura también lo
+    verifica porque DynamoDB borra los ítems vencidos con retraso.
+    """
+
+    def __init__(self, table, ttl: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.table = table
+        self.ttl = ttl
+        self._contadores = {"aciertos": 0, "fallos": 0, "guardadas": 0}
+
+    def obtener(self, clave: str) -> Optional[str]:
+        item = self.table.get_item(Key={"Clave": clave}).get("Item")
+        if item is None or int(item.get("Expira", 0)) < time.time():
+            self._contadores["fallos"] += 1
+            return None
+        self._contadores["aciertos"] += 1
+        return item["Respuesta"]
+
+    def guardar(self, clave: str, respuesta: str) -> None:
+        self.table.put_item(Item={"Clave": clave, "Respuesta": respuesta, "Expira": int(time.time() + self.ttl)})
+        self._contadores["guardadas"] += 1
+
+    def estadisticas(self) -> dict:
+        return dict(self._contadores)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache_respuestas():
+    """Caché del proceso: en DynamoDB si RESPONSE_CACHE_TABLE está definida, si no en memoria."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if RESPONSE_CACHE_TABLE:
+                import boto3
+                from observability import instrumentar_boto3
+
+                instrumentar_boto3()
+                dynamodb = boto3.resource("dynamodb", endpoint_url=os.getenv("DYNAMODB_ENDPOINT_URL"))
+                _cache = CacheRespuestasDynamo(dynamodb.Table(RESPONSE_CACHE_TABLE))
+            else:
+                _cache = CacheRespuestasLocal()
+        return _cache
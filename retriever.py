@@ -0,0 +1,246 @@
+from langchain_core.documents import Document
+from observability import span
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import threading
+import hashlib
+import logging
+import json
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "pinecone" (por defecto) o "local": matriz de embeddings en un archivo mapeado en memoria
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "pinecone").lower()
+# Descriptor JSON del índice local; la matriz va en un .npy junto a él
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "kb_index.json")
+# Cada cuánto se revisa si el índice local cambió en disco
+LOCAL_INDEX_CHECK_SECONDS = float(os.getenv("LOCAL_INDEX_CHECK_SECONDS", "1"))
+
+# Clave del texto en los metadatos: la que lee PineconeVectorStore al buscar
+CLAVE_TEXTO = "text"
+# Namespace de Pinecone donde `ingest.py` publica la versión de cada namespace de documentos;
+# las búsquedas nunca lo consultan
+NAMESPACE_VERSION = "__kb_version__"
+
+
+def id_version(namespace: Optional[str]) -> str:
+    """Id del registro con la versión del namespace de documentos `namespace`."""
+    return namespace or "__default__"
+
+
+def publicar_version(index, namespace: Optional[str], version: str) -> None:
+    """
+    Guarda en Pinecone la versión del contenido de `namespace` (ver `RecuperadorPinecone.version`).
+
+    Pinecone solo guarda metadatos junto a un vector: se usa un vector unitario
+    de la dimensión del índice.
+    """
+    with span("external_call", service="pinecone", operation="describe_index_stats"):
+        dimension = index.describe_index_stats().dimension
+    with span("external_call", service="pinecone", operation="upsert"):
+        index.upsert(
+            vectors=[{"id": id_version(namespace), "values": [1.0] + [0.0] * (dimension - 1), "metadata": {"version": version}}],
+            namespace=NAMESPACE_VERSION,
+        )
+
+
+class RecuperadorPinecone:
+    """Búsqueda por vector en el índice de Pinecone."""
+
+    def __init__(self, obtener_vectorstore: Callable, namespace: Optional[str] = None):
+        self.obtener_vectorstore = obtener_vectorstore
+        self.namespace = namespace
+
+    def buscar(self, embedding: List[float], k: int) -> List[Document]:
+        with span("external_call", service="pinecone", operation="query"):
+            return self.obtener_vectorstore().similarity_search_by_vector(embedding, k=k)
+
+    async def abuscar(self, embedding: List[float], k: int) -> List[Document]:
+        with span("external_call", service="pinecone", operation="query"):
+            return await self.obtener_vectorstore().asimilarity_search_by_vector(embedding, k=k)
+
+    def version(self):
+        """
+        Versión publicada por `ingest.py` para el namespace (cambia con cualquier
+        edición de los documentos). Si el índice no la tiene, por haberse cargado
+        con otra herramienta, se usa la cantidad de vectores por namespace.
+        """
+        index = self.obtener_vectorstore().index
+        with span("external_call", service="pinecone", operation="fetch"):
+            registros = index.fetch(ids=[id_version(self.namespace)], namespace=NAMESPACE_VERSION).vectors
+        registro = registros.get(id_version(self.namespace))
+        if registro is not None and registro.metadata:
+            return registro.metadata.get("version")
+        with span("external_call", service="pinecone", operation="describe_index_stats"):
+            stats = index.describe_index_stats()
+        return {nombre: ns.vector_count for nombre, ns in stats.namespaces.items() if nombre != NAMESPACE_VERSION}
+
+
+def leer_indice(ruta: str):
+    """
+    Abre el índice local descrito en `ruta`.
+
+    Returns:
+        tuple: (matriz mapeada en memoria, metadatos por fila, versión).
+    """
+    with open(ruta, encoding="utf-8") as f:
+        descriptor = json.load(f)
+    ruta_matriz = os.path.join(os.path.dirname(os.path.abspath(ruta)), descriptor["matriz"])
+    matriz = np.load(ruta_matriz, mmap_mode="r") if descriptor["metadatos"] else np.zeros((0, 0), dtype=np.float32)
+    return matriz, descriptor["metadatos"], descriptor["version"]
+
+
+class _Datos:
+    def __init__(self, matriz: np.ndarray, metadatos: List[dict], version: str, firma: tuple):
+        self.matriz = matriz
+        self.metadatos = metadatos
+        self.version = version
+        self.firma = firma
+
+
+class RecuperadorLocal:
+    """
+    Búsqueda por similitud coseno sobre una matriz de embeddings local.
+
+    El índice lo escribe `IndiceLocal` (`python ingest.py ... --destino local`).
+    Un descriptor JSON contiene los textos, los metadatos y el nombre del `.npy`
+    con los vectores ya normalizados, que se abre con `mmap_mode="r"`: las
+    páginas se cargan bajo demanda y se comparten entre procesos.
+
+    Cada `intervalo_revision` segundos se compara la fecha de modificación del
+    descriptor. Si cambió, el índice se recarga y reemplaza al anterior de una vez,
+    sin interrumpir las búsquedas en curso.
+    """
+
+    def __init__(self, ruta: str = LOCAL_INDEX_PATH, intervalo_revision: float = LOCAL_INDEX_CHECK_SECONDS):
+        self.ruta = ruta
+        self.intervalo_revision = intervalo_revision
+        self._lock = threading.Lock()
+        self._datos: Optional[_Datos] = None
+        self._ultima_revision = 0.0
+
+    def _revisar(self) -> _Datos:
+        ahora = time.monotonic()
+        datos = self._datos
+        if datos is not None and ahora - self._ultima_revision < self.intervalo_revision:
+            return datos
+        with self._lock:
+            self._ultima_revision = ahora
+            for intento in range(2):
+                estado = os.stat(self.ruta)
+                firma = (estado.st_mtime_ns, estado.st_size)
+                if self._datos is not None and self._datos.firma == firma:
+                    break
+                try:
+                    self._datos = _Datos(*leer_indice(self.ruta), firma)
+                except FileNotFoundError:
+                    # Dos guardados seguidos borraron la matriz de este descriptor: se lee el nuevo
+                    if intento:
+                        raise
+                    continue
+                logger.info(f"Índice local cargado: {len(self._datos.metadatos)} fragmentos (versión {self._datos.version})")
+                break
+            return self._datos
+
+    def buscar(self, embedding: List[float], k: int) -> List[Document]:
+        with span("local_index", operation="query"):
+            datos = self._revisar()
+            if not datos.metadatos:
+                return []
+            consulta = np.asarray(embedding, dtype=np.float32)
+            puntajes = datos.matriz @ (consulta / (np.linalg.norm(consulta) or 1.0))
+            if len(puntajes) > k:
+                mejores = np.argpartition(-puntajes, k)[:k]
+                mejores = mejores[np.argsort(-puntajes[mejores])]
+            else:
+                mejores = np.argsort(-puntajes)
+            documentos = []
+            for i in mejores:
+                metadatos = dict(datos.metadatos[i])
+                texto = metadatos.pop(CLAVE_TEXTO, "")
+                documentos.append(Document(page_content=texto, metadata=metadatos))
+            return documentos
+
+    async def abuscar(self, embedding: List[float], k: int) -> List[Document]:
+        # Menos de un milisegundo: no vale la pena pasarla a otro hilo
+        return self.buscar(embedding, k)
+
+    def version(self) -> str:
+        return self._revisar().version
+
+
+class IndiceLocal:
+    """
+    Índice local editable con la parte del API del índice de Pinecone que usa `ingest.py`
+    (`upsert`, `delete` y `list`). `guardar` lo escribe para `RecuperadorLocal`.
+
+    La matriz se escribe en un `.npy` nuevo y después se reemplaza el descriptor
+    con `os.replace`. Un lector que revisa el descriptor siempre ve una matriz y
+    unos metadatos de la misma versión. Se conservan la matriz vigente y la
+    anterior; las más viejas se borran al guardar.
+    """
+
+    def __init__(self, ruta: str = LOCAL_INDEX_PATH):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._vectores: Dict[str, tuple] = {}
+        if os.path.exists(ruta):
+            matriz, filas, _ = leer_indice(ruta)
+            for fila, metadatos in enumerate(filas):
+                metadatos = dict(metadatos)
+                self._vectores[metadatos.pop("id")] = (np.array(matriz[fila]), metadatos)
+
+    def upsert(self, vectors: List[dict], namespace: str = "") -> None:
+        with self._lock:
+            for vector in vectors:
+                valores = np.asarray(vector["values"], dtype=np.float32)
+                self._vectores[vector["id"]] = (valores / (np.linalg.norm(valores) or 1.0), vector.get("metadata", {}))
+
+    def delete(self, ids: List[str], namespace: str = "") -> None:
+        with self._lock:
+            for id_vector in ids:
+                self._vectores.pop(id_vector, None)
+
+    def list(self, prefix: str = "", namespace: str = ""):
+        with self._lock:
+            ids = [id_vector for id_vector in self._vectores if id_vector.startswith(prefix)]
+        yield ids
+
+    def guardar(self) -> None:
+        with self._lock:
+            ids = sorted(self._vectores)
+            metadatos = [{"id": id_vector, **self._vectores[id_vector][1]} for id_vector in ids]
+            matriz = np.stack([self._vectores[id_vector][0] for id_vector in ids]) if ids else np.zeros((0, 0), dtype=np.float32)
+        version = hashlib.sha256("\n".join(ids).encode("utf-8")).hexdigest()[:16]
+        directorio = os.path.dirname(os.path.abspath(self.ruta))
+        base = os.path.splitext(os.path.basename(self.ruta))[0]
+        nombre_matriz = f"{base}.{version}.npy"
+        anterior = previa = None
+        if os.path.exists(self.ruta):
+            with open(self.ruta, encoding="utf-8") as f:
+                descriptor = json.load(f)
+            anterior, previa = descriptor.get("matriz"), descriptor.get("anterior")
+        if anterior == nombre_matriz:
+            anterior = previa
+
+        # Con los mismos ids la matriz no cambió; nunca se sobrescribe un .npy que un lector tenga mapeado
+        ruta_matriz = os.path.join(directorio, nombre_matriz)
+        if not os.path.exists(ruta_matriz):
+            with open(f"{ruta_matriz}.tmp", "wb") as f:
+                np.save(f, matriz.astype(np.float32))
+            os.replace(f"{ruta_matriz}.tmp", ruta_matriz)
+        temporal = f"{self.ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "matriz": nombre_matriz, "anterior": anterior, "metadatos": metadatos}, f, ensure_ascii=False)
+        os.replace(temporal, self.ruta)
+        # La matriz anterior se conserva hasta el próximo guardado: un lector que leyó el
+        # descriptor anterior justo antes del reemplazo todavía puede abrirla
+        if previa and previa not in (nombre_matriz, anterior):
+            try:
+                os.remove(os.path.join(directorio, previa))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,115 @@
+from response_cache import normalizar_consulta
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+import threading
+import logging
+import time
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class _Entrada:
+    __slots__ = ("respuesta", "embedding", "creado")
+
+    def __init__(self, respuesta: str, embedding: Optional[np.ndarray]):
+        self.respuesta = respuesta
+        self.embedding = embedding
+        self.creado = time.monotonic()
+
+
+class CacheSemantico:
+    """
+    Caché de respuestas en dos niveles.
+
+    1. Coincidencia exacta sobre la consulta normalizada.
+    2. Coincidencia por similitud coseno entre embeddings, a partir de `umbral`.
+
+    Las entradas se expulsan por LRU al superar `max_entradas` y caducan tras `ttl` segundos.
+    """
+
+    def __init__(self, max_entradas: int, ttl: float, umbral: float):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.umbral = umbral
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[str, _Entrada]" = OrderedDict()
+        self._matriz: Optional[np.ndarray] = None
+        self._claves_matriz: List[str] = []
+        self._contadores = {"exactas": 0, "similares": 0, "fallos": 0}
+
+    def buscar_exacta(self, query: str) -> Optional[str]:
+        clave = normalizar_consulta(query)
+        with self._lock:
+            entrada = self._vigente(clave)
+            if entrada is None:
+                return None
+            self._entradas.move_to_end(clave)
+            self._contadores["exactas"] += 1
+            return entrada.respuesta
+
+    def buscar_similar(self, embedding: List[float]) -> Optional[str]:
+        vector = self._normalizar_vector(embedding)
+        with self._lock:
+            if self._matriz is None:
+                self._reconstruir_matriz()
+            if not self._claves_matriz:
+                self._contadores["fallos"] += 1
+                return None
+            similitudes = self._matriz @ vector
+            mejor = int(np.argmax(similitudes))
+            clave = self._claves_matriz[mejor]
+            entrada = self._vigente(clave)
+            if entrada is None or similitudes[mejor] < self.umbral:
+                self._contadores["fallos"] += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self._contadores["similares"] += 1
+            return entrada.respuesta
+
+    def guardar(self, query: str, embedding: Optional[List[float]], respuesta: str) -> None:
+        clave = normalizar_consulta(query)
+        vector = self._normalizar_vector(embedding) if embedding is not None else None
+        with self._lock:
+            self._entradas[clave] = _Entrada(respuesta, vector)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+            self._matriz = None
+
+    def invalidar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+            self._matriz = None
+            self._claves_matriz = []
+        logger.info("Caché semántico invalidado")
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {**self._contadores, "entradas": len(self._entradas)}
+
+    def _vigente(self, clave: str) -> Optional[_Entrada]:
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        if time.monotonic() - entrada.creado > self.ttl:
+            del self._entradas[clave]
+            self._matriz = None
+            return None
+        return entrada
+
+    def _reconstruir_matriz(self) -> None:
+        claves = [clave for clave, entrada in self._entradas.items() if entrada.embedding is not None]
+        self._claves_matriz = claves
+        if claves:
+            self._matriz = np.vstack([self._entradas[clave].embedding for clave in claves])
+        else:
+            self._matriz = np.empty((0, 0), dtype=np.float32)
+
+    @staticmethod
+    def _normalizar_vector(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norma = np.linalg.norm(vector)
+        return vector / norma if norma else vector
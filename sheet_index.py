@@ -0,0 +1,232 @@
+from tenants import recurso_tenant
+from typing import Dict, List, Optional, Tuple
+import threading
+import logging
+import time
+import os
+import re
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se relee la hoja completa para recoger ediciones manuales o borrados externos
+FULL_SYNC_SECONDS = float(os.getenv("SHEET_INDEX_FULL_SYNC_SECONDS", "300"))
+# Intervalo mínimo entre sincronizaciones incrementales (solo filas nuevas)
+SYNC_SECONDS = float(os.getenv("SHEET_INDEX_SYNC_SECONDS", "5"))
+
+_RANGO_ACTUALIZADO = re.compile(r"![A-Z]+(\d+)")
+
+
+class IndiceCitas:
+    """
+    Índice en memoria de la hoja de citas.
+
+    Mantiene una copia de las filas de la hoja junto con dos índices:
+    (fecha, hora) -> fila y codigo -> fila. Las filas se numeran igual que en
+    `buscar_fila`: la posición 0 corresponde a los encabezados.
+    """
+
+    def __init__(self, sheet_id: str):
+        self.sheet_id = sheet_id
+        self._lock = threading.RLock()
+        self._filas: List[List[str]] = []
+        self._por_codigo: Dict[str, int] = {}
+        self._por_fecha: Dict[str, Dict[str, int]] = {}
+        self._col_fecha: Optional[int] = None
+        self._col_hora: Optional[int] = None
+        self._ultima_carga = 0.0
+        self._ultima_sincronizacion = 0.0
+
+    # ------------------------------------------------------------------
+    # Sincronización con la hoja
+    # ------------------------------------------------------------------
+    def sincronizar(self, sheet, forzar: bool = False) -> None:
+        """
+        Mantiene el índice al día con la hoja de cálculo.
+
+        La primera vez (y cada `SHEET_INDEX_FULL_SYNC_SECONDS`) lee la hoja completa;
+        el resto de las veces solo lee las filas añadidas después de la última conocida.
+
+        Args:
+            sheet: Recurso `spreadsheets()` del cliente de Google Sheets.
+            forzar (bool): Ignora el intervalo mínimo entre sincronizaciones.
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            if not self._filas or ahora - self._ultima_carga > FULL_SYNC_SECONDS:
+                rows = sheet.values().get(spreadsheetId=self.sheet_id, range='A:Z').execute().get('values', [])
+                self._cargar(rows)
+                logger.info(f"Índice de citas cargado con {max(len(self._filas) - 1, 0)} citas")
+                self._ultima_carga = self._ultima_sincronizacion = ahora
+                return
+
+            if not forzar and ahora - self._ultima_sincronizacion < SYNC_SECONDS:
+                return
+
+            inicio = len(self._filas) + 1
+            nuevas = sheet.values().get(
+                spreadsheetId=self.sheet_id,
+                range=f"A{inicio}:Z"
+            ).execute().get('values', [])
+            for row in nuevas:
+                self._agregar(row)
+            self._ultima_sincronizacion = ahora
+            if nuevas:
+                logger.info(f"Índice de citas: {len(nuevas)} filas nuevas sincronizadas")
+
+    def invalidar(self) -> None:
+        """Obliga a releer la hoja completa en la próxima sincronización."""
+        with self._lock:
+            self._ultima_carga = 0.0
+
+    def _cargar(self, rows: List[List[str]]) -> None:
+        self._filas = []
+        self._por_codigo = {}
+        self._por_fecha = {}
+        self._col_fecha = self._col_hora = None
+        for row in rows:
+            self._agregar(row)
+
+    def _reindexar(self) -> None:
+        self._cargar(self._filas)
+
+    def _agregar(self, row: List[str]) -> None:
+        fila = len(self._filas)
+        self._filas.append(list(row))
+        if fila == 0:
+            encabezados = self._filas[0]
+            self._col_fecha = encabezados.index("Fecha") if "Fecha" in encabezados else None
+            self._col_hora = encabezados.index("Hora") if "Hora" in encabezados else None
+            return
+        self._indexar(fila, self._filas[fila])
+
+    def _indexar(self, fila: int, row: List[str]) -> None:
+        if row and row[0]:
+            self._por_codigo[row[0]] = fila
+        slot = self._slot(row)
+        if slot:
+            self._por_fecha.setdefault(slot[0], {})[slot[1]] = fila
+
+    def _desindexar(self, fila: int, row: List[str]) -> None:
+        if row and self._por_codigo.get(row[0]) == fila:
+            del self._por_codigo[row[0]]
+        slot = self._slot(row)
+        if slot and self._por_fecha.get(slot[0], {}).get(slot[1]) == fila:
+            del self._por_fecha[slot[0]][slot[1]]
+            if not self._por_fecha[slot[0]]:
+                del self._por_fecha[slot[0]]
+
+    def _slot(self, row: List[str]) -> Optional[Tuple[str, str]]:
+        if self._col_fecha is None or self._col_hora is None:
+            return None
+        if len(row) <= max(self._col_fecha, self._col_hora):
+            return None
+        fecha, hora = row[self._col_fecha], row[self._col_hora]
+        if not fecha or not hora:
+            return None
+        return fecha, hora
+
+    # ------------------------------------------------------------------
+    # Consultas O(1)
+    # ------------------------------------------------------------------
+    @property
+    def encabezados(self) -> List[str]:
+        with self._lock:
+            return list(self._filas[0]) if self._filas else []
+
+    @property
+    def tiene_fecha_y_hora(self) -> bool:
+        with self._lock:
+            return self._col_fecha is not None and self._col_hora is not None
+
+    def buscar_codigo(self, codigo: str) -> int:
+        """
+        Devuelve la fila de la cita con el código dado, o -1 si no existe.
+        """
+        with self._lock:
+            return self._por_codigo.get(codigo, -1)
+
+    def fila(self, fila: int) -> List[str]:
+        """Devuelve una copia de los valores de la fila indicada."""
+        with self._lock:
+            return list(self._filas[fila])
+
+    def fila_ocupante(self, fecha: str, hora: str) -> int:
+        """
+        Devuelve la fila que ocupa el horario (fecha, hora), o -1 si está libre.
+        """
+        with self._lock:
+            return self._por_fecha.get(fecha, {}).get(hora, -1)
+
+    def horas_ocupadas(self, fecha: str) -> List[str]:
+        """Horas ocupadas en la fecha indicada, en el orden de la hoja."""
+        with self._lock:
+            ocupadas = self._por_fecha.get(fecha, {})
+            return [hora for hora, _ in sorted(ocupadas.items(), key=lambda item: item[1])]
+
+    def citas_en_fecha(self, fecha: str) -> List[Tuple[str, str]]:
+        """Pares (hora, código) de las citas de la fecha indicada, en el orden de la hoja."""
+        with self._lock:
+            ocupadas = self._por_fecha.get(fecha, {})
+            return [
+                (hora, self._filas[fila][0])
+                for hora, fila in sorted(ocupadas.items(), key=lambda item: item[1])
+            ]
+
+    def slot(self, row: List[str]) -> Optional[Tuple[str, str]]:
+        """(fecha, hora) de una fila con el formato de la hoja, o None si le falta alguno."""
+        with self._lock:
+            return self._slot(row)
+
+    # ------------------------------------------------------------------
+    # Actualizaciones tras escribir en la hoja
+    # ------------------------------------------------------------------
+    def registrar_fila(self, fila: int, row: List[str]) -> None:
+        """
+        Registra una fila recién añadida a la hoja.
+
+        Si la posición no coincide con la siguiente fila conocida (otro proceso
+        escribió en la hoja), se fuerza una recarga completa.
+        """
+        with self._lock:
+            if fila == len(self._filas):
+                self._agregar(row)
+            else:
+                self.invalidar()
+
+    def actualizar_fila(self, fila: int, row: List[str]) -> None:
+        """Reemplaza los valores de una fila existente."""
+        with self._lock:
+            if fila <= 0 or fila >= len(self._filas):
+                self.invalidar()
+                return
+            self._desindexar(fila, self._filas[fila])
+            self._filas[fila] = list(row)
+            self._indexar(fila, self._filas[fila])
+
+    def eliminar_fila(self, fila: int) -> None:
+        """Elimina una fila; las filas posteriores suben una posición."""
+        with self._lock:
+            if fila <= 0 or fila >= len(self._filas):
+                self.invalidar()
+                return
+            if fila == len(self._filas) - 1:
+                self._desindexar(fila, self._filas.pop())
+            else:
+                del self._filas[fila]
+                self._reindexar()
+
+
+def fila_desde_rango(rango: str) -> int:
+    """
+    Convierte el rango devuelto por `values().append` (p. ej. "Hoja 1!A12:F12")
+    en el número de fila usado por el índice (base 0), o -1 si no se reconoce.
+    """
+    match = _RANGO_ACTUALIZADO.search(rango or "")
+    return int(match.group(1)) - 1 if match else -1
+
+
+def get_indice_citas(sheet_id: str) -> IndiceCitas:
+    """Devuelve el índice compartido del proceso para la hoja indicada; se desaloja con el estado del tenant."""
+    return recurso_tenant(f"indice_citas:{sheet_id}", lambda tenant: IndiceCitas(sheet_id))
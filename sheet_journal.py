@@ -0,0 +1,352 @@
+from sheet_index import IndiceCitas, get_indice_citas
+from tenants import recurso_tenant
+from object.tenant import Tenant
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+import logging
+import sqlite3
+import json
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "/tmp/citas_journal.sqlite")
+# Cada cuánto se escriben en la hoja las mutaciones pendientes
+JOURNAL_FLUSH_SECONDS = float(os.getenv("JOURNAL_FLUSH_SECONDS", "2"))
+# Con esta cantidad de citas pendientes se escribe sin esperar el intervalo
+JOURNAL_FLUSH_MAX_PENDING = int(os.getenv("JOURNAL_FLUSH_MAX_PENDING", "50"))
+# Pestaña de la hoja (sheetId) donde están las citas
+SHEET_TAB_ID = int(os.getenv("SHEET_TAB_ID", "0"))
+
+ALTA = "alta"
+MODIFICACION = "modificacion"
+BAJA = "baja"
+
+
+def _celdas(row: List[str]) -> dict:
+    return {"values": [{"userEnteredValue": {"stringValue": str(valor)}} for valor in row]}
+
+
+class DiarioCitas:
+    """
+    Diario local y durable de las mutaciones de citas (write-behind).
+
+    Las herramientas registran altas, modificaciones y bajas por código en
+    SQLite y responden sin esperar a Google Sheets. Un hilo en segundo plano
+    combina las mutaciones pendientes (la última de cada código gana) y las
+    escribe con una sola llamada a `spreadsheets.batchUpdate`; las filas se
+    resuelven leyendo la columna A justo antes de escribir.
+
+    Las consultas (`cita`, `ocupante`, `citas_en_fecha`, `horas_ocupadas`) combinan el índice de
+    la hoja con las mutaciones pendientes, de modo que cada herramienta ve sus
+    propias escrituras. Si el proceso se detiene, las mutaciones que quedaron en
+    SQLite se vuelven a aplicar al iniciar; aplicarlas dos veces no cambia el
+    resultado (un alta ya presente se actualiza, una baja ausente se ignora).
+    """
+
+    def __init__(
+        self,
+        ruta: str,
+        sheet_id: str,
+        indice: IndiceCitas,
+        obtener_sheet: Callable[[], object],
+        intervalo: float = JOURNAL_FLUSH_SECONDS,
+        max_pendientes: int = JOURNAL_FLUSH_MAX_PENDING,
+    ):
+        self.sheet_id = sheet_id
+        self.indice = indice
+        self.obtener_sheet = obtener_sheet
+        self.intervalo = intervalo
+        self.max_pendientes = max_pendientes
+        self._lock = threading.Lock()
+        self._vaciando = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._cerrado = False
+        # código -> (id de la última mutación, tipo combinado, fila)
+        self._pendientes: Dict[str, Tuple[int, str, Optional[List[str]]]] = {}
+        # código -> [(id de la mutación, función)] a ejecutar cuando la mutación esté en la hoja
+        self._al_escribir: Dict[str, List[Tuple[int, Callable[[], None]]]] = {}
+        self._ultimo_id = 0
+        self._contadores = {"mutaciones": 0, "lotes": 0, "filas_escritas": 0, "errores": 0}
+        self._ultimo_vaciado_s = None
+
+        self._db = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS mutaciones ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, codigo TEXT NOT NULL, tipo TEXT NOT NULL, fila TEXT)"
+        )
+        self._reanudar()
+
+    # ------------------------------------------------------------------
+    # Registro de mutaciones
+    # ------------------------------------------------------------------
+    def registrar_alta(self, codigo: str, row: List[str]) -> None:
+        self._registrar(codigo, ALTA, row)
+
+    def registrar_modificacion(self, codigo: str, row: List[str]) -> None:
+        self._registrar(codigo, MODIFICACION, row)
+
+    def registrar_baja(self, codigo: str) -> None:
+        self._registrar(codigo, BAJA, None)
+
+    def _registrar(self, codigo: str, tipo: str, row: Optional[List[str]]) -> None:
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO mutaciones (codigo, tipo, fila) VALUES (?, ?, ?)",
+                (codigo, tipo, json.dumps(row) if row is not None else None),
+            )
+            self._combinar(cursor.lastrowid, codigo, tipo, row)
+            self._contadores["mutaciones"] += 1
+            pendientes = len(self._pendientes)
+        self._iniciar()
+        if pendientes >= self.max_pendientes:
+            self._despertar.set()
+
+    def al_escribir(self, codigo: str, funcion: Callable[[], None]) -> None:
+        """
+        Ejecuta `funcion` cuando la última mutación registrada de `codigo` esté escrita
+        en la hoja, o de inmediato si ya lo está.
+        """
+        with self._lock:
+            pendiente = self._pendientes.get(codigo)
+            if pendiente is not None:
+                self._al_escribir.setdefault(codigo, []).append((pendiente[0], funcion))
+                return
+        self._avisar([funcion])
+
+    @staticmethod
+    def _avisar(funciones: List[Callable[[], None]]) -> None:
+        for funcion in funciones:
+            try:
+                funcion()
+            except Exception as e:
+                logger.warning(f"Diario de citas: error al avisar una escritura: {e}")
+
+    def _combinar(self, id_mutacion: int, codigo: str, tipo: str, row: Optional[List[str]]) -> None:
+        anterior = self._pendientes.get(codigo)
+        # Una modificación de un alta que aún no llega a la hoja sigue siendo un alta
+        if tipo == MODIFICACION and anterior and anterior[1] == ALTA:
+            tipo = ALTA
+        self._pendientes[codigo] = (id_mutacion, tipo, list(row) if row is not None else None)
+        self._ultimo_id = max(self._ultimo_id, id_mutacion)
+
+    def _reanudar(self) -> None:
+        for id_mutacion, codigo, tipo, fila in self._db.execute("SELECT id, codigo, tipo, fila FROM mutaciones ORDER BY id"):
+            self._combinar(id_mutacion, codigo, tipo, json.loads(fila) if fila else None)
+        if self._pendientes:
+            logger.info(f"Diario de citas: {len(self._pendientes)} citas pendientes de escribir en la hoja")
+            self._iniciar()
+
+    # ------------------------------------------------------------------
+    # Lecturas que incluyen las mutaciones pendientes
+    # ------------------------------------------------------------------
+    def cita(self, codigo: str) -> Optional[List[str]]:
+        """Fila vigente de la cita con el código dado, o None si no existe o fue borrada."""
+        with self._lock:
+            pendiente = self._pendientes.get(codigo)
+        if pendiente is not None:
+            return list(pendiente[2]) if pendiente[2] is not None else None
+        from utils import buscar_fila
+
+        fila = buscar_fila(codigo)
+        return self.indice.fila(fila) if fila != -1 else None
+
+    def ocupante(self, fecha: str, hora: str) -> Optional[str]:
+        """Código de la cita que ocupa el horario (fecha, hora), o None si está libre."""
+        with self._lock:
+            pendientes = dict(self._pendientes)
+        for codigo, (_, tipo, row) in pendientes.items():
+            if tipo != BAJA and self.indice.slot(row) == (fecha, hora):
+                return codigo
+        fila = self.indice.fila_ocupante(fecha, hora)
+        if fila != -1:
+            codigo = self.indice.fila(fila)[0]
+            if codigo not in pendientes:
+                return codigo
+        return None
+
+    def citas_en_fecha(self, fecha: str) -> List[Tuple[str, str]]:
+        """(hora, código) de las citas de la fecha: las de la hoja más las pendientes, sin las borradas o movidas."""
+        with self._lock:
+            pendientes = dict(self._pendientes)
+        citas = [(hora, codigo) for hora, codigo in self.indice.citas_en_fecha(fecha) if codigo not in pendientes]
+        for codigo, (_, tipo, row) in pendientes.items():
+            slot = self.indice.slot(row) if tipo != BAJA else None
+            if slot and slot[0] == fecha:
+                citas.append((slot[1], codigo))
+        return citas
+
+    def horas_ocupadas(self, fecha: str) -> List[str]:
+        """Horas ocupadas en la fecha: las de la hoja más las pendientes, sin las borradas o movidas."""
+        return [hora for hora, _ in self.citas_en_fecha(fecha)]
+
+    # ------------------------------------------------------------------
+    # Escritura en la hoja
+    # ------------------------------------------------------------------
+    def vaciar(self) -> int:
+        """
+        Escribe en la hoja las mutaciones pendientes con un único `batchUpdate`.
+
+        Returns:
+            int: Cantidad de citas escritas.
+        """
+        with self._vaciando:
+            with self._lock:
+                lote = dict(self._pendientes)
+                hasta_id = self._ultimo_id
+            if not lote:
+                return 0
+
+            inicio = time.perf_counter()
+            sheet = self.obtener_sheet()
+            columna = sheet.values().get(spreadsheetId=self.sheet_id, range="A:A").execute().get("values", [])
+            filas = {row[0]: i for i, row in enumerate(columna) if row and i > 0}
+
+            requests = self._construir_requests(lote, filas)
+            if requests:
+                sheet.batchUpdate(spreadsheetId=self.sheet_id, body={"requests": requests}).execute()
+
+            # El índice se recarga antes de soltar las pendientes para que las lecturas
+            # nunca vean la hoja sin las mutaciones recién escritas
+            self.indice.invalidar()
+            self.indice.sincronizar(sheet)
+            escritas = []
+            with self._lock:
+                for codigo, (id_mutacion, _, _) in lote.items():
+                    if self._pendientes.get(codigo, (None,))[0] == id_mutacion:
+                        del self._pendientes[codigo]
+                    esperando = self._al_escribir.pop(codigo, [])
+                    escritas += [funcion for id_esperado, funcion in esperando if id_esperado <= id_mutacion]
+                    restantes = [(id_esperado, funcion) for id_esperado, funcion in esperando if id_esperado > id_mutacion]
+                    if restantes:
+                        self._al_escribir[codigo] = restantes
+                self._db.execute("DELETE FROM mutaciones WHERE id <= ?", (hasta_id,))
+                self._contadores["lotes"] += 1
+                self._contadores["filas_escritas"] += len(lote)
+                self._ultimo_vaciado_s = round(time.perf_counter() - inicio, 3)
+            logger.info(f"Diario de citas: {len(lote)} citas escritas en {len(requests)} operaciones de un batchUpdate")
+            self._avisar(escritas)
+            return len(lote)
+
+    def _construir_requests(self, lote: Dict[str, Tuple[int, str, Optional[List[str]]]], filas: Dict[str, int]) -> List[dict]:
+        actualizaciones, borrados, altas = [], [], []
+        for codigo, (_, tipo, row) in lote.items():
+            fila = filas.get(codigo)
+            if tipo == BAJA:
+                if fila is not None:
+                    borrados.append(fila)
+            elif fila is not None:
+                # Un alta que ya está en la hoja (reintento tras una caída) se actualiza
+                actualizaciones.append({
+                    "updateCells": {
+                        "range": {
+                            "sheetId": SHEET_TAB_ID,
+                            "startRowIndex": fila,
+                            "endRowIndex": fila + 1,
+                            "startColumnIndex": 0,
+                            "endColumnIndex": len(row),
+                        },
+                        "rows": [_celdas(row)],
+                        "fields": "userEnteredValue",
+                    }
+                })
+            elif tipo == ALTA:
+                altas.append(_celdas(row))
+            else:
+                logger.warning(f"Diario de citas: la cita {codigo} ya no está en la hoja, se omite la modificación")
+
+        # Las actualizaciones usan las filas leídas; los borrados van de abajo hacia arriba para
+        # no desplazar las filas que faltan por borrar, y las altas se agregan al final
+        requests = actualizaciones
+        requests += [
+            {
+                "deleteDimension": {
+                    "range": {"sheetId": SHEET_TAB_ID, "dimension": "ROWS", "startIndex": fila, "endIndex": fila + 1}
+                }
+            }
+            for fila in sorted(borrados, reverse=True)
+        ]
+        if altas:
+            requests.append({"appendCells": {"sheetId": SHEET_TAB_ID, "rows": altas, "fields": "userEnteredValue"}})
+        return requests
+
+    # ------------------------------------------------------------------
+    # Hilo de escritura
+    # ------------------------------------------------------------------
+    def _iniciar(self) -> None:
+        with self._lock:
+            if self._hilo is not None:
+                return
+            self._hilo = threading.Thread(target=self._ciclo, name="diario-citas", daemon=True)
+            self._hilo.start()
+
+    def _ciclo(self) -> None:
+        espera = self.intervalo
+        while not self._cerrado:
+            self._despertar.wait(espera)
+            self._despertar.clear()
+            if self._cerrado:
+                return
+            try:
+                self.vaciar()
+                espera = self.intervalo
+            except Exception as e:
+                # Las mutaciones siguen en SQLite: se reintenta con espera creciente
+                with self._lock:
+                    self._contadores["errores"] += 1
+                espera = min(espera * 2, 60.0)
+                logger.error(f"Diario de citas: error al escribir en la hoja, reintento en {espera:.0f} s: {e}")
+
+    def cerrar(self) -> None:
+        """
+        Escribe las mutaciones pendientes y detiene el hilo de escritura.
+
+        Lo que no se pueda escribir sigue en SQLite y se reanuda la próxima vez que se
+        abra el diario de la misma hoja.
+        """
+        self._cerrado = True
+        self._despertar.set()
+        try:
+            self.vaciar()
+        except Exception as e:
+            logger.warning(f"Diario de citas: quedan mutaciones pendientes al cerrar: {e}")
+        hilo = self._hilo
+        if hilo is not None:
+            hilo.join(timeout=5)
+            if hilo.is_alive():
+                return
+        self._db.close()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"pendientes": len(self._pendientes), "ultimo_vaciado_s": self._ultimo_vaciado_s, **self._contadores}
+
+
+def ruta_diario(tenant: Tenant) -> str:
+    """SQLite del diario del tenant: JOURNAL_PATH para el tenant por defecto, `<base>.<id><ext>` para los demás."""
+    if not tenant.ambito:
+        return JOURNAL_PATH
+    base, extension = os.path.splitext(JOURNAL_PATH)
+    return f"{base}.{tenant.id}{extension}"
+
+
+def get_diario_citas() -> DiarioCitas:
+    """Devuelve el diario del tenant actual; al crearlo reanuda las mutaciones pendientes."""
+
+    def crear(tenant: Tenant) -> DiarioCitas:
+        from utils import get_google_sheets_service
+
+        return DiarioCitas(
+            ruta=ruta_diario(tenant),
+            sheet_id=tenant.sheet_id,
+            indice=get_indice_citas(tenant.sheet_id),
+            obtener_sheet=lambda: get_google_sheets_service().spreadsheets(),
+        )
+
+    return recurso_tenant("diario_citas", crear, DiarioCitas.cerrar)
@@ -0,0 +1,126 @@
+"""
+Medición del arranque en frío.
+
+Dentro del proceso, `fase()` cronometra cada etapa de inicialización (importar el
+grafo, construirlo, crear clientes) y `reporte_arranque()` las resume.
+
+Como script, importa el punto de entrada con `python -X importtime` y agrupa el
+tiempo de importación por paquete, para detectar regresiones del arranque:
+
+    python startup_profile.py
+    python startup_profile.py --inicializar --top 15
+"""
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Dict, List, Tuple
+import subprocess
+import threading
+import argparse
+import json
+import time
+import sys
+
+_inicio = time.perf_counter()
+_fases: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+@contextmanager
+def fase(nombre: str):
+    """Registra la duración de una etapa de inicialización."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _fases[nombre] = _fases.get(nombre, 0.0) + time.perf_counter() - inicio
+
+
+def reporte_arranque() -> dict:
+    """Duración de cada etapa registrada y tiempo transcurrido desde que se importó este módulo."""
+    with _lock:
+        return {
+            "fases_ms": {nombre: round(duracion * 1000, 1) for nombre, duracion in _fases.items()},
+            "desde_importacion_ms": round((time.perf_counter() - _inicio) * 1000, 1),
+        }
+
+
+def parsear_importtime(salida: str) -> Dict[str, Tuple[float, float]]:
+    """
+    Agrupa la salida de `-X importtime` por paquete de primer nivel.
+
+    Returns:
+        Dict[str, Tuple[float, float]]: paquete -> (tiempo propio en ms, tiempo acumulado en ms).
+            El acumulado cuenta cada punto donde otro paquete importa a este, sin sumar dos veces
+            sus importaciones internas.
+    """
+    entradas = []
+    for linea in salida.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        partes = linea[len("import time:"):].split("|")
+        if len(partes) != 3:
+            continue
+        nombre = partes[2]
+        profundidad = (len(nombre) - len(nombre.lstrip())) // 2
+        entradas.append((profundidad, nombre.strip().split(".")[0], int(partes[0]), int(partes[1])))
+
+    propio: Dict[str, float] = defaultdict(float)
+    acumulado: Dict[str, float] = defaultdict(float)
+    # importtime imprime cada módulo después de sus dependencias: se recorre al revés para
+    # conocer el padre de cada entrada y sumar el acumulado solo donde entra el paquete
+    pila: List[Tuple[int, str]] = []
+    for profundidad, paquete, self_us, cumulativo_us in reversed(entradas):
+        while pila and pila[-1][0] >= profundidad:
+            pila.pop()
+        propio[paquete] += self_us / 1000
+        if not pila or pila[-1][1] != paquete:
+            acumulado[paquete] += cumulativo_us / 1000
+        pila.append((profundidad, paquete))
+    return {paquete: (propio[paquete], acumulado[paquete]) for paquete in propio}
+
+
+def perfilar(modulo: str, inicializar: bool) -> Tuple[Dict[str, Tuple[float, float]], dict]:
+    codigo = (
+        f"import json, {modulo}\n"
+        + (f"{modulo}.get_graph()\n" if inicializar else "")
+        + "from startup_profile import reporte_arranque\n"
+        + "print(json.dumps(reporte_arranque()))\n"
+    )
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo],
+        capture_output=True,
+        text=True,
+    )
+    if proceso.returncode != 0:
+        raise RuntimeError(f"Error al importar {modulo}:\n{proceso.stderr[-2000:]}")
+    fases = json.loads(proceso.stdout.strip().splitlines()[-1])
+    return parsear_importtime(proceso.stderr), fases
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Reporte de tiempos de arranque en frío")
+    parser.add_argument("--modulo", default="lambda_function")
+    parser.add_argument("--inicializar", action="store_true", help="También construye el grafo (requiere credenciales)")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="Imprime el reporte completo en JSON")
+    args = parser.parse_args(argv)
+
+    paquetes, fases = perfilar(args.modulo, args.inicializar)
+    if args.json:
+        print(json.dumps({"paquetes_ms": paquetes, **fases}, indent=2))
+        return
+
+    total = sum(propio for propio, _ in paquetes.values())
+    print(f"Importaciones: {total:.1f} ms en {len(paquetes)} paquetes")
+    print(f"{'paquete':<32}{'propio ms':>12}{'acumulado ms':>14}")
+    for paquete, (propio, acumulado) in sorted(paquetes.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"{paquete:<32}{propio:>12.1f}{acumulado:>14.1f}")
+    print("\nFases de inicialización:")
+    for nombre, duracion in fases["fases_ms"].items():
+        print(f"  {nombre:<30}{duracion:>10.1f} ms")
+    print(f"  {'total desde importación':<30}{fases['desde_importacion_ms']:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
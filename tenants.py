@@ -0,0 +1,307 @@
+from object.tenant import Tenant
+from contextlib import contextmanager
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, TypeVar
+from functools import lru_cache, wraps
+import threading
+import logging
+import hmac
+import json
+import time
+import gc
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Archivo JSON con la lista de tenants (ver `object/tenant.py`); sin él se atiende un solo
+# negocio configurado con SHEET_ID, TWILIO_NUMBER, PROMPT_BUCKET_NAME, NAME_FILE e INDEX_NAME
+TENANTS_FILE = os.getenv("TENANTS_FILE")
+# Máximo de tenants con estado en memoria (grafo compilado, índice de la hoja, cachés)
+TENANT_MAX_ACTIVE = int(os.getenv("TENANT_MAX_ACTIVE", "32"))
+# Memoria residente del proceso a partir de la cual se desaloja el estado de los tenants inactivos (0 = sin límite)
+TENANT_MEMORY_BUDGET_MB = float(os.getenv("TENANT_MEMORY_BUDGET_MB", "0"))
+
+T = TypeVar("T")
+
+
+def _normalizar_numero(numero: str) -> str:
+    return (numero or "").replace("whatsapp:", "").strip()
+
+
+class DirectorioTenants:
+    """
+    Tenants configurados, por id y por número de WhatsApp.
+
+    El tenant por defecto atiende los mensajes a números no configurados y el
+    trabajo fuera de una petición (scripts, benchmarks): es el configurado con las
+    variables de entorno de un solo negocio o, si no existe, el primero del archivo.
+    """
+
+    def __init__(self, tenants: List[Tenant]):
+        self._por_id: Dict[str, Tenant] = {}
+        self._por_numero: Dict[str, Tenant] = {}
+        for tenant in tenants:
+            if tenant.id in self._por_id:
+                raise ValueError(f"Tenant duplicado: {tenant.id}")
+            numero = _normalizar_numero(tenant.twilio_number)
+            if numero in self._por_numero:
+                raise ValueError(f"Los tenants {self._por_numero[numero].id} y {tenant.id} tienen el mismo número: {numero}")
+            self._por_id[tenant.id] = tenant
+            self._por_numero[numero] = tenant
+        # El tenant por defecto usa claves sin prefijo: dos compartirían historial, reservas y diario
+        por_defecto = [t.id for t in tenants if t.por_defecto]
+        if len(por_defecto) > 1:
+            raise ValueError(
+                f"Solo un tenant puede ser el por defecto: {', '.join(por_defecto)} "
+                "(el configurado con SHEET_ID lo es; en TENANTS_FILE usa el mismo id o quita SHEET_ID)"
+            )
+        self.por_defecto = next((t for t in tenants if t.por_defecto), tenants[0] if tenants else None)
+
+    def resolver(self, numero: str) -> Optional[Tenant]:
+        """Tenant del número de WhatsApp que recibió el mensaje (campo `To` del webhook)."""
+        tenant = self._por_numero.get(_normalizar_numero(numero))
+        if tenant is None and self.por_defecto is not None and self.por_defecto.por_defecto:
+            return self.por_defecto
+        return tenant
+
+    def obtener(self, id_tenant: str) -> Optional[Tenant]:
+        return self._por_id.get(id_tenant)
+
+    def por_token_reportes(self, token: str) -> Optional[Tenant]:
+        """Tenant dueño del token de reportes, o None si ningún tenant lo tiene."""
+        if not token:
+            return None
+        # Comparación en tiempo constante para no filtrar el token por la latencia
+        return next((t for t in self._por_id.values() if t.reportes_token and hmac.compare_digest(t.reportes_token, token)), None)
+
+    def todos(self) -> List[Tenant]:
+        return list(self._por_id.values())
+
+
+def tenant_de_entorno() -> Optional[Tenant]:
+    if not os.getenv("SHEET_ID"):
+        return None
+    return Tenant(
+        id=os.getenv("TENANT_ID", "default"),
+        twilio_number=os.getenv("TWILIO_NUMBER", ""),
+        sheet_id=os.getenv("SHEET_ID"),
+        prompt_bucket=os.getenv("PROMPT_BUCKET_NAME"),
+        prompt_file=os.getenv("NAME_FILE"),
+        index_name=os.getenv("INDEX_NAME"),
+        namespace=os.getenv("PINECONE_NAMESPACE") or None,
+        reportes_token=os.getenv("REPORTES_TOKEN") or None,
+        por_defecto=True,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_directorio() -> DirectorioTenants:
+    tenants = []
+    if TENANTS_FILE:
+        with open(TENANTS_FILE, encoding="utf-8") as f:
+            tenants = [Tenant(**datos) for datos in json.load(f)]
+        # Sin hoja el tenant fallaría recién en su primera cita: se rechaza al arrancar
+        sin_hoja = [tenant.id for tenant in tenants if not (tenant.sheet_id or "").strip()]
+        if sin_hoja:
+            raise ValueError(f"{TENANTS_FILE}: tenants sin sheet_id: {', '.join(sin_hoja)}")
+    entorno = tenant_de_entorno()
+    if entorno is not None and all(t.id != entorno.id for t in tenants):
+        tenants.insert(0, entorno)
+    if not tenants:
+        # Sin configuración (p. ej. en scripts): un tenant vacío para no romper los valores por defecto
+        tenants = [Tenant(id="default", twilio_number=os.getenv("TWILIO_NUMBER", ""), por_defecto=True)]
+    return DirectorioTenants(tenants)
+
+
+# ----------------------------------------------------------------------
+# Tenant de la petición en curso
+# ----------------------------------------------------------------------
+_tenant_actual: ContextVar[Optional[Tenant]] = ContextVar("tenant_actual", default=None)
+
+
+def get_tenant() -> Tenant:
+    """Tenant del contexto actual o, fuera de una petición, el tenant por defecto."""
+    tenant = _tenant_actual.get()
+    return tenant if tenant is not None else get_directorio().por_defecto
+
+
+@contextmanager
+def usar_tenant(tenant: Tenant):
+    """
+    Fija el tenant del contexto durante el bloque.
+
+    Mientras dura el bloque su estado no se desaloja. El contexto se copia a
+    `run_in_threadpool` y a las colas de trabajo, así que las herramientas y los
+    envíos del turno ven el mismo tenant.
+    """
+    token = _tenant_actual.set(tenant)
+    recursos_tenants.fijar(tenant.id)
+    try:
+        yield tenant
+    finally:
+        recursos_tenants.soltar(tenant.id)
+        _tenant_actual.reset(token)
+
+
+def con_tenant(funcion):
+    """Decorador: ejecuta la función con el tenant del contexto fijado (ver `usar_tenant`)."""
+
+    @wraps(funcion)
+    def envuelta(*args, **kwargs):
+        with usar_tenant(get_tenant()):
+            return funcion(*args, **kwargs)
+
+    return envuelta
+
+
+# ----------------------------------------------------------------------
+# Estado por tenant
+# ----------------------------------------------------------------------
+def memoria_proceso() -> int:
+    """Memoria residente del proceso en bytes, o 0 si el sistema no la informa."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class _Ranura:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.recursos: Dict[str, tuple] = {}
+        self.en_uso = 0
+        self.ultimo_uso = time.monotonic()
+
+
+class RecursosTenants:
+    """
+    Estado de cada tenant que se construye bajo demanda y se desaloja en orden LRU.
+
+    `obtener` crea el recurso la primera vez que un tenant lo pide y lo reutiliza
+    después. Cuando hay más de `max_activos` tenants con estado, o la memoria del
+    proceso supera `presupuesto_bytes`, se descarta el estado completo de los
+    tenants menos usados que no tienen turnos en curso. Se llama al `cerrar` de
+    cada recurso y el tenant vuelve a construirse en su próximo mensaje.
+
+    Args:
+        max_activos (int): Tenants con estado en memoria.
+        presupuesto_bytes (int): Memoria residente máxima del proceso (0 = sin límite).
+        medir_memoria: Función que devuelve la memoria actual en bytes.
+    """
+
+    def __init__(self, max_activos: int = TENANT_MAX_ACTIVE, presupuesto_bytes: int = int(TENANT_MEMORY_BUDGET_MB * 1024 * 1024),
+                 medir_memoria: Callable[[], int] = memoria_proceso):
+        self.max_activos = max_activos
+        self.presupuesto_bytes = presupuesto_bytes
+        self.medir_memoria = medir_memoria
+        self._lock = threading.Lock()
+        self._ranuras: "OrderedDict[str, _Ranura]" = OrderedDict()
+        self._contadores = {"construidos": 0, "desalojados": 0}
+
+    def obtener(self, id_tenant: str, nombre: str, crear: Callable[[], T], cerrar: Optional[Callable[[T], None]] = None) -> T:
+        ranura = self._ranura(id_tenant)
+        recurso = ranura.recursos.get(nombre)
+        if recurso is not None:
+            return recurso[0]
+        # La construcción (p. ej. compilar el grafo) no bloquea a los demás tenants
+        with ranura.lock:
+            recurso = ranura.recursos.get(nombre)
+            if recurso is None:
+                recurso = ranura.recursos[nombre] = (crear(), cerrar)
+                with self._lock:
+                    self._contadores["construidos"] += 1
+            else:
+                return recurso[0]
+        self.desalojar()
+        return recurso[0]
+
+    def _ranura(self, id_tenant: str) -> _Ranura:
+        with self._lock:
+            ranura = self._ranuras.get(id_tenant)
+            if ranura is None:
+                ranura = self._ranuras[id_tenant] = _Ranura()
+            self._ranuras.move_to_end(id_tenant)
+            ranura.ultimo_uso = time.monotonic()
+            return ranura
+
+    def fijar(self, id_tenant: str) -> None:
+        ranura = self._ranura(id_tenant)
+        with self._lock:
+            ranura.en_uso += 1
+
+    def soltar(self, id_tenant: str) -> None:
+        with self._lock:
+            ranura = self._ranuras.get(id_tenant)
+            if ranura is not None:
+                ranura.en_uso -= 1
+
+    def desalojar(self) -> None:
+        """Descarta el estado de los tenants inactivos mientras se excedan los límites."""
+        while True:
+            memoria = self.medir_memoria() if self.presupuesto_bytes else 0
+            with self._lock:
+                con_estado = [(i, r) for i, r in self._ranuras.items() if r.recursos]
+                excede_cantidad = len(con_estado) > self.max_activos
+                excede_memoria = bool(self.presupuesto_bytes) and memoria > self.presupuesto_bytes
+                if not (excede_cantidad or excede_memoria):
+                    break
+                victima = next(((i, r) for i, r in con_estado if r.en_uso == 0), None)
+                # Con un solo tenant con estado no hay a quién desalojar: el límite no se puede cumplir
+                if victima is None or len(con_estado) == 1:
+                    break
+                id_tenant, ranura = victima
+                del self._ranuras[id_tenant]
+                self._contadores["desalojados"] += 1
+            logger.info(f"Estado del tenant {id_tenant} desalojado ({'memoria' if excede_memoria else 'cantidad'})")
+            self._cerrar(ranura)
+            if excede_memoria:
+                # El grafo y los clientes tienen ciclos de referencias: sin esto la memoria no baja
+                gc.collect()
+
+    @staticmethod
+    def _cerrar(ranura: _Ranura) -> None:
+        with ranura.lock:
+            recursos, ranura.recursos = ranura.recursos, {}
+        for nombre, (valor, cerrar) in recursos.items():
+            if cerrar is None:
+                continue
+            try:
+                cerrar(valor)
+            except Exception as e:
+                logger.warning(f"No se pudo cerrar {nombre}: {e}")
+
+    def estadisticas(self) -> dict:
+        ahora = time.monotonic()
+        with self._lock:
+            tenants = {
+                id_tenant: {"recursos": sorted(ranura.recursos), "en_uso": ranura.en_uso,
+                            "inactivo_s": round(ahora - ranura.ultimo_uso, 1)}
+                for id_tenant, ranura in self._ranuras.items() if ranura.recursos
+            }
+            contadores = dict(self._contadores)
+        return {
+            **contadores,
+            "activos": len(tenants),
+            "max_activos": self.max_activos,
+            "memoria_mb": round(self.medir_memoria() / (1024 * 1024), 1),
+            "presupuesto_mb": round(self.presupuesto_bytes / (1024 * 1024), 1),
+            "tenants": tenants,
+        }
+
+
+recursos_tenants = RecursosTenants()
+
+
+def recurso_tenant(nombre: str, crear: Callable[[Tenant], T], cerrar: Optional[Callable[[T], None]] = None) -> T:
+    """
+    Recurso `nombre` del tenant actual, construido con `crear(tenant)` la primera vez.
+
+    Ejemplo de uso:
+        indice = recurso_tenant("indice_citas", lambda tenant: IndiceCitas(tenant.sheet_id))
+    """
+    tenant = get_tenant()
+    return recursos_tenants.obtener(tenant.id, nombre, lambda: crear(tenant), cerrar)
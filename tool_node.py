@@ -0,0 +1,177 @@
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.tools import BaseTool
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from observability import span
+from typing import Dict, Iterable, List
+import contextvars
+import logging
+import asyncio
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "30"))
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+
+# Tiempos máximos por herramienta; las que no aparecen usan TOOL_TIMEOUT_SECONDS
+TIEMPOS_MAXIMOS = {
+    "validate_date": 2.0,
+    "get_next_day": 2.0,
+    "resolver_fechas": 2.0,
+    "consultar_disponibilidad": 15.0,
+    "lookup_project_info": 20.0,
+}
+
+# Hilos compartidos por todas las conversaciones. Una herramienta que excede su tiempo
+# sigue ocupando su hilo hasta terminar, pero el turno no la espera.
+_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="herramientas")
+
+
+def mensaje_error(error: Exception, tool_call: dict) -> ToolMessage:
+    return ToolMessage(
+        content=f"Error: {repr(error)}\n please fix your mistakes.",
+        tool_call_id=tool_call["id"],
+        name=tool_call["name"],
+        status="error",
+    )
+
+
+class NodoHerramientas:
+    """
+    Nodo del grafo que ejecuta en paralelo las llamadas a herramientas de un mensaje.
+
+    Las llamadas independientes corren a la vez (en hilos o como corrutinas,
+    según el grafo se ejecute con `stream` o `astream`) y cada una tiene su
+    tiempo máximo: el turno tarda lo que la llamada más lenta. Las herramientas
+    de `secuenciales` (las que escriben en la hoja) se ejecutan juntas, una tras
+    otra y en el orden en que las pidió el modelo.
+
+    Los errores y los tiempos agotados se devuelven al modelo como `ToolMessage`
+    de error, igual que `handle_tool_error`, para que pueda corregir la llamada.
+    """
+
+    def __init__(
+        self,
+        tools: List[BaseTool],
+        secuenciales: Iterable[str] = (),
+        tiempos_maximos: Dict[str, float] = TIEMPOS_MAXIMOS,
+        tiempo_por_defecto: float = TOOL_TIMEOUT_SECONDS,
+    ):
+        self.tools = {tool.name: tool for tool in tools}
+        self.secuenciales = frozenset(secuenciales)
+        self.tiempos_maximos = tiempos_maximos
+        self.tiempo_por_defecto = tiempo_por_defecto
+
+    def runnable(self) -> RunnableLambda:
+        return RunnableLambda(self.invocar, afunc=self.ainvocar, name="tools")
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+    def invocar(self, state: dict, config: RunnableConfig) -> dict:
+        with span("graph_node", node="tools"):
+            return self._invocar(state, config)
+
+    async def ainvocar(self, state: dict, config: RunnableConfig) -> dict:
+        with span("graph_node", node="tools"):
+            return await self._ainvocar(state, config)
+
+    def _invocar(self, state: dict, config: RunnableConfig) -> dict:
+        grupos = self._agrupar(self._tool_calls(state))
+        inicio = time.monotonic()
+        futuros = [
+            _executor.submit(contextvars.copy_context().run, self._ejecutar_grupo, grupo, config)
+            for grupo in grupos
+        ]
+        mensajes: Dict[str, ToolMessage] = {}
+        for grupo, futuro in zip(grupos, futuros):
+            restante = max(inicio + self._tiempo_grupo(grupo) - time.monotonic(), 0.0)
+            try:
+                mensajes.update(futuro.result(timeout=restante))
+            except FuturesTimeoutError:
+                mensajes.update(self._tiempo_agotado(grupo))
+        return self._en_orden(state, mensajes)
+
+    async def _ainvocar(self, state: dict, config: RunnableConfig) -> dict:
+        grupos = self._agrupar(self._tool_calls(state))
+
+        async def con_tiempo(grupo: List[dict]) -> Dict[str, ToolMessage]:
+            try:
+                return await asyncio.wait_for(self._aejecutar_grupo(grupo, config), self._tiempo_grupo(grupo))
+            except asyncio.TimeoutError:
+                return self._tiempo_agotado(grupo)
+
+        mensajes: Dict[str, ToolMessage] = {}
+        for resultado in await asyncio.gather(*(con_tiempo(grupo) for grupo in grupos)):
+            mensajes.update(resultado)
+        return self._en_orden(state, mensajes)
+
+    def _ejecutar_grupo(self, grupo: List[dict], config: RunnableConfig) -> Dict[str, ToolMessage]:
+        mensajes = {}
+        for tool_call in grupo:
+            try:
+                with span("tool", tool=tool_call["name"]):
+                    mensajes[tool_call["id"]] = self._tool(tool_call).invoke({**tool_call, "type": "tool_call"}, config)
+            except Exception as e:
+                mensajes[tool_call["id"]] = mensaje_error(e, tool_call)
+        return mensajes
+
+    async def _aejecutar_grupo(self, grupo: List[dict], config: RunnableConfig) -> Dict[str, ToolMessage]:
+        mensajes = {}
+        for tool_call in grupo:
+            try:
+                with span("tool", tool=tool_call["name"]):
+                    mensajes[tool_call["id"]] = await self._tool(tool_call).ainvoke({**tool_call, "type": "tool_call"}, config)
+            except Exception as e:
+                mensajes[tool_call["id"]] = mensaje_error(e, tool_call)
+        return mensajes
+
+    # ------------------------------------------------------------------
+    # Auxiliares
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _tool_calls(state: dict) -> List[dict]:
+        message = state["messages"][-1]
+        return message.tool_calls if isinstance(message, AIMessage) else []
+
+    def _tool(self, tool_call: dict) -> BaseTool:
+        if tool_call["name"] not in self.tools:
+            raise ValueError(f"La herramienta {tool_call['name']} no existe. Usa una de: {', '.join(self.tools)}")
+        return self.tools[tool_call["name"]]
+
+    def _agrupar(self, tool_calls: List[dict]) -> List[List[dict]]:
+        """Cada llamada independiente forma su propio grupo; las secuenciales comparten uno."""
+        grupos: List[List[dict]] = []
+        secuencial: List[dict] = []
+        for tool_call in tool_calls:
+            if tool_call["name"] in self.secuenciales:
+                if not secuencial:
+                    grupos.append(secuencial)
+                secuencial.append(tool_call)
+            else:
+                grupos.append([tool_call])
+        return grupos
+
+    def _tiempo_grupo(self, grupo: List[dict]) -> float:
+        return sum(self.tiempos_maximos.get(tool_call["name"], self.tiempo_por_defecto) for tool_call in grupo)
+
+    def _tiempo_agotado(self, grupo: List[dict]) -> Dict[str, ToolMessage]:
+        mensajes = {}
+        for tool_call in grupo:
+            logger.warning(f"Tiempo agotado en la herramienta {tool_call['name']}")
+            aviso = f"Error: la herramienta {tool_call['name']} no respondió a tiempo."
+            if tool_call["name"] in self.secuenciales:
+                aviso += " La operación pudo haberse completado: verifica antes de reintentar."
+            mensajes[tool_call["id"]] = ToolMessage(
+                content=aviso, tool_call_id=tool_call["id"], name=tool_call["name"], status="error"
+            )
+        return mensajes
+
+    @staticmethod
+    def _en_orden(state: dict, mensajes: Dict[str, ToolMessage]) -> dict:
+        tool_calls = NodoHerramientas._tool_calls(state)
+        return {"messages": [mensajes[tool_call["id"]] for tool_call in tool_calls]}
@@ -1,18 +1,129 @@
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from object.informacion_cita import InformacionCita
-from utils import buscar_fila, generar_codigo_cita, get_colombia_time, get_google_sheets_service
-from datetime import datetime, timedelta
-from langchain_core.tools import tool
+from utils import generar_codigo_cita, get_colombia_time, get_google_sheets_service
+from sheet_index import get_indice_citas
+from sheet_journal import get_diario_citas
+from reservas import HorarioReservado, get_reservas, reservar
+from calendario import FORMATO_FECHA, franjas_reserva, get_calendario, parsear_fecha, parsear_hora, resolver_fechas
+from datetime import date, datetime, timedelta
+from langchain_core.tools import StructuredTool, tool
 from pydantic import ValidationError
+from semantic_cache import CacheSemantico
+from tenants import get_tenant, recurso_tenant
+from retriever import LOCAL_INDEX_PATH, RETRIEVER_BACKEND, RecuperadorLocal, RecuperadorPinecone
+from observability import callbacks_llm, span
+from functools import lru_cache
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 import logging
+import asyncio
+import time
 import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@tool
-def lookup_project_info(query: str) -> str:
+load_dotenv()
+
+# Máximo de días que devuelve una consulta de disponibilidad
+DISPONIBILIDAD_MAX_DIAS = int(os.getenv("DISPONIBILIDAD_MAX_DIAS", "7"))
+
+# Herramientas que escriben en la hoja: dentro de un mismo mensaje se ejecutan en el orden
+# pedido por el modelo. Entre conversaciones, las reservas por horario y por cita evitan que
+# la validación de conflictos y la escritura se intercalen.
+HERRAMIENTAS_ESCRITURA = frozenset({"write_to_sheet_with_validation", "modify_sheet", "erase_from_sheet"})
+# Cuánto espera una modificación o un borrado a que termine otra operación sobre la misma cita
+RESERVA_ESPERA_SECONDS = float(os.getenv("RESERVA_ESPERA_SECONDS", "5"))
+
+# Clientes compartidos: se crean en el primer uso y se reutilizan entre llamadas
+@lru_cache(maxsize=None)
+def get_embeddings():
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings()
+
+@lru_cache(maxsize=None)
+def get_pinecone():
+    # Un solo cliente (y pool de conexiones) para los índices de todos los tenants
+    from pinecone import Pinecone
+    return Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+
+def get_vectorstore():
+    # Índice y namespace del tenant actual (por defecto INDEX_NAME)
+    from langchain_pinecone import PineconeVectorStore
+
+    def crear(tenant):
+        index = get_pinecone().Index(tenant.index_name or os.getenv('INDEX_NAME'))
+        return PineconeVectorStore(index=index, embedding=get_embeddings(), namespace=tenant.namespace)
+
+    return recurso_tenant("vectorstore", crear)
+
+def get_retriever():
+    # Con RETRIEVER_BACKEND=local las búsquedas no salen del proceso (ver ingest.py --destino local)
+    if RETRIEVER_BACKEND == "local":
+        return recurso_tenant("retriever", lambda tenant: RecuperadorLocal(tenant.local_index_path or LOCAL_INDEX_PATH))
+    return recurso_tenant("retriever", lambda tenant: RecuperadorPinecone(lambda: get_vectorstore(), tenant.namespace))
+
+@lru_cache(maxsize=None)
+def get_llm_consulta():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=os.getenv('GPT_MODEL'), max_tokens=180, callbacks=callbacks_llm())
+
+
+class CacheConsultas(CacheSemantico):
+    """
+    Caché semántico de `lookup_project_info` que se invalida cuando cambia el índice.
+
+    Cada `SEMANTIC_CACHE_KB_CHECK_SECONDS` compara la versión del índice (la que
+    publica `ingest.py` en Pinecone, hash de los ids en el índice local) con la de
+    la última revisión.
+    """
+
+    def __init__(self, intervalo_revision: float, **kwargs):
+        super().__init__(**kwargs)
+        self.intervalo_revision = intervalo_revision
+        self._version_base = None
+        self._ultima_revision = 0.0
+
+    def verificar_base_conocimiento(self) -> None:
+        ahora = time.monotonic()
+        if ahora - self._ultima_revision < self.intervalo_revision:
+            return
+        self._ultima_revision = ahora
+        try:
+            version = get_retriever().version()
+        except Exception as e:
+            logger.info(f"No se pudo revisar la versión de la base de conocimiento: {e}")
+            return
+        if self._version_base is not None and version != self._version_base:
+            self.invalidar()
+        self._version_base = version
+
+    def version_base_conocimiento(self) -> str:
+        """Versión de la base de conocimiento en la última revisión; también forma parte de la clave del caché de respuestas."""
+        self.verificar_base_conocimiento()
+        return str(self._version_base)
+
+
+def get_cache_semantico() -> CacheConsultas:
+    # Cada tenant tiene su base de conocimiento: las respuestas no se comparten entre tenants
+    return recurso_tenant("cache_semantico", lambda tenant: CacheConsultas(
+        intervalo_revision=float(os.getenv("SEMANTIC_CACHE_KB_CHECK_SECONDS", "300")),
+        max_entradas=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512")),
+        ttl=float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400")),
+        umbral=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+    ))
+
+def _prompt_consulta(query: str, docs) -> str:
+    relevant_texts = [doc.page_content for doc in docs]
+    return f"""
+        Aquí tienes información extraída de un proyecto:
+
+        {''.join(relevant_texts)}
+
+        Basado en la consulta: "{query}"
+        proporciona una respuesta clara
+    """
+
+def _lookup_project_info(query: str) -> str:
     """
     Consulta información general sobre la compañia Spark basada en atributos específicos desde un índice Pinecone.
     Args:
@@ -25,25 +136,64 @@ def lookup_project_info(query: str) -> str:
         lookup_project_info(query="Cuéntame sobre las metas del proyecto")
         lookup_project_info(query="que productos tienen")
     """
-    from langchain_pinecone import PineconeVectorStore
-    load_dotenv()
-    index_name = os.getenv('INDEX_NAME')
-    embeddings = OpenAIEmbeddings()
-    vectorstore = PineconeVectorStore(index_name=index_name, embedding=embeddings)
-    docs = vectorstore.similarity_search(query, k=2)
-    llm = ChatOpenAI(model=os.getenv('GPT_MODEL'), max_tokens=180)
+    cache_semantico = get_cache_semantico()
+    cache_semantico.verificar_base_conocimiento()
+
+    respuesta = cache_semantico.buscar_exacta(query)
+    if respuesta is not None:
+        return respuesta
+
+    # El mismo embedding sirve para el caché por similitud y para la búsqueda en Pinecone
+    with span("external_call", service="openai", operation="embeddings"):
+        embedding = get_embeddings().embed_query(query)
+    respuesta = cache_semantico.buscar_similar(embedding)
+    if respuesta is not None:
+        return respuesta
+
+    docs = get_retriever().buscar(embedding, k=2)
+    response = get_llm_consulta().invoke(_prompt_consulta(query, docs))
+    cache_semantico.guardar(query, embedding, response.content)
+    return response.content
 
-    relevant_texts = [doc.page_content for doc in docs]
-    prompt = f"""
-        Aquí tienes información extraída de un proyecto:
+async def _alookup_project_info(query: str) -> str:
+    # Misma lógica que _lookup_project_info con los clientes asíncronos, para que el nodo
+    # de herramientas la ejecute en paralelo con otras llamadas sin ocupar un hilo
+    cache_semantico = get_cache_semantico()
+    await asyncio.to_thread(cache_semantico.verificar_base_conocimiento)
+
+    respuesta = cache_semantico.buscar_exacta(query)
+    if respuesta is not None:
+        return respuesta
+
+    with span("external_call", service="openai", operation="embeddings"):
+        embedding = await get_embeddings().aembed_query(query)
+    respuesta = cache_semantico.buscar_similar(embedding)
+    if respuesta is not None:
+        return respuesta
+
+    docs = await get_retriever().abuscar(embedding, k=2)
+    response = await get_llm_consulta().ainvoke(_prompt_consulta(query, docs))
+    cache_semantico.guardar(query, embedding, response.content)
+    return response.content
 
-        {''.join(relevant_texts)}
+lookup_project_info = StructuredTool.from_function(
+    func=_lookup_project_info,
+    coroutine=_alookup_project_info,
+    name="lookup_project_info",
+)
 
-        Basado en la consulta: "{query}"
-        proporciona una respuesta clara
+def datos_cita(codigo: str) -> Optional[dict]:
     """
-    response = llm.invoke(prompt)
-    return response.content
+    Busca una cita por código en la hoja, incluidas las mutaciones pendientes del diario.
+
+    Returns:
+        Optional[dict]: Encabezado -> valor de la cita, o None si no existe.
+    """
+    row_data = get_diario_citas().cita(codigo)
+    if row_data is None:
+        return None
+    headers = get_indice_citas(get_tenant().sheet_id).encabezados
+    return {headers[i]: row_data[i] if i < len(row_data) else "" for i in range(len(headers))}
 
 @tool("validate_date")
 def validate_date(mes: int, dia: int) -> str:
@@ -62,24 +212,75 @@ def validate_date(mes: int, dia: int) -> str:
         validate_date(mes=2, dia=30)
     """
     try:
-        actual_date = get_colombia_time()
-        anio = actual_date.year
-        user_date = datetime(anio, mes, dia)
-        if actual_date.month > user_date.month or (actual_date.month == user_date.month and actual_date.day > user_date.day):
-            anio += 1
-        fecha_input = datetime(anio, mes, dia)
-        three_months_ahead = actual_date + timedelta(days=90)
-        
-        if fecha_input <= actual_date or fecha_input > three_months_ahead:
-            return "la fecha ya paso"
-        
-        if fecha_input.weekday() >= 1 and fecha_input.weekday() <= 6:
-            return "La fecha es válida."
-        else:
-            return "La fecha debe ser entre lunes y sabado."
+        hoy = get_colombia_time().date()
+        fecha_input = date(hoy.year, mes, dia)
+        # Solo una fecha anterior a hoy se refiere al año siguiente; hoy no se puede agendar
+        if fecha_input < hoy:
+            fecha_input = date(hoy.year + 1, mes, dia)
     except ValueError:
         return "La fecha no existe."
 
+    error = get_calendario(hoy).validar(fecha_input)
+    return error or "La fecha es válida."
+
+@tool("consultar_disponibilidad")
+def consultar_disponibilidad(fecha_inicio: str, fecha_fin: str = None) -> str:
+    """
+    Consulta los horarios libres para agendar una cita en un día o en un rango de días.
+    Úsala antes de agendar o modificar una cita para ofrecer horarios disponibles.
+
+    Args:
+        fecha_inicio (str): Fecha inicial en formato YYYY-MM-DD.
+        fecha_fin (str, optional): Fecha final en formato YYYY-MM-DD. Si no se indica, solo se consulta fecha_inicio.
+
+    Returns:
+        str: Los horarios libres (HH:MM:SS) de cada día hábil del rango.
+
+    Ejemplo de uso:
+        consultar_disponibilidad(fecha_inicio="2024-12-02")
+        consultar_disponibilidad(fecha_inicio="2024-12-02", fecha_fin="2024-12-07")
+    """
+    try:
+        desde = parsear_fecha(fecha_inicio)
+        hasta = parsear_fecha(fecha_fin) if fecha_fin else desde
+    except ValueError as e:
+        return f"Error: {e}. Usa el formato YYYY-MM-DD."
+    if hasta < desde:
+        desde, hasta = hasta, desde
+
+    calendario = get_calendario(get_colombia_time().date())
+    if desde == hasta:
+        error = calendario.validar(desde)
+        if error:
+            return error
+    dias = calendario.rango(desde, hasta)[:DISPONIBILIDAD_MAX_DIAS]
+    if not dias:
+        return "No hay días hábiles para agendar en ese rango."
+
+    lineas = []
+    for dia, libres in horarios_libres(dias).items():
+        lineas.append(f"{dia.isoformat()}: {', '.join(libres) if libres else 'sin horarios libres'}")
+    return "Horarios disponibles:\n" + "\n".join(lineas)
+
+def horarios_libres(dias: List[date]) -> Dict[date, List[str]]:
+    """
+    Horarios libres de cada día: el calendario de citas menos las citas agendadas en la hoja.
+
+    Args:
+        dias (List[date]): Días a consultar.
+
+    Returns:
+        Dict[date, List[str]]: Día -> horas libres en formato HH:MM:SS.
+    """
+    calendario = get_calendario(get_colombia_time().date())
+    indice = get_indice_citas(get_tenant().sheet_id)
+    try:
+        indice.sincronizar(get_google_sheets_service().spreadsheets())
+    except Exception as e:
+        raise RuntimeError(f"Error al consultar la disponibilidad: {e}")
+    diario = get_diario_citas()
+    return {dia: calendario.libres(dia, diario.horas_ocupadas(dia.strftime(FORMATO_FECHA))) for dia in dias}
+
 @tool("get_next_day")
 def next_day_of_week(start_date: str, weekday: str) -> str:
     """
@@ -118,6 +319,37 @@ def next_day_of_week(start_date: str, weekday: str) -> str:
     next_date = date + timedelta(days=delta_days)
     return next_date.strftime("%d/%m/%Y")
 
+_NOMBRES_DIAS = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+
+@tool("resolver_fechas")
+def resolver_fechas_relativas(expresion: str) -> str:
+    """
+    Convierte en fechas concretas lo que dice el usuario ("el próximo martes", "pasado mañana",
+    "el lunes y el miércoles de la próxima semana", "en 3 días", "el 15", "25 de diciembre")
+    e indica si en cada una se puede agendar. Úsala en lugar de get_next_day y validate_date:
+    una sola llamada resuelve y valida todas las fechas de la expresión.
+
+    Args:
+        expresion (str): Las fechas tal como las escribió el usuario; puede incluir varias.
+
+    Returns:
+        str: Una línea por fecha con el formato YYYY-MM-DD, el día de la semana y si es válida o el motivo por el que no.
+
+    Ejemplo de uso:
+        resolver_fechas_relativas(expresion="el próximo martes")
+        resolver_fechas_relativas(expresion="pasado mañana o el viernes")
+    """
+    calendario = get_calendario(get_colombia_time().date())
+    fechas = resolver_fechas(expresion, calendario)
+    if not fechas:
+        return "No se reconoció ninguna fecha. Pide al usuario la fecha exacta (día y mes)."
+    lineas = []
+    for fragmento, fecha in fechas:
+        error = calendario.validar(fecha)
+        estado = f"no válida: {error}" if error else "válida"
+        lineas.append(f"{fragmento}: {fecha.isoformat()} ({_NOMBRES_DIAS[fecha.weekday()]}) - {estado}")
+    return f"Hoy es {calendario.hoy.isoformat()} ({_NOMBRES_DIAS[calendario.hoy.weekday()]}).\n" + "\n".join(lineas)
+
 @tool("write_to_sheet_with_validation")
 def write_to_sheet_with_validation(cadena: str) -> str:
     """
@@ -132,7 +364,7 @@ def write_to_sheet_with_validation(cadena: str) -> str:
         str: Mensaje indicando el resultado de la operación.
     """
     load_dotenv()
-    sheet_id=os.getenv("SHEET_ID")
+    sheet_id=get_tenant().sheet_id
     service = get_google_sheets_service()
     sheet = service.spreadsheets()
 
@@ -146,53 +378,38 @@ def write_to_sheet_with_validation(cadena: str) -> str:
         if not fecha_persona or not hora_persona:
             return "Error: La fecha o la hora no están definidas en los datos proporcionados."
 
-        # Obtener los encabezados de la hoja
-        headers = sheet.values().get(spreadsheetId=sheet_id, range='A:Z').execute().get('values', [])[0]
+        indice = get_indice_citas(sheet_id)
+        indice.sincronizar(sheet)
+        diario = get_diario_citas()
 
-        if "Fecha" not in headers or "Hora" not in headers:
+        if not indice.tiene_fecha_y_hora:
             return "Problemas en el Excel de citas: faltan los encabezados 'Fecha' o 'Hora'."
 
-        # Identificar las columnas de Fecha y Hora
-        fecha_col = chr(headers.index("Fecha") + ord('A'))
-        hora_col = chr(headers.index("Hora") + ord('A'))
-        data_range = f"{fecha_col}:{hora_col}"
-
-        # Leer los datos dentro del rango dinámico
-        rows = sheet.values().get(spreadsheetId=sheet_id, range=data_range).execute().get('values', [])
-
-        if len(rows) == 1:  # Solo contiene los encabezados
-            persona["codigo"] = generar_codigo_cita(persona.get("nombre"))
-            save_values = [list(persona.values())]
-            sheet.values().append(
-                spreadsheetId=sheet_id,
-                range='A:Z',
-                valueInputOption='RAW',
-                insertDataOption='INSERT_ROWS',
-                body={'values': save_values}
-            ).execute()
-            return "Guardado exitoso"
-
-        # Validar conflictos de horario
-        conflict="Horarios ocupados:"
-        for row in rows[1:]:
-            if len(row) > 1:  # Asegurarse de que la fila tenga datos en ambas columnas
-                if row[0] == fecha_persona and row[1] == hora_persona:
-                    for row in rows[1:]:
-                        if len(row) > 1:
-                            if row[0] == fecha_persona:
-                                conflict+=f"\n{row[1]}"
+        calendario = get_calendario(get_colombia_time().date())
+
+        # Solo una reserva a la vez por horario: la verificación y el registro en el diario
+        # no se intercalan con otra reserva que se cruce con esta (comparten al menos una
+        # franja), y horarios que no se cruzan no se esperan
+        try:
+            horarios = [(fecha_persona, franja) for franja in franjas_reserva(hora_persona)]
+            with reservar(get_reservas(), horarios=horarios, ambito=get_tenant().ambito) as reserva:
+                # Validar conflictos de horario, incluidas las citas aún no escritas en la hoja,
+                # con la misma regla de cruce que consultar_disponibilidad
+                ocupadas = diario.horas_ocupadas(fecha_persona)
+                if calendario.conflictos(hora_persona, ocupadas):
+                    conflict="Horarios ocupados:"
+                    for hora in ocupadas:
+                        conflict+=f"\n{hora}"
                     return conflict
 
-        # Guardar los datos si no hay conflictos
-        persona["codigo"] = generar_codigo_cita(persona.get("nombre"))
-        save_values = [list(persona.values())]
-        sheet.values().append(
-            spreadsheetId=sheet_id,
-            range='A:Z',
-            valueInputOption='RAW',
-            insertDataOption='INSERT_ROWS',
-            body={'values': save_values}
-        ).execute()
+                # Guardar los datos si no hay conflictos; el diario los escribe en la hoja en segundo plano
+                persona["codigo"] = generar_codigo_cita(persona.get("nombre"))
+                diario.registrar_alta(persona["codigo"], list(persona.values()))
+                reserva.confirmar()
+        except HorarioReservado:
+            return f"Horarios ocupados: otra persona está reservando las {hora_persona} del {fecha_persona} en este momento."
+        # Con reservas compartidas, el horario sigue reservado hasta que la cita esté en la hoja
+        diario.al_escribir(persona["codigo"], reserva.escrita)
         return f"Guardado exitoso. Código generado: {persona.get('codigo')}"
 
     except ValidationError as ve:
@@ -212,38 +429,20 @@ def erase_from_sheet(codigo: str) -> str:
         str: Mensaje indicando el resultado de la operación.
     """
     load_dotenv()
-    sheet_id=os.getenv("SHEET_ID")
-    service = get_google_sheets_service()
-    sheet = service.spreadsheets()
 
     try:
-        # Buscar la fila correspondiente al código
-        fila = buscar_fila(codigo)
-
-        if fila == -1:
-            return "No se encontró la cita con el código especificado."
-
-        # Eliminar la fila encontrada
-        sheet.batchUpdate(
-            spreadsheetId=sheet_id,
-            body={
-                'requests': [
-                    {
-                        'deleteDimension': {
-                            'range': {
-                                'sheetId': 0,  # Suponiendo que es la primera hoja
-                                'dimension': 'ROWS',
-                                'startIndex': fila,
-                                'endIndex': fila + 1
-                            }
-                        }
-                    }
-                ]
-            }
-        ).execute()
+        diario = get_diario_citas()
+        with reservar(get_reservas(), citas=[codigo], espera=RESERVA_ESPERA_SECONDS, ambito=get_tenant().ambito):
+            if diario.cita(codigo) is None:
+                return "No se encontró la cita con el código especificado."
+
+            # La fila se elimina de la hoja en el próximo lote del diario
+            diario.registrar_baja(codigo)
 
         return "Cita borrada exitosamente."
 
+    except HorarioReservado:
+        return "La cita se está modificando en este momento, intenta de nuevo en unos segundos."
     except Exception as e:
         raise RuntimeError(f"Error al borrar la cita: {e}")
 
@@ -264,60 +463,71 @@ def modify_sheet(codigo: str, hora: str = None, fecha: str = None, modalidad: st
     Ejemplo de uso:("JUA-b2295cec",None,None,"Presencial")
     """
     load_dotenv()
-    sheet_id=os.getenv("SHEET_ID")
+    # Fecha y hora se guardan en el formato de la hoja (DD/MM/YYYY y HH:MM:SS), el mismo
+    # con el que el diario y las reservas comparan los horarios
+    try:
+        if fecha:
+            dia = parsear_fecha(fecha)
+            error = get_calendario(get_colombia_time().date()).validar(dia)
+            if error:
+                return error
+            fecha = dia.strftime(FORMATO_FECHA)
+        if hora:
+            hora = parsear_hora(hora)
+    except ValueError as e:
+        return f"Error: {e}. Usa los formatos YYYY-MM-DD y HH:MM:SS."
+
+    sheet_id=get_tenant().sheet_id
     service = get_google_sheets_service()
     sheet = service.spreadsheets()
 
     try:
-        # Buscar la fila correspondiente al código
-        fila = buscar_fila(codigo)
-
-        if fila == -1:
-            return "No se encontró la cita con el código especificado."
-
-        # Leer los encabezados
-        headers = sheet.values().get(spreadsheetId=sheet_id, range='A:Z').execute().get('values', [])[0]
-
-        # Leer la fila específica
-        row_data = sheet.values().get(
-            spreadsheetId=sheet_id,
-            range=f"A{fila + 1}:Z{fila + 1}"
-        ).execute().get('values', [[]])[0]
-
-        # Crear un diccionario con los datos actuales
-        cita = {headers[i]: row_data[i] for i in range(len(headers))}
-
-        # Actualizar solo los campos proporcionados
-        if fecha:
-            cita["Fecha"] = fecha
-        if hora:
-            cita["Hora"] = hora
-        if modalidad:
-            cita["Modalidad"] = modalidad
-        
-        if(fecha or hora):
-            fecha_col = chr(headers.index("Fecha") + ord('A'))
-            hora_col = chr(headers.index("Hora") + ord('A'))
-            data_range = f"{fecha_col}:{hora_col}"
-            # Leer los datos dentro del rango dinámico
-            rows = sheet.values().get(spreadsheetId=sheet_id, range=data_range).execute().get('values', [])
-            for row in rows[1:]:
-                if len(row) > 1:  # Asegurarse de que la fila tenga datos en ambas columnas
-                    if row[0] == cita["Fecha"] and row[1] == cita["Hora"]:
-                        return f"Horarios ocupados: {rows[1:]}"
-
-        # Preparar los datos actualizados para escribir
-        updated_row = [cita.get(header, "") for header in headers]
-
-        # Escribir los datos actualizados en la hoja
-        sheet.values().update(
-            spreadsheetId=sheet_id,
-            range=f"A{fila + 1}:Z{fila + 1}",
-            valueInputOption='RAW',
-            body={"values": [updated_row]}
-        ).execute()
+        diario = get_diario_citas()
+        indice = get_indice_citas(sheet_id)
+        if fecha or hora:
+            indice.sincronizar(sheet)
+
+        with reservar(get_reservas(), citas=[codigo], espera=RESERVA_ESPERA_SECONDS, ambito=get_tenant().ambito):
+            # Datos vigentes de la cita, incluidas las modificaciones aún no escritas en la hoja
+            row_data = diario.cita(codigo)
+
+            if row_data is None:
+                return "No se encontró la cita con el código especificado."
+
+            headers = indice.encabezados
+
+            # Crear un diccionario con los datos actuales
+            cita = {headers[i]: row_data[i] if i < len(row_data) else "" for i in range(len(headers))}
+
+            # Actualizar solo los campos proporcionados
+            if fecha:
+                cita["Fecha"] = fecha
+            if hora:
+                cita["Hora"] = hora
+            if modalidad:
+                cita["Modalidad"] = modalidad
+
+            # Preparar los datos actualizados; el diario los escribe en la hoja en segundo plano
+            updated_row = [cita.get(header, "") for header in headers]
+
+            if not (fecha or hora):
+                diario.registrar_modificacion(codigo, updated_row)
+                return "Cita modificada exitosamente."
+
+            # El nuevo horario se reserva igual que en una cita nueva
+            horarios = [(cita.get("Fecha"), franja) for franja in franjas_reserva(cita.get("Hora"))]
+            with reservar(get_reservas(), horarios=horarios, ambito=get_tenant().ambito) as reserva:
+                # La propia cita no cuenta como conflicto
+                ocupadas = [h for h, ocupante in diario.citas_en_fecha(cita.get("Fecha")) if ocupante != codigo]
+                if get_calendario(get_colombia_time().date()).conflictos(cita.get("Hora"), ocupadas):
+                    return f"Horarios ocupados: {diario.horas_ocupadas(cita.get('Fecha'))}"
+                diario.registrar_modificacion(codigo, updated_row)
+                reserva.confirmar()
+            diario.al_escribir(codigo, reserva.escrita)
 
         return "Cita modificada exitosamente."
 
+    except HorarioReservado:
+        return "Horarios ocupados: otra persona está reservando ese horario o modificando la cita en este momento."
     except Exception as e:
         raise RuntimeError(f"Error al modificar la cita: {e}")
\ No newline at end of file
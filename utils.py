@@ -1,15 +1,17 @@
 # Standard library import
 import uuid
-from googleapiclient.discovery import build
-from botocore.exceptions import ClientError
-from google.oauth2 import service_account
-from twilio.rest import Client
+from sheet_index import get_indice_citas
+from tenants import get_tenant
+from observability import instrumentar_boto3, span, trazar
+from functools import lru_cache
 from dotenv import load_dotenv
 from datetime import datetime
+from typing import List, Tuple
+import threading
 import logging
-import boto3
 import json
 import pytz
+import time
 import re
 import os
 
@@ -23,40 +25,59 @@ load_dotenv()
 account_sid = os.getenv("TWILIO_ACCOUNT_SID")
 auth_token = os.getenv("TWILIO_AUTH_TOKEN")
 twilio_number = os.getenv('TWILIO_NUMBER')
-client = Client(account_sid, auth_token)
+
+# Un único pool de conexiones HTTP compartido por todos los envíos.
+# El cliente se crea en el primer envío para no cargar Twilio durante el arranque.
+@lru_cache(maxsize=None)
+def get_twilio_client():
+    from twilio.http.http_client import TwilioHttpClient
+    from requests.adapters import HTTPAdapter
+    from twilio.rest import Client
+    twilio_http_client = TwilioHttpClient(pool_connections=True, timeout=float(os.getenv("TWILIO_HTTP_TIMEOUT_SECONDS", "15")))
+    twilio_http_client.session.mount("https://", HTTPAdapter(pool_maxsize=int(os.getenv("DISPATCH_WORKERS", "8"))))
+    return Client(account_sid, auth_token, http_client=twilio_http_client)
 
 # Set up logging
 
+@trazar("external_call", service="twilio", operation="messages.create")
+def enviar_mensaje_twilio(to_number, body_text, media_url=None, from_number=None):
+    # Igual que send_message, pero propaga los errores para que el llamador decida si reintentar.
+    # from_number es el número del tenant que responde; por defecto, TWILIO_NUMBER
+    from_number = from_number or twilio_number
+    if media_url:
+        logger.debug("Enviando imagen: %s", media_url)
+        message = get_twilio_client().messages.create(   
+            from_=f"whatsapp:{from_number}",
+            media_url=[media_url],
+            body=body_text,
+            to=f"whatsapp:{to_number}"
+            )
+    else:
+        logger.debug("%s Enviando mensaje sin imagen", from_number)
+        message = get_twilio_client().messages.create(   
+            from_=f"whatsapp:{from_number}",
+            body=body_text,
+            to=f"whatsapp:{to_number}"
+            )
+    logger.debug("Message sent to %s: %s", to_number, message.body)
+    return message
+
 # Sending message logic through Twilio Messaging API
 def send_message(to_number, body_text, media_url=None):
     try:
-        if media_url:
-            logger.info(media_url)
-            message = client.messages.create(   
-                from_=f"whatsapp:{twilio_number}",
-                media_url=[media_url],
-                body=body_text,
-                to=f"whatsapp:{to_number}"
-                )
-        else:
-            logger.info(f"{twilio_number} Enviando mensaje sin imagen")
-            message = client.messages.create(   
-                from_=f"whatsapp:{twilio_number}",
-                body=body_text,
-                to=f"whatsapp:{to_number}"
-                )
-        logger.info(f"Message sent to {to_number}: {message.body}")
+        enviar_mensaje_twilio(to_number, body_text, media_url)
     except Exception as e:
         logger.error(f"Error sending message to {to_number}: {e}")
 
 
+# Expresión regular para encontrar URLs de imágenes en el mensaje
+IMAGEN_PATTERN = re.compile(r"\[Imagen: (https?://[^\s]+)\]")
+
 def split_text_and_images(text):
-    # Expresión regular para encontrar URLs de imágenes en el mensaje
-    url_pattern = r"\[Imagen: (https?://[^\s]+)\]"
     # Extraer todas las URLs de imágenes
-    urls = re.findall(url_pattern, text)
+    urls = IMAGEN_PATTERN.findall(text)
     # Eliminar las URLs de imágenes del mensaje original
-    clean_text = re.sub(url_pattern, "", text).strip()
+    clean_text = IMAGEN_PATTERN.sub("", text).strip()
     return clean_text, urls
 
 # Función para dividir el mensaje y enviar imágenes por separado eliminando la URL
@@ -82,22 +103,62 @@ def send_message_with_images(to_number, message_text):
     for url in urls:
         send_message(to_number, "", media_url=url)
 
+PROMPT_CACHE_DIR = os.getenv("PROMPT_CACHE_DIR", "/tmp/prompt_cache")
+
 def get_prompts()-> str:
+    # El prompt se guarda en disco junto a su ETag; S3 solo lo vuelve a enviar si cambió.
+    # Cada tenant tiene su propio archivo (por defecto PROMPT_BUCKET_NAME/NAME_FILE)
+    import boto3
+    from botocore.exceptions import ClientError
+    instrumentar_boto3()
     s3 = boto3.client('s3')
-    bucket_name=os.getenv('PROMPT_BUCKET_NAME')
+    tenant = get_tenant()
+    bucket_name=tenant.prompt_bucket or os.getenv('PROMPT_BUCKET_NAME')
+    file_name=tenant.prompt_file or os.getenv('NAME_FILE')
+    cache_path = os.path.join(PROMPT_CACHE_DIR, f"{bucket_name}_{file_name}".replace("/", "_"))
+    cached = None
+    etag = None
+    if os.path.exists(cache_path) and os.path.exists(cache_path + ".etag"):
+        with open(cache_path, encoding='utf-8') as f:
+            cached = f.read()
+        with open(cache_path + ".etag", encoding='utf-8') as f:
+            etag = f.read()
+
     try:
-        response = s3.get_object(Bucket=bucket_name, Key=os.getenv('NAME_FILE'))
+        kwargs = {"IfNoneMatch": etag} if etag else {}
+        response = s3.get_object(Bucket=bucket_name, Key=file_name, **kwargs)
         content = response['Body'].read().decode('utf-8')
+        try:
+            os.makedirs(PROMPT_CACHE_DIR, exist_ok=True)
+            with open(cache_path, "w", encoding='utf-8') as f:
+                f.write(content)
+            with open(cache_path + ".etag", "w", encoding='utf-8') as f:
+                f.write(response['ETag'])
+        except OSError as e:
+            logger.info(f"No se pudo guardar el prompt en caché: {e}")
+        return content
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+            logger.info("Prompt sin cambios, se usa la copia en disco")
+            return cached
+        logger.info(f"Error al leer el archivo: {e}")
     except Exception as e:
         logger.info(f"Error al leer el archivo: {e}")
-    return content
+
+    if cached is None:
+        raise RuntimeError("No se pudo obtener el prompt.")
+    logger.info("Se usa la última copia del prompt guardada en disco")
+    return cached
 
 def get_secret() -> str:
+    import boto3
+    from botocore.exceptions import ClientError
     secret_name = os.getenv("SECRET")
     region_name = os.getenv("REGION")
 
-    session = boto3.session.Session()
-    client = session.client(service_name='secretsmanager', region_name=region_name)
+    # La sesión por defecto lleva los eventos que miden cada llamada
+    instrumentar_boto3()
+    client = boto3.client(service_name='secretsmanager', region_name=region_name)
 
     try:
         response = client.get_secret_value(SecretId=secret_name)
@@ -107,14 +168,80 @@ def get_secret() -> str:
         logger.info(f"Error al obtener el secreto: {e}")
         raise RuntimeError("No se pudo obtener el secreto.") from e
 
+class ClienteGoogleSheets:
+    """
+    Mantiene un único cliente de Google Sheets por proceso.
+
+    El secreto y el documento de discovery se cargan una sola vez y se renuevan
+    al vencer el TTL; el token de acceso se refresca automáticamente al expirar.
+    httplib2 no es seguro entre hilos, así que cada hilo reutiliza su propia
+    conexión autorizada (keep-alive) en lugar de compartir una.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._service = None
+        self._credentials = None
+        self._creado = 0.0
+
+    def service(self) -> object:
+        with self._lock:
+            if self._service is None or time.monotonic() - self._creado > self.ttl:
+                self._construir()
+            return self._service
+
+    def invalidar(self) -> None:
+        with self._lock:
+            self._service = None
+
+    def _construir(self) -> None:
+        from googleapiclient.discovery import build
+        from google.oauth2 import service_account
+        key_dict = json.loads(get_secret())
+        scopes = [os.getenv("GOOGLE_SCOPES")]
+        self._credentials = service_account.Credentials.from_service_account_info(key_dict, scopes=scopes)
+        self._local = threading.local()
+        self._service = build(
+            'sheets', 'v4',
+            http=self._http(),
+            requestBuilder=self._build_request,
+            cache_discovery=False
+        )
+        self._creado = time.monotonic()
+        logger.info("Cliente de Google Sheets inicializado")
+
+    def _http(self):
+        from google_auth_httplib2 import AuthorizedHttp
+        import httplib2
+        local = self._local
+        http = getattr(local, "http", None)
+        if http is None:
+            http = local.http = AuthorizedHttp(self._credentials, http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT))
+        return http
+
+    def _build_request(self, http, *args, **kwargs):
+        from googleapiclient.http import HttpRequest
+        # Ignora el http compartido y usa la conexión del hilo actual
+        request = HttpRequest(self._http(), *args, **kwargs)
+        execute = request.execute
+
+        def execute_medido(*a, **k):
+            with span("external_call", service="sheets", operation=request.methodId or "desconocida"):
+                return execute(*a, **k)
+
+        request.execute = execute_medido
+        return request
+
+
+SHEETS_CLIENT_TTL = float(os.getenv("SHEETS_CLIENT_TTL_SECONDS", "3300"))
+SHEETS_HTTP_TIMEOUT = float(os.getenv("SHEETS_HTTP_TIMEOUT_SECONDS", "30"))
+sheets_client = ClienteGoogleSheets(ttl=SHEETS_CLIENT_TTL)
+
 def get_google_sheets_service() -> object:
     try:
-        secret_key = get_secret()
-        key_dict = json.loads(secret_key)
-        scopes = [os.getenv("GOOGLE_SCOPES")]
-        credentials = service_account.Credentials.from_service_account_info(key_dict, scopes=scopes)
-        service = build('sheets', 'v4', credentials=credentials, cache_discovery=False)
-        return service
+        return sheets_client.service()
     except Exception as e:
         raise RuntimeError(f"Error al configurar el cliente de Google Sheets: {e}")
 
@@ -128,18 +255,17 @@ def generar_codigo_cita(nombre_paciente):
     return codigo_cita
 
 def buscar_fila(codigo: str) -> int:
-    sheet_id=os.getenv("SHEET_ID")
-    service = get_google_sheets_service()
-    sheet = service.spreadsheets()
+    sheet_id=get_tenant().sheet_id
+    indice = get_indice_citas(sheet_id)
 
     try:
-        rows = sheet.values().get(spreadsheetId=sheet_id, range='A:A').execute().get('values', [])
-
-        for i, row in enumerate(rows):
-            if row and row[0] == codigo:
-                return i
-
-        return -1
+        fila = indice.buscar_codigo(codigo)
+        if fila == -1:
+            # El código pudo haberse creado desde otro proceso: trae solo las filas nuevas
+            service = get_google_sheets_service()
+            indice.sincronizar(service.spreadsheets(), forzar=True)
+            fila = indice.buscar_codigo(codigo)
+        return fila
     except Exception as e:
         raise RuntimeError(f"Error al buscar el código: {e}")
     
@@ -149,4 +275,88 @@ def split_text(text):
     for i in range(0, len(paragraphs), 2):
         segment = '\n\n'.join(paragraphs[i:i+2])
         result.append(segment)
-    return result
\ No newline at end of file
+    return result
+
+class DivisorIncremental:
+    """
+    Divide una respuesta que llega por fragmentos en los mismos mensajes que
+    `split_text_and_images` + `split_text` producirían con el texto completo.
+
+    `agregar` devuelve los envíos que ya son definitivos: cada par de párrafos
+    en cuanto se cierra y las imágenes `[Imagen: ...]` después del segmento de
+    texto en el que aparecen, para respetar el orden en que se generaron.
+    `finalizar` devuelve lo que queda al terminar la respuesta.
+
+    Cada envío es una tupla ("texto", contenido) o ("imagen", url).
+    """
+
+    _PREFIJOS_IMAGEN = ("[Imagen: http://", "[Imagen: https://")
+
+    def __init__(self):
+        self._crudo = ""
+        self._segmento = ""
+        self._imagenes: List[str] = []
+        self._iniciado = False
+
+    def agregar(self, fragmento: str) -> List[Tuple[str, str]]:
+        self._crudo += fragmento
+        corte = self._etiqueta_abierta()
+        estable, self._crudo = self._crudo[:corte], self._crudo[corte:]
+        return self._procesar(estable)
+
+    def finalizar(self) -> List[Tuple[str, str]]:
+        envios = self._procesar(self._crudo)
+        # split_text_and_images quita los espacios finales del texto limpio
+        segmento = self._segmento.rstrip()
+        if segmento:
+            envios.extend(("texto", parte) for parte in split_text(segmento))
+        envios.extend(("imagen", url) for url in self._imagenes)
+        self._crudo, self._segmento, self._imagenes = "", "", []
+        return envios
+
+    def _etiqueta_abierta(self) -> int:
+        """Posición de la primera etiqueta de imagen que aún puede cambiar, o el final del texto."""
+        inicio = 0
+        while True:
+            i = self._crudo.find("[", inicio)
+            if i == -1:
+                return len(self._crudo)
+            candidato = self._crudo[i:]
+            for prefijo in self._PREFIJOS_IMAGEN:
+                if prefijo.startswith(candidato):
+                    return i
+                # La URL termina en el primer espacio: hasta verlo, la etiqueta puede crecer
+                if candidato.startswith(prefijo) and not re.search(r"\s", candidato[len(prefijo):]):
+                    return i
+            inicio = i + 1
+
+    def _procesar(self, texto: str) -> List[Tuple[str, str]]:
+        envios: List[Tuple[str, str]] = []
+        posicion = 0
+        for match in IMAGEN_PATTERN.finditer(texto):
+            envios.extend(self._agregar_texto(texto[posicion:match.start()]))
+            self._imagenes.append(match.group(1))
+            posicion = match.end()
+        envios.extend(self._agregar_texto(texto[posicion:]))
+        return envios
+
+    def _agregar_texto(self, texto: str) -> List[Tuple[str, str]]:
+        if not self._iniciado:
+            # split_text_and_images también quita los espacios iniciales
+            texto = texto.lstrip()
+            if not texto:
+                return []
+            self._iniciado = True
+        envios: List[Tuple[str, str]] = []
+        self._segmento += texto
+        while True:
+            # split_text agrupa los párrafos de a dos: un segmento se cierra en el
+            # separador que sigue a su segundo párrafo, siempre que después venga texto
+            # (si solo vienen espacios, el strip final lo eliminaría)
+            primero = self._segmento.find("\n\n")
+            corte = self._segmento.find("\n\n", primero + 2) if primero != -1 else -1
+            if corte == -1 or not self._segmento[corte + 2:].strip():
+                return envios
+            envios.append(("texto", self._segmento[:corte]))
+            envios.extend(("imagen", url) for url in self._imagenes)
+            self._segmento, self._imagenes = self._segmento[corte + 2:], []
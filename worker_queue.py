@@ -0,0 +1,123 @@
+from typing import Any, Callable, Deque, Dict, List, Optional
+from collections import deque
+import threading
+import logging
+import queue
+import time
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ColaPorClave:
+    """
+    Pool de hilos que procesa trabajos en orden estricto por clave.
+
+    Los trabajos con la misma clave (p. ej. un número de WhatsApp) se ejecutan
+    uno detrás de otro, mientras que claves distintas avanzan en paralelo.
+    Una clave solo está en la cola de listas una vez: cuando un worker termina
+    un trabajo, la clave vuelve al final si aún tiene pendientes, lo que reparte
+    los workers de forma justa entre claves.
+    """
+
+    def __init__(self, nombre: str, manejador: Callable[[str, Any], None], workers: int):
+        self.nombre = nombre
+        self._manejador = manejador
+        self._num_workers = max(workers, 1)
+        self._lock = threading.Lock()
+        self._vacia = threading.Condition(self._lock)
+        self._pendientes: Dict[str, Deque[Any]] = {}
+        self._listas: "queue.Queue[Any]" = queue.Queue()
+        self._hilos: List[threading.Thread] = []
+        self._profundidad = 0
+        self._metricas: Dict[str, Dict[str, float]] = {}
+
+    def encolar(self, clave: str, trabajo: Any) -> int:
+        """
+        Agrega un trabajo para la clave indicada.
+
+        Returns:
+            int: Número de trabajos pendientes en la cola tras encolar.
+        """
+        with self._lock:
+            if not self._hilos:
+                self._iniciar()
+            pendientes = self._pendientes.get(clave)
+            if pendientes is None:
+                self._pendientes[clave] = deque([trabajo])
+                self._listas.put(clave)
+            else:
+                pendientes.append(trabajo)
+            self._profundidad += 1
+            return self._profundidad
+
+    def esperar_vacia(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera a que no queden trabajos pendientes ni en ejecución.
+
+        Returns:
+            bool: False si se agotó el tiempo de espera.
+        """
+        with self._vacia:
+            return self._vacia.wait_for(lambda: not self._pendientes, timeout)
+
+    def detener(self) -> None:
+        """Detiene los workers después de que terminen su trabajo actual."""
+        with self._lock:
+            hilos, self._hilos = self._hilos, []
+        for _ in hilos:
+            self._listas.put(None)
+        for hilo in hilos:
+            hilo.join()
+
+    def estadisticas(self) -> dict:
+        """Profundidad de la cola y latencia por worker."""
+        with self._lock:
+            return {
+                "profundidad": self._profundidad,
+                "claves_pendientes": len(self._pendientes),
+                "workers": {nombre: dict(m) for nombre, m in self._metricas.items()},
+            }
+
+    def _iniciar(self) -> None:
+        for i in range(self._num_workers):
+            nombre = f"{self.nombre}-{i}"
+            self._metricas[nombre] = {"procesados": 0, "errores": 0, "ultimo_s": 0.0, "promedio_s": 0.0, "maximo_s": 0.0}
+            hilo = threading.Thread(target=self._trabajar, args=(nombre,), name=nombre, daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+        logger.info(f"Cola '{self.nombre}' iniciada con {self._num_workers} workers")
+
+    def _trabajar(self, nombre: str) -> None:
+        while True:
+            clave = self._listas.get()
+            if clave is None:
+                return
+            with self._lock:
+                trabajo = self._pendientes[clave].popleft()
+                self._profundidad -= 1
+
+            inicio = time.perf_counter()
+            error = False
+            try:
+                self._manejador(clave, trabajo)
+            except Exception as e:
+                error = True
+                logger.error(f"Error procesando trabajo de {clave} en {nombre}: {e}")
+            duracion = time.perf_counter() - inicio
+
+            with self._lock:
+                metricas = self._metricas[nombre]
+                metricas["procesados"] += 1
+                metricas["errores"] += int(error)
+                metricas["ultimo_s"] = duracion
+                metricas["promedio_s"] += (duracion - metricas["promedio_s"]) / metricas["procesados"]
+                metricas["maximo_s"] = max(metricas["maximo_s"], duracion)
+
+                if self._pendientes[clave]:
+                    self._listas.put(clave)
+                else:
+                    del self._pendientes[clave]
+                    if not self._pendientes:
+                        self._vacia.notify_all()